@@ -548,6 +548,77 @@ class TestInitrdInject(TestBaseCommand):
         TestBaseCommand.run(self)
 
 
+class PerfTestCommand(Command):
+    description = ("Run the benchmarks in tests/benchmarks and compare "
+                   "them against a baseline")
+    user_options = [
+        ("baseline=", None, "Baseline JSON to compare against (default: "
+                            "tests/benchmarks/baseline.json)"),
+        ("update-baseline", None, "Save the results as the new baseline "
+                                  "instead of comparing"),
+        ("threshold=", None, "Allowed slowdown in percent (default: 25)"),
+        ("scale=", None, "Comma separated guest counts (default: 10,100)"),
+        ("repeat=", None, "Runs per benchmark (default: 5)"),
+        ("skipcli", None, "Don't time the clitest suite"),
+    ]
+
+    def initialize_options(self):
+        self.baseline = None
+        self.update_baseline = None
+        self.threshold = 25
+        self.scale = "10,100"
+        self.repeat = 5
+        self.skipcli = None
+
+    def finalize_options(self):
+        if not self.baseline:
+            self.baseline = os.path.join("tests", "benchmarks",
+                                         "baseline.json")
+        self.threshold = float(self.threshold)
+        self.scale = [int(s) for s in str(self.scale).split(",")]
+        self.repeat = int(self.repeat)
+
+    def run(self):
+        import json
+        from tests.benchmarks import bench
+
+        report = bench.run_all(self.scale, repeat=self.repeat)
+        if not self.skipcli:
+            report["extra"]["clitest"] = bench.time_clitest()
+        print bench.format_report(report)
+        print
+
+        if self.update_baseline:
+            f = file(self.baseline, "w")
+            try:
+                json.dump(report, f, indent=2, sort_keys=True)
+            finally:
+                f.close()
+            print "Saved baseline to %s" % self.baseline
+            return
+
+        if not os.path.exists(self.baseline):
+            print ("No baseline at %s, create one with "
+                   "--update-baseline" % self.baseline)
+            sys.exit(1)
+
+        f = file(self.baseline)
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+        regressions = bench.compare(baseline, report,
+                                    threshold=self.threshold / 100)
+        print "Compared against %s (commit %s)" % (self.baseline,
+                                                   baseline.get("commit"))
+        if regressions:
+            print "Performance regressions:"
+            for msg in regressions:
+                print "  %s" % msg
+            sys.exit(1)
+        print "No regressions over %d%%" % self.threshold
+
+
 class CheckPylint(Command):
     user_options = []
     description = "Check code using pylint and pep8"
@@ -638,5 +709,6 @@ setup(
         'test': TestCommand,
         'test_urls' : TestURLFetch,
         'test_initrd_inject' : TestInitrdInject,
+        'perftest' : PerfTestCommand,
     }
 )
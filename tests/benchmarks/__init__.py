@@ -0,0 +1,27 @@
+# Copyright (C) 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+
+"""
+Benchmarks of virtinst and virtManager hot paths, run against test
+driver XML with a configurable number of guests, disks, NICs, pools and
+volumes. Not part of the regular test suite, run it with:
+
+    python -m tests.benchmarks --scale 10,100,1000 --output results.json
+
+The JSON results record the git commit they were run against, so they
+can be kept around and compared with later runs.
+"""
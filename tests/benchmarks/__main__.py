@@ -0,0 +1,81 @@
+# Copyright (C) 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+
+import argparse
+import json
+import sys
+
+from tests.benchmarks import bench
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(prog="python -m tests.benchmarks")
+    parser.add_argument("--scale", default="10,100",
+        help="Comma separated guest counts to run at (default: %(default)s)")
+    parser.add_argument("--disks", type=int, default=2,
+        help="Disks per guest (default: %(default)s)")
+    parser.add_argument("--nics", type=int, default=2,
+        help="NICs per guest (default: %(default)s)")
+    parser.add_argument("--pools", type=int, default=None,
+        help="Storage pools (default: a tenth of the guest count)")
+    parser.add_argument("--vols", type=int, default=10,
+        help="Volumes per pool (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=5,
+        help="Runs per benchmark (default: %(default)s)")
+    parser.add_argument("--only",
+        help="Comma separated benchmarks to run, out of: %s" %
+             ", ".join(bench.get_names() + [bench.IMPORT_NAME]))
+    parser.add_argument("--output", metavar="FILE",
+        help="Save the results as JSON to FILE")
+    parser.add_argument("--compare", metavar="FILE",
+        help="Report regressions against results saved in FILE")
+    return parser.parse_args()
+
+
+def main():
+    options = _parse_args()
+    scales = [int(s) for s in options.scale.split(",")]
+    only = options.only and options.only.split(",") or None
+
+    report = bench.run_all(scales, repeat=options.repeat, only=only,
+                           disks=options.disks, nics=options.nics,
+                           pools=options.pools, vols=options.vols)
+
+    print bench.format_report(report)
+    if options.output:
+        f = file(options.output, "w")
+        try:
+            json.dump(report, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+        print "Results saved to %s" % options.output
+
+    if options.compare:
+        f = file(options.compare)
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+        regressions = bench.compare(baseline, report)
+        for msg in regressions:
+            print "Regression: %s" % msg
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
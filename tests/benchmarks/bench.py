@@ -0,0 +1,420 @@
+# Copyright (C) 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+
+"""
+The benchmarks themselves. Each one is a function taking a _Context
+and returning the callable to time, optionally paired with a callable
+to run untimed after every run.
+"""
+
+import gc
+import logging
+import os
+import StringIO
+import subprocess
+import sys
+import time
+import unittest
+
+import virtinst.cli
+from virtinst import Cloner
+from virtinst import Guest
+from virtinst import VirtualDisk
+from virtinst import VirtualNetworkInterface
+
+from tests.benchmarks import xmlgen
+
+_benchmarks = []
+
+
+class SkipBenchmark(Exception):
+    pass
+
+
+def _benchmark(name):
+    def wrap(func):
+        _benchmarks.append((name, func))
+        return func
+    return wrap
+
+
+def get_names():
+    return [b[0] for b in _benchmarks]
+
+
+class _Context(object):
+    """
+    A test driver connection over generated XML, shared by all the
+    benchmarks of one scale
+    """
+    def __init__(self, counts):
+        self.counts = counts
+        self.xmlpath = xmlgen.write_xml(counts)
+        self.uri = "test://%s" % self.xmlpath
+
+        self.conn = virtinst.cli.getConnection(self.uri)
+        # We want to time the fetching, not the cache
+        self.conn.cache_object_fetch = False
+        self.cleanups = []
+
+        self.guestxml = [self.conn.lookupByName(
+                            xmlgen.guest_name(idx)).XMLDesc(0)
+                         for idx in range(counts.guests)]
+
+    def close(self):
+        self.conn.close()
+        os.unlink(self.xmlpath)
+
+
+###############
+# virtinst    #
+###############
+
+@_benchmark("guest-parse")
+def _guest_parse(ctx):
+    def run():
+        for xml in ctx.guestxml:
+            Guest(ctx.conn, parsexml=xml)
+    return run
+
+
+@_benchmark("guest-get-xml-config")
+def _guest_get_xml_config(ctx):
+    guests = [Guest(ctx.conn, parsexml=xml) for xml in ctx.guestxml]
+    def run():
+        for guest in guests:
+            guest.get_xml_config()
+    return run
+
+
+@_benchmark("fetch-all-guests")
+def _fetch_all_guests(ctx):
+    return ctx.conn.fetch_all_guests
+
+
+@_benchmark("fetch-all-vols")
+def _fetch_all_vols(ctx):
+    return ctx.conn.fetch_all_vols
+
+
+@_benchmark("path-in-use-by")
+def _path_in_use_by(ctx):
+    # A used path, and one nothing points at
+    paths = [xmlgen.vol_path(ctx.counts, 0),
+             xmlgen.pool_path(0) + "/unused.img"]
+    def run():
+        for path in paths:
+            VirtualDisk.path_in_use_by(ctx.conn, path)
+    return run
+
+
+@_benchmark("generate-mac")
+def _generate_mac(ctx):
+    return lambda: VirtualNetworkInterface.generate_mac(ctx.conn)
+
+
+@_benchmark("cloner-setup")
+def _cloner_setup(ctx):
+    paths = [xmlgen.pool_path(0) + "/bench-clone-%d.img" % idx
+             for idx in range(ctx.counts.disks)]
+    def run():
+        cloner = Cloner(ctx.conn)
+        cloner.original_guest = xmlgen.guest_name(0)
+        cloner.clone_name = "bench-clone"
+        cloner.clone_paths = paths
+        cloner.setup()
+    return run
+
+
+###############
+# virtManager #
+###############
+
+def _init_virtmanager():
+    try:
+        # pylint: disable=E0611
+        from gi.repository import GLib
+        # pylint: enable=E0611
+        from virtcli import cliconfig
+        from virtManager.config import vmmConfig
+        from virtManager.connection import vmmConnection
+    except Exception, e:
+        raise SkipBenchmark("virtManager not importable: %s" % e)
+
+    from virtManager import config
+    if not config.running_config:
+        vmmConfig("virt-manager", cliconfig, True)
+
+    def drain():
+        context = GLib.MainContext.default()
+        while context.pending():
+            context.iteration(False)
+    return vmmConnection, drain
+
+
+@_benchmark("vmm-conn-tick")
+def _vmm_conn_tick(ctx):
+    vmmConnection, drain = _init_virtmanager()
+
+    conn = vmmConnection(ctx.uri)
+    conn.open(sync=True)
+    drain()
+    if not conn.is_active():
+        raise SkipBenchmark("Connection failed: %s" %
+                            (conn.connectError and conn.connectError[0]))
+
+    args = {"stats_update": True, "pollvm": True, "pollnet": True,
+            "pollpool": True}
+    # The first tick creates all the objects, time the steady state
+    conn.tick(**args)
+    drain()
+    ctx.cleanups.append(conn.cleanup)
+
+    return (lambda: conn.tick(**args)), drain
+
+
+##########
+# Runner #
+##########
+
+def _count_objects(func, after):
+    """
+    Return how many more objects the garbage collector tracks after a
+    run than before it. With collection disabled this counts everything
+    the run allocated and didn't free, including cyclic garbage.
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        func()
+        return len(gc.get_objects()) - before
+    finally:
+        gc.enable()
+        if after:
+            after()
+
+
+def _time(func, after, repeat):
+    times = []
+    for ignore in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+        if after:
+            after()
+
+    times.sort()
+    return {
+        "min": times[0],
+        "median": times[len(times) / 2],
+        "mean": sum(times) / len(times),
+        "runs": repeat,
+        "objects": _count_objects(func, after),
+    }
+
+
+def run_scale(counts, repeat=5, only=None):
+    """
+    Run the benchmarks for one set of xmlgen.Counts. Returns a dict
+    of benchmark name -> timing dict. Benchmarks that can't run here
+    map to {"skipped": reason}.
+    """
+    ctx = _Context(counts)
+    results = {}
+    try:
+        for name, func in _benchmarks:
+            if only and name not in only:
+                continue
+
+            try:
+                ret = func(ctx)
+            except SkipBenchmark, e:
+                logging.debug("Skipping %s: %s", name, e)
+                results[name] = {"skipped": str(e)}
+                continue
+
+            after = None
+            if isinstance(ret, tuple):
+                ret, after = ret
+            results[name] = _time(ret, after, repeat)
+    finally:
+        for cb in ctx.cleanups:
+            cb()
+        ctx.close()
+
+    return results
+
+
+def get_commit():
+    try:
+        proc = subprocess.Popen(["git", "describe", "--always", "--dirty"],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        out = proc.communicate()[0].strip()
+        if proc.returncode == 0:
+            return out
+    except OSError:
+        pass
+    return None
+
+
+# Startup cost of the command line tools, see time_import
+IMPORT_NAME = "import-virtinst"
+_IMPORT_SCRIPT = ("import time\n"
+                  "start = time.time()\n"
+                  "import virtinst, virtinst.cli\n"
+                  "%s"
+                  "print time.time() - start\n")
+
+
+def time_import(repeat=5, extra=None):
+    """
+    Time 'import virtinst, virtinst.cli' in fresh interpreters, which
+    is the fixed cost every virt-install run pays before doing any
+    work. Modules listed in extra are imported and timed along with
+    it. Returns a timing dict like the benchmarks.
+    """
+    script = _IMPORT_SCRIPT % "".join(["import %s\n" % m
+                                       for m in (extra or [])])
+    times = []
+    for ignore in range(repeat):
+        proc = subprocess.Popen([sys.executable, "-c", script],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError("Importing virtinst failed:\n%s" % err)
+        times.append(float(out.split()[-1]))
+
+    times.sort()
+    return {
+        "min": times[0],
+        "median": times[len(times) / 2],
+        "mean": sum(times) / len(times),
+        "runs": repeat,
+    }
+
+
+def run_all(scales, repeat=5, only=None, **kwargs):
+    """
+    Run the benchmarks at each guest count in scales, plus the import
+    time check unless only leaves it out. kwargs are passed to
+    xmlgen.Counts. Returns a report dict suitable for saving as JSON.
+    """
+    report = {
+        "commit": get_commit(),
+        "time": time.time(),
+        "python": sys.version.split()[0],
+        "repeat": repeat,
+        "scales": [],
+    }
+
+    for scale in scales:
+        counts = xmlgen.Counts(scale, **kwargs)
+        logging.debug("Running benchmarks with %s", counts)
+        report["scales"].append({
+            "counts": counts.to_dict(),
+            "results": run_scale(counts, repeat=repeat, only=only),
+        })
+
+    report["extra"] = {}
+    if not only or IMPORT_NAME in only:
+        report["extra"][IMPORT_NAME] = time_import(repeat)
+    return report
+
+
+def time_clitest():
+    """
+    Run the whole tests/clitest.py suite once, returning its timing in
+    the same format as the benchmarks
+    """
+    suite = unittest.TestLoader().loadTestsFromName("tests.clitest")
+    out = StringIO.StringIO()
+    runner = unittest.TextTestRunner(stream=out, verbosity=0)
+
+    start = time.time()
+    result = runner.run(suite)
+    elapsed = time.time() - start
+
+    if not result.wasSuccessful():
+        raise RuntimeError("clitest failed, not timing it:\n%s" %
+                           out.getvalue())
+    return {"min": elapsed, "median": elapsed, "mean": elapsed, "runs": 1}
+
+
+def _iter_results(report):
+    for scale in report["scales"]:
+        counts = xmlgen.Counts(**scale["counts"])
+        for name, res in scale["results"].items():
+            yield "%s (%s)" % (name, counts), res
+    for name, res in report.get("extra", {}).items():
+        yield name, res
+
+
+def compare(baseline, report, threshold=.25,
+            min_time=.005, min_objects=100):
+    """
+    Compare a run_all report against an earlier one. Returns a list of
+    strings describing the regressions, so an empty list is a pass.
+
+    A benchmark regresses if its best time, or the number of objects
+    it leaves allocated, grew by more than threshold (a fraction) over
+    the baseline. Growth smaller than min_time seconds or min_objects
+    objects is ignored as noise.
+    """
+    old = dict(_iter_results(baseline))
+    ret = []
+    for key, res in _iter_results(report):
+        base = old.get(key)
+        if not base or "min" not in base or "min" not in res:
+            continue
+
+        checks = [("time", base["min"], res["min"], min_time, "%.4fs")]
+        if "objects" in base and "objects" in res:
+            checks.append(("objects", base["objects"], res["objects"],
+                           min_objects, "%d"))
+
+        for what, oldval, newval, minval, fmt in checks:
+            if newval - oldval < minval:
+                continue
+            if newval <= oldval * (1 + threshold):
+                continue
+            ret.append(("%s: %s went from " + fmt + " to " + fmt) %
+                       (key, what, oldval, newval))
+    return ret
+
+
+def format_report(report):
+    lines = []
+    for scale in report["scales"]:
+        counts = xmlgen.Counts(**scale["counts"])
+        lines.append("%s" % counts)
+        for name in get_names():
+            res = scale["results"].get(name)
+            if res is None:
+                continue
+            if "skipped" in res:
+                lines.append("  %-24s skipped: %s" % (name, res["skipped"]))
+                continue
+            lines.append("  %-24s min %10.2fms  median %10.2fms  "
+                         "objects %8d" %
+                         (name, res["min"] * 1000, res["median"] * 1000,
+                          res["objects"]))
+    for name, res in report.get("extra", {}).items():
+        lines.append("%-26s %10.2fms" % (name, res["min"] * 1000))
+    return "\n".join(lines)
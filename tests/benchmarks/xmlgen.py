@@ -0,0 +1,163 @@
+# Copyright (C) 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+
+"""
+Generate test driver XML with a configurable number of objects
+"""
+
+import os
+import tempfile
+
+
+class Counts(object):
+    """
+    How many objects to generate. disks and nics are per guest, vols
+    per pool.
+    """
+    def __init__(self, guests, disks=2, nics=2, pools=None, vols=10):
+        self.guests = guests
+        self.disks = disks
+        self.nics = nics
+        self.pools = pools or max(1, guests / 10)
+        self.vols = vols
+
+    def to_dict(self):
+        return {"guests": self.guests, "disks": self.disks,
+                "nics": self.nics, "pools": self.pools, "vols": self.vols}
+
+    def __str__(self):
+        return ("guests=%(guests)d disks=%(disks)d nics=%(nics)d "
+                "pools=%(pools)d vols=%(vols)d" % self.to_dict())
+
+
+def pool_path(poolidx):
+    return "/bench-pool-%d" % poolidx
+
+
+def vol_path(counts, volidx):
+    """
+    Path of the volidx'th volume over all pools
+    """
+    poolidx, idx = divmod(volidx % (counts.pools * counts.vols), counts.vols)
+    return "%s/vol-%d.img" % (pool_path(poolidx), idx)
+
+
+def guest_name(idx):
+    return "bench-guest-%d" % idx
+
+
+def _guest_xml(counts, idx):
+    devices = []
+    for diskidx in range(counts.disks):
+        path = vol_path(counts, idx * counts.disks + diskidx)
+        devices.append("""    <disk type='file' device='disk'>
+      <source file='%s'/>
+      <target dev='vd%s' bus='virtio'/>
+    </disk>""" % (path, chr(ord("a") + diskidx % 26)))
+
+    for nicidx in range(counts.nics):
+        mac = idx * counts.nics + nicidx
+        devices.append("""    <interface type='network'>
+      <source network='default'/>
+      <mac address='52:54:00:%02x:%02x:%02x'/>
+      <model type='virtio'/>
+    </interface>""" % ((mac >> 16) & 0xff, (mac >> 8) & 0xff, mac & 0xff))
+
+    return """<domain type='test'>
+  <name>%s</name>
+  <memory>1048576</memory>
+  <currentMemory>1048576</currentMemory>
+  <vcpu>1</vcpu>
+  <os>
+    <type arch='i686'>hvm</type>
+    <boot dev='hd'/>
+  </os>
+  <devices>
+%s
+    <graphics type='vnc' port='-1'/>
+  </devices>
+</domain>
+""" % (guest_name(idx), "\n".join(devices))
+
+
+def _pool_xml(counts, idx):
+    vols = []
+    for volidx in range(counts.vols):
+        vols.append("""  <volume>
+    <name>vol-%d.img</name>
+    <capacity>1000000000</capacity>
+    <allocation>50000</allocation>
+    <target>
+      <format type='raw'/>
+    </target>
+  </volume>""" % volidx)
+
+    return """<pool type='dir'>
+  <name>bench-pool-%d</name>
+  <capacity>107374182400</capacity>
+  <allocation>0</allocation>
+  <available>107374182400</available>
+  <target>
+    <path>%s</path>
+  </target>
+%s
+</pool>
+""" % (idx, pool_path(idx), "\n".join(vols))
+
+
+def make_xml(counts):
+    """
+    Return test driver XML for the passed Counts
+    """
+    parts = ["""<node>
+  <cpu>
+    <nodes>1</nodes>
+    <sockets>4</sockets>
+    <cores>4</cores>
+    <threads>1</threads>
+    <active>16</active>
+    <mhz>4000</mhz>
+    <model>i686</model>
+  </cpu>
+  <memory>100000000</memory>
+
+<network>
+  <name>default</name>
+  <forward mode='nat'/>
+  <bridge name='virbr0'/>
+  <ip address='192.168.122.1' netmask='255.255.255.0'>
+    <dhcp>
+      <range start='192.168.122.2' end='192.168.122.254'/>
+    </dhcp>
+  </ip>
+</network>
+"""]
+    parts += [_guest_xml(counts, idx) for idx in range(counts.guests)]
+    parts += [_pool_xml(counts, idx) for idx in range(counts.pools)]
+    parts.append("</node>\n")
+    return "\n".join(parts)
+
+
+def write_xml(counts):
+    """
+    Write make_xml output to a temporary file, returning its path.
+    The caller should remove it.
+    """
+    fd, path = tempfile.mkstemp(prefix="virtinst-bench-", suffix=".xml")
+    os.write(fd, make_xml(counts))
+    os.close(fd)
+    return path
@@ -0,0 +1,122 @@
+# Copyright (C) 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from virtManager import consolelog
+from virtManager.consolelog import (ConsoleCapture, CaptureReader,
+                                    INDEX_INTERVAL)
+
+# pylint: disable=W0212
+# Access to protected member, needed to unittest stuff
+
+
+def _read(path):
+    f = file(path, "rb")
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def _make_line(idx):
+    # Varying lengths, and a token that only matches this line
+    return "line <%d> %s\n" % (idx, "x" * (idx % 7))
+
+
+class TestConsoleLog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="virtmanager-consolelog")
+        self.path = os.path.join(self.tmpdir, "serial0.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _capture(self, lines, maxsize=1024 * 1024, backups=2):
+        capture = ConsoleCapture(self.path, maxsize, backups)
+        for line in lines:
+            capture.write(line)
+        capture.close()
+
+    def testRotation(self):
+        # Every line is 100 bytes, so a 1000 byte log holds 10. Use a
+        # fresh capture per line, so the writer thread can't batch
+        # them up and the split points are predictable.
+        lines = ["%-99d\n" % idx for idx in range(35)]
+        for line in lines:
+            self._capture([line], maxsize=1000, backups=2)
+
+        self.assertEquals(consolelog.get_capture_files(self.path),
+                          [self.path + ".2", self.path + ".1", self.path])
+        self.assertFalse(os.path.exists(self.path + ".3"))
+        self.assertFalse(os.path.exists(self.path + ".3.idx"))
+
+        self.assertEquals(_read(self.path + ".2"), "".join(lines[10:20]))
+        self.assertEquals(_read(self.path + ".1"), "".join(lines[20:30]))
+        self.assertEquals(_read(self.path), "".join(lines[30:]))
+
+        # Rotated logs keep their own index
+        reader = CaptureReader(self.path + ".1")
+        self.assertEquals(reader.get_line_count(), 10)
+        self.assertEquals(reader.search("25 "), [(5, lines[25])])
+
+    def testLineIndex(self):
+        count = 3 * INDEX_INTERVAL + 10
+        lines = [_make_line(idx) for idx in range(count)]
+
+        # Split over two captures, so appending to an existing log has
+        # to pick up the line count where it left off
+        half = INDEX_INTERVAL + 50
+        self._capture(lines[:half])
+        self._capture(lines[half:])
+        self.assertEquals(_read(self.path), "".join(lines))
+
+        index = consolelog._read_index(self.path)
+        self.assertEquals(len(index), 4)
+        self._check_reader(lines)
+
+        # A missing index is rebuilt with the same contents
+        os.unlink(consolelog._index_path(self.path))
+        self._check_reader(lines)
+        self.assertEquals(consolelog._read_index(self.path), index)
+
+    def _check_reader(self, lines):
+        reader = CaptureReader(self.path)
+        self.assertEquals(reader.get_line_count(), len(lines))
+
+        for first in [0, 1, INDEX_INTERVAL - 1, INDEX_INTERVAL,
+                      INDEX_INTERVAL + 1, 2 * INDEX_INTERVAL - 2,
+                      3 * INDEX_INTERVAL, len(lines) - 3]:
+            self.assertEquals(reader.read_lines(first, 5),
+                              lines[first:first + 5])
+        self.assertEquals(reader.read_lines(len(lines), 5), [])
+
+        for idx in [0, INDEX_INTERVAL - 1, INDEX_INTERVAL,
+                    2 * INDEX_INTERVAL + 1, len(lines) - 1]:
+            token = "<%d>" % idx
+            self.assertEquals(reader.search(token), [(idx, lines[idx])])
+            self.assertEquals(reader.search(token, first=idx),
+                              [(idx, lines[idx])])
+            self.assertEquals(reader.search(token, first=idx + 1), [])
+
+        results = reader.search("LINE", first=INDEX_INTERVAL - 2,
+                                maxresults=4)
+        self.assertEquals([r[0] for r in results],
+                          range(INDEX_INTERVAL - 2, INDEX_INTERVAL + 2))
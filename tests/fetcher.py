@@ -0,0 +1,318 @@
+# Copyright (C) 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+
+import BaseHTTPServer
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+import urlgrabber.progress
+
+from virtinst import isoreader
+from virtinst import urlfetcher
+from virtinst.urlcache import URLCache
+
+# pylint: disable=W0212
+# Access to protected member, needed to unittest stuff
+
+
+class _TreeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves server.files over keep-alive HTTP/1.1, with Range and
+    ETag support. Paths listed in server.truncate have their first
+    GET cut short.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        ignore = args
+
+    def _send(self, body):
+        path = self.path.lstrip("/")
+        if path not in self.server.files:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        data = self.server.files[path]
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        match = re.match(r"bytes=(\d+)-", self.headers.get("Range") or "")
+        if match and self.server.ranges:
+            start = int(match.group(1))
+            self.server.range_requests.append((path, start))
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" %
+                             (start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data) - start))
+        self.send_header("ETag", etag)
+        self.end_headers()
+
+        if not body:
+            return
+        self.server.gets.append(path)
+        if path in self.server.truncate:
+            self.server.truncate.remove(path)
+            self.wfile.write(data[start:start + len(data) / 3])
+            self.close_connection = 1
+            return
+        self.wfile.write(data[start:])
+
+    def do_HEAD(self):
+        self.server.heads += 1
+        self._send(False)
+
+    def do_GET(self):
+        self._send(True)
+
+
+class TestHTTPFetcher(unittest.TestCase):
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0),
+                                                _TreeHandler)
+        self.server.files = {
+            "": "",
+            ".treeinfo": "[general]\nfamily = Fedora\n",
+            "images/pxeboot/initrd.img": os.urandom(256 * 1024),
+        }
+        self.server.truncate = []
+        self.server.ranges = True
+        self.server.range_requests = []
+        self.server.connections = 0
+        self.server.heads = 0
+        self.server.gets = []
+        self.server.daemon_threads = True
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.scratchdir = tempfile.mkdtemp(prefix="virtinst-fetcher-test")
+        url = "http://127.0.0.1:%d/" % self.server.server_port
+        self.fetcher = urlfetcher.fetcherForURI(url, self.scratchdir,
+            urlgrabber.progress.BaseMeter())
+        self.cachedir = tempfile.mkdtemp(prefix="virtinst-urlcache-test")
+        self.fetcher.cache = URLCache(self.cachedir)
+
+    def tearDown(self):
+        self.fetcher.cleanupLocation()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.scratchdir)
+        shutil.rmtree(self.cachedir)
+
+    def _fetch(self, filename):
+        tmpname = self.fetcher.acquireFile(filename)
+        try:
+            return file(tmpname).read()
+        finally:
+            os.unlink(tmpname)
+
+    def testConnectionReuse(self):
+        self.fetcher.prepareLocation()
+        self.assertTrue(self.fetcher.hasFile(".treeinfo"))
+        self.assertFalse(self.fetcher.hasFile("Fedora"))
+        self.assertEquals(self._fetch(".treeinfo"),
+                          self.server.files[".treeinfo"])
+        self.assertEquals(self._fetch("images/pxeboot/initrd.img"),
+                          self.server.files["images/pxeboot/initrd.img"])
+
+        self.assertEquals(self.server.heads, 3)
+        self.assertEquals(self.server.connections, 1)
+
+    def testResume(self):
+        initrd = "images/pxeboot/initrd.img"
+        self.server.truncate.append(initrd)
+        self.assertEquals(self._fetch(initrd), self.server.files[initrd])
+
+        self.assertEquals(len(self.server.range_requests), 1)
+        self.assertEquals(self.server.range_requests[0][0], initrd)
+        self.assertTrue(self.server.range_requests[0][1] > 0)
+
+    def testResumeNoRangeSupport(self):
+        initrd = "images/pxeboot/initrd.img"
+        self.server.ranges = False
+        self.server.truncate.append(initrd)
+        self.assertEquals(self._fetch(initrd), self.server.files[initrd])
+
+    def testCache(self):
+        initrd = "images/pxeboot/initrd.img"
+
+        # Fresh downloads are hardlinked into the cache, not copied
+        tmpname = self.fetcher.acquireFile(initrd)
+        self.assertEquals(os.stat(tmpname).st_nlink, 2)
+        self.assertEquals(file(tmpname).read(), self.server.files[initrd])
+        os.unlink(tmpname)
+
+        self.assertEquals(self._fetch(initrd), self.server.files[initrd])
+        self.assertEquals(self.server.gets, [initrd])
+
+        # Changed on the server, so we need to download it again
+        self.server.files[initrd] = os.urandom(1024)
+        self.assertEquals(self._fetch(initrd), self.server.files[initrd])
+        self.assertEquals(self.server.gets, [initrd, initrd])
+
+        # Cache hits are hardlinked into the scratchdir
+        tmpname = self.fetcher.acquireFile(initrd)
+        self.assertEquals(os.stat(tmpname).st_nlink, 2)
+        os.unlink(tmpname)
+
+    def testCacheEviction(self):
+        self.fetcher.cache = URLCache(self.cachedir, maxsize=300 * 1024)
+        initrd = "images/pxeboot/initrd.img"
+        self._fetch(initrd)
+        self._fetch(".treeinfo")
+
+        # initrd is least recently used, so is pushed out by the new file
+        self.server.files["images/pxeboot/vmlinuz"] = os.urandom(100 * 1024)
+        self._fetch("images/pxeboot/vmlinuz")
+        self._fetch(".treeinfo")
+        self._fetch(initrd)
+        self.assertEquals(self.server.gets,
+            [initrd, ".treeinfo", "images/pxeboot/vmlinuz", initrd])
+
+    def testCacheEvictedBeforeFetch(self):
+        initrd = "images/pxeboot/initrd.img"
+        self._fetch(initrd)
+
+        # Another process evicts the file between our lookup and the
+        # server telling us it's unchanged
+        cache = self.fetcher.cache
+        origlookup = cache.lookup
+        def lookup(url):
+            entry = origlookup(url)
+            os.unlink(cache._blobpath(entry["digest"]))
+            return entry
+        cache.lookup = lookup
+
+        self.assertEquals(self._fetch(initrd), self.server.files[initrd])
+        self.assertEquals(self.server.gets, [initrd, initrd])
+        self.assertEquals(os.listdir(self.scratchdir), [])
+
+    def testMissingFile(self):
+        self.assertRaises(ValueError, self.fetcher.acquireFile, "missing")
+        self.assertEquals(os.listdir(self.scratchdir), [])
+
+
+class TestISOFetcher(unittest.TestCase):
+    """
+    Extract files from small ISO images with each kind of naming
+    """
+    def setUp(self):
+        self.scratchdir = tempfile.mkdtemp(prefix="virtinst-fetcher-test")
+
+    def tearDown(self):
+        shutil.rmtree(self.scratchdir)
+
+    def _get_fetcher(self, name):
+        isopath = os.path.join(self.scratchdir, name)
+        gz = gzip.open("tests/iso-files/%s.gz" % name)
+        file(isopath, "wb").write(gz.read())
+        gz.close()
+
+        fetcher = urlfetcher.fetcherForURI(isopath, self.scratchdir,
+            urlgrabber.progress.BaseMeter())
+        self.assertTrue(isinstance(fetcher, urlfetcher._ISOImageFetcher))
+        fetcher.prepareLocation()
+        return fetcher
+
+    def _check_tree(self, fetcher):
+        self.assertTrue(fetcher.hasFile(""))
+        self.assertTrue(fetcher.hasFile("images/pxeboot"))
+        self.assertFalse(fetcher.hasFile("images/xen/vmlinuz"))
+
+        for filename, content in [
+                ("images/pxeboot/vmlinuz", "kernel " * 3000),
+                ("images/pxeboot/initrd.img", "initrd" * 1000)]:
+            self.assertTrue(fetcher.hasFile(filename))
+            tmpname = fetcher.acquireFile(filename)
+            self.assertEquals(file(tmpname).read(), content)
+            os.unlink(tmpname)
+
+        self.assertRaises(ValueError, fetcher.acquireFile, "images")
+        self.assertRaises(ValueError, fetcher.acquireFile, "missing")
+
+    def testRockRidge(self):
+        fetcher = self._get_fetcher("rockridge.iso")
+        try:
+            self.assertEquals(fetcher._iso.mode, "rockridge")
+            self._check_tree(fetcher)
+            self.assertTrue(fetcher.hasFile(".treeinfo"))
+            self.assertFalse(fetcher.hasFile("IMAGES"))
+
+            # isolinux/vmlinuz is a symlink to the pxeboot kernel
+            tmpname = fetcher.acquireFile("isolinux/vmlinuz")
+            self.assertEquals(file(tmpname).read(), "kernel " * 3000)
+            os.unlink(tmpname)
+        finally:
+            fetcher.cleanupLocation()
+
+    def testJoliet(self):
+        fetcher = self._get_fetcher("joliet.iso")
+        try:
+            self.assertEquals(fetcher._iso.mode, "joliet")
+            self._check_tree(fetcher)
+        finally:
+            fetcher.cleanupLocation()
+
+    def testISO9660(self):
+        fetcher = self._get_fetcher("iso9660.iso")
+        try:
+            self.assertEquals(fetcher._iso.mode, "iso9660")
+            self._check_tree(fetcher)
+            self.assertTrue(fetcher.hasFile("IMAGES/PXEBOOT/VMLINUZ"))
+        finally:
+            fetcher.cleanupLocation()
+
+    def testProgress(self):
+        fetcher = self._get_fetcher("iso9660.iso")
+        updates = []
+        fetcher.meter.update = updates.append
+        try:
+            tmpname = fetcher.acquireFile("images/pxeboot/vmlinuz")
+            os.unlink(tmpname)
+        finally:
+            fetcher.cleanupLocation()
+
+        size = len("kernel " * 3000)
+        self.assertTrue(len(updates) > 1)
+        self.assertEquals(updates, sorted(updates))
+        self.assertEquals(updates[-1], size)
+
+    def testNotISO(self):
+        self.assertFalse(isoreader.is_iso("tests/testdriver.xml"))
+        fetcher = urlfetcher.fetcherForURI("tests/testdriver.xml",
+            self.scratchdir, urlgrabber.progress.BaseMeter())
+        self.assertTrue(isinstance(fetcher,
+                                   urlfetcher._MountedImageFetcher))
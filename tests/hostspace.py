@@ -0,0 +1,139 @@
+# Copyright (C) 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+
+import time
+import unittest
+
+# pylint: disable=E0611
+from gi.repository import GLib
+# pylint: enable=E0611
+
+from virtManager import uihelpers
+from virtManager.hostspace import vmmHostSpace
+
+# pylint: disable=W0212
+# Access to protected member, needed to unittest stuff
+
+
+class _FakeLabel(object):
+    def __init__(self):
+        self.markup = None
+        self.handlers = {}
+
+    def connect(self, signal, cb):
+        handle = len(self.handlers) + 1
+        self.handlers[handle] = (signal, cb)
+        return handle
+
+    def disconnect(self, handle):
+        del(self.handlers[handle])
+
+    def set_markup(self, markup):
+        self.markup = markup
+
+    def destroy(self):
+        for signal, cb in self.handlers.values():
+            if signal == "destroy":
+                cb(self)
+
+
+class TestHostSpace(unittest.TestCase):
+    def setUp(self):
+        self.space = {}
+        self.calls = []
+        self._origspace = uihelpers.host_disk_space
+        uihelpers.host_disk_space = self._host_disk_space
+        self.trackers = []
+
+    def tearDown(self):
+        uihelpers.host_disk_space = self._origspace
+        for tracker in self.trackers:
+            tracker.cleanup()
+        self.assertEquals(vmmHostSpace._label_owners, {})
+
+    def _host_disk_space(self, conn):
+        self.calls.append(conn)
+        return self.space[conn]
+
+    def _tracker(self, conn, avail):
+        self.space[conn] = avail
+        tracker = vmmHostSpace(conn)
+        self.trackers.append(tracker)
+        return tracker
+
+    def _wait(self, tracker):
+        context = GLib.MainContext.default()
+        endtime = time.time() + 5
+        while tracker._thread and time.time() < endtime:
+            context.iteration(False)
+        self.assertEquals(tracker._thread, None)
+
+    def testCache(self):
+        tracker = self._tracker("conna", 12.5)
+        self.assertTrue(tracker.is_stale())
+        self.assertEquals(tracker.get_available(), None)
+
+        label = _FakeLabel()
+        tracker.add_label(label)
+        self.assertEquals(label.markup, "")
+        self._wait(tracker)
+        self.assertEquals(tracker.get_available(), 12.5)
+        self.assertTrue("12.5 GB" in label.markup)
+        self.assertEquals(self.calls, ["conna"])
+
+        # Still fresh, so no new lookup
+        self.assertFalse(tracker.is_stale())
+        tracker.refresh()
+        tracker.add_label(_FakeLabel())
+        self.assertEquals(tracker._thread, None)
+        self.assertEquals(self.calls, ["conna"])
+
+        # Once the cache times out the next refresh looks again
+        self.space["conna"] = 20
+        tracker._timestamp -= tracker.CACHE_TIMEOUT + 1
+        self.assertTrue(tracker.is_stale())
+        tracker.refresh()
+        self._wait(tracker)
+        self.assertEquals(self.calls, ["conna", "conna"])
+        self.assertTrue("20.0 GB" in label.markup)
+
+        tracker.refresh(force=True)
+        self._wait(tracker)
+        self.assertEquals(len(self.calls), 3)
+
+    def testSwitchConnection(self):
+        tracka = self._tracker("conna", 10)
+        trackb = self._tracker("connb", 30)
+        label = _FakeLabel()
+
+        tracka.add_label(label)
+        self._wait(tracka)
+        trackb.add_label(label)
+        self._wait(trackb)
+        self.assertTrue("30.0 GB" in label.markup)
+
+        # A later refresh of the old connection leaves the label alone
+        self.space["conna"] = 11
+        tracka.refresh(force=True)
+        self._wait(tracka)
+        self.assertEquals(tracka.get_available(), 11)
+        self.assertTrue("30.0 GB" in label.markup)
+        self.assertEquals(len(label.handlers), 1)
+
+        label.destroy()
+        self.assertEquals(label.handlers, {})
+        self.assertEquals(trackb._labels, {})
@@ -15,7 +15,11 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 # MA 02110-1301 USA.
 
+import hashlib
+import json
 import os
+import shutil
+import tempfile
 import unittest
 
 from virtinst import virtimage
@@ -61,6 +65,51 @@ class TestImageParser(unittest.TestCase):
         virtimage.ImageInstaller(self.conn, image, 0)
         self.assertTrue(True)
 
+    def testDiskSignatures(self):
+        tmpdir = tempfile.mkdtemp(prefix="virtinst-image-test")
+        cachefile = os.path.join(tmpdir, "digests.json")
+        origfunc = virtimage._hash_file
+        hashed = []
+        def fake_hash(path, *args):
+            hashed.append(path)
+            return origfunc(path, *args)
+
+        try:
+            virtimage._hash_file = fake_hash
+            disks = []
+            for idx in range(3):
+                disk = virtimage.Disk()
+                disk.file = os.path.join(tmpdir, "disk%d.raw" % idx)
+                data = os.urandom(1024 * (idx + 1))
+                file(disk.file, "w").write(data)
+                disk.csum["sha256"] = hashlib.sha256(data).hexdigest()
+                disks.append(disk)
+            disks[2].csum = {"sha1": hashlib.sha1(data).hexdigest()}
+
+            virtimage.verify_disk_signatures(disks, cachefile=cachefile)
+            self.assertEquals(len(hashed), 3)
+
+            # Unchanged disks aren't hashed again
+            virtimage.verify_disk_signatures(disks, cachefile=cachefile)
+            self.assertEquals(len(hashed), 3)
+
+            # Changed disk is rehashed and fails
+            file(disks[1].file, "a").write("foo")
+            self.assertRaises(ValueError, virtimage.verify_disk_signatures,
+                              disks, cachefile=cachefile)
+            self.assertEquals(hashed[3:], [disks[1].file])
+
+            # Entries for deleted or changed files are dropped on save
+            os.unlink(disks[0].file)
+            os.utime(disks[2].file, (0, 0))
+            cache = virtimage._DigestCache(cachefile)
+            cache.save()
+            self.assertEquals(json.load(file(cachefile)).keys(),
+                              [os.path.realpath(disks[1].file)])
+        finally:
+            virtimage._hash_file = origfunc
+            shutil.rmtree(tmpdir)
+
     def testStorageFormat(self):
         self._image2XMLhelper("image-format.xml", "image-format-out.xml",
                               qemu=True)
@@ -0,0 +1,145 @@
+# Copyright (C) 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+import zlib
+
+from virtinst import distroinstaller
+
+# pylint: disable=W0212
+# Access to protected member, needed to unittest stuff
+
+
+def _read(path):
+    f = file(path, "rb")
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def _write(path, data):
+    f = file(path, "wb")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+
+def _parse_cpio(archive):
+    """
+    Split a newc cpio archive into (name, data, mode) tuples, checking
+    the header magic and padding as we go
+    """
+    entries = []
+    pos = 0
+    while True:
+        if archive[pos:pos + 6] != "070701":
+            raise AssertionError("Bad cpio magic at %d" % pos)
+        fields = [int(archive[pos + 6 + idx * 8:pos + 14 + idx * 8], 16)
+                  for idx in range(13)]
+        mode, filesize, namesize = fields[1], fields[6], fields[11]
+        pos += 110
+
+        name = archive[pos:pos + namesize]
+        if name[-1] != "\0":
+            raise AssertionError("Unterminated cpio name at %d" % pos)
+        pos += namesize
+        if archive[pos:pos + (-pos % 4)] != "\0" * (-pos % 4):
+            raise AssertionError("Bad cpio name padding at %d" % pos)
+        pos += -pos % 4
+
+        data = archive[pos:pos + filesize]
+        pos += filesize
+        if archive[pos:pos + (-pos % 4)] != "\0" * (-pos % 4):
+            raise AssertionError("Bad cpio data padding at %d" % pos)
+        pos += -pos % 4
+
+        entries.append((name[:-1], data, mode))
+        if name[:-1] == "TRAILER!!!":
+            break
+
+    if pos != len(archive):
+        raise AssertionError("Trailing data after cpio archive")
+    return entries
+
+
+class TestInitrdInjection(unittest.TestCase):
+    """
+    Check the cpio segment we append to initrds for injections
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="virtinst-initrd")
+        self.files = [("ks.cfg", "install\nreboot\n"),
+                      ("empty", ""),
+                      ("odd-name.txt", "x")]
+        self.paths = []
+        for name, data in self.files:
+            self.paths.append(os.path.join(self.tmpdir, name))
+            _write(self.paths[-1], data)
+            os.chmod(self.paths[-1], 0640)
+
+        self.initrd = os.path.join(self.tmpdir, "initrd.img")
+        self.base = "base initrd\n" * 100
+        _write(self.initrd, self.base)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _check_segment(self, segment):
+        archive = zlib.decompress(segment, 16 + zlib.MAX_WBITS)
+        self.assertEquals(len(archive) % 4, 0)
+
+        entries = _parse_cpio(archive)
+        self.assertEquals(entries[-1], ("TRAILER!!!", "", 0))
+        self.assertEquals([e[:2] for e in entries[:-1]], self.files)
+        for ignore, ignore, mode in entries[:-1]:
+            self.assertEquals(mode, 0100640)
+
+    def testSegment(self):
+        out = StringIO.StringIO()
+        distroinstaller._write_initrd_segment(out, self.paths)
+        self._check_segment(out.getvalue())
+
+    def testAppend(self):
+        distroinstaller._perform_initrd_injections(self.initrd, self.paths)
+        data = _read(self.initrd)
+        self.assertTrue(data.startswith(self.base))
+        self._check_segment(data[len(self.base):])
+
+    def testHardlinked(self):
+        # The URL cache hardlinks its read only copy into the scratchdir,
+        # that copy must come out unchanged
+        cached = os.path.join(self.tmpdir, "cached.img")
+        os.link(self.initrd, cached)
+        os.chmod(cached, 0444)
+
+        distroinstaller._perform_initrd_injections(self.initrd, self.paths)
+        self.assertEquals(_read(cached), self.base)
+        self.assertEquals(os.stat(self.initrd).st_nlink, 1)
+
+        data = _read(self.initrd)
+        self.assertTrue(data.startswith(self.base))
+        self._check_segment(data[len(self.base):])
+
+    def testNoInjections(self):
+        distroinstaller._perform_initrd_injections(self.initrd, [])
+        self.assertEquals(_read(self.initrd), self.base)
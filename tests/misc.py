@@ -18,12 +18,19 @@
 import fnmatch
 import imp
 import importlib
+import json
 import os
+import subprocess
 import sys
+import tempfile
+import types
 import unittest
 
 _badmodules = ["gi.repository.Gtk", "gi.repository.Gdk"]
 
+# Slow modules that shouldn't be loaded just by importing the CLI code
+_lazymodules = ["virtinst.urlfetcher", "gi.repository.Libosinfo", "guestfs"]
+
 
 def _restore_modules(fn):
     def wrap(*args, **kwargs):
@@ -88,3 +95,140 @@ class TestMisc(unittest.TestCase):
         files += _find_py("virtcli")
 
         self._check_modules(files)
+
+    def test_lazy_imports(self):
+        """
+        Make sure importing virtinst doesn't load modules that are only
+        needed once an install or lookup actually happens
+        """
+        script = ("import sys\n"
+                  "import virtinst, virtinst.cli\n"
+                  "for m in %r:\n"
+                  "    if m in sys.modules:\n"
+                  "        print m\n" % _lazymodules)
+        proc = subprocess.Popen([sys.executable, "-c", script],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            raise AssertionError("Importing virtinst failed:\n%s" % err)
+
+        found = out.split()
+        if found:
+            raise AssertionError("%s found in sys.modules" % found)
+
+    def test_import_time(self):
+        """
+        Importing virtinst must be measurably quicker than importing it
+        along with the modules it defers, otherwise something is
+        pulling them back in at startup
+        """
+        from tests.benchmarks import bench
+
+        extra = []
+        for name in _lazymodules:
+            try:
+                importlib.import_module(name)
+                extra.append(name)
+            except ImportError:
+                pass
+        if not extra:
+            self.skipTest("None of %s are installed" % _lazymodules)
+
+        lazy = bench.time_import(repeat=5)
+        eager = bench.time_import(repeat=5, extra=extra)
+        self.assertTrue(lazy["min"] < eager["min"],
+                        "import virtinst took %.3fs, with %s %.3fs" %
+                        (lazy["min"], extra, eager["min"]))
+
+    def test_startup_profile(self):
+        """
+        Check the --profile-startup report records imports and calls
+        """
+        fd, path = tempfile.mkstemp(prefix="virtinst-profile", suffix=".json")
+        os.close(fd)
+        script = ("from virtcli import startupprofile\n"
+                  "startupprofile.early_init('test', "
+                  "['--profile-startup', %r])\n"
+                  "import virtinst\n"
+                  "from virtinst import cli\n"
+                  "cli._setupProfiling()\n"
+                  "virtinst.CapabilitiesParser.Capabilities("
+                  "file('tests/capabilities-xml/capabilities-kvm.xml')"
+                  ".read())\n" % path)
+        try:
+            proc = subprocess.Popen([sys.executable, "-c", script],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            ignore, err = proc.communicate()
+            if proc.returncode != 0:
+                raise AssertionError("Profiling failed:\n%s" % err)
+
+            report = json.load(file(path))
+        finally:
+            os.unlink(path)
+
+        modules = [i["module"] for i in report["imports"]]
+        self.assertTrue("virtinst" in modules)
+        self.assertTrue("virtinst.cli" in modules)
+        self.assertEquals(report["calls"]["caps-parse"]["count"], 1)
+        self.assertEquals(report["events"][0]["name"], "logging-setup")
+
+    def test_benchmarks(self):
+        """
+        Run the virtinst benchmarks once at a tiny scale, so they
+        don't bitrot
+        """
+        from tests.benchmarks import bench, xmlgen
+
+        only = [n for n in bench.get_names() if not n.startswith("vmm-")]
+        results = bench.run_scale(xmlgen.Counts(3, pools=2, vols=3),
+                                  repeat=1, only=only)
+        self.assertEquals(sorted(results.keys()), sorted(only))
+        for name, res in results.items():
+            self.assertTrue("min" in res, "%s: %s" % (name, res))
+
+        res = bench.time_import(repeat=1)
+        self.assertTrue(res["min"] > 0)
+
+    def test_module_trace_timing(self):
+        """
+        Check the --trace-libvirt=timing call counts and self time
+        bookkeeping on a module with nested calls
+        """
+        from virtManager import module_trace
+
+        mod = types.ModuleType("tracetest")
+        exec ("import time\n"
+              "def inner():\n"
+              "    time.sleep(.01)\n"
+              "def outer():\n"
+              "    inner()\n"
+              "    inner()\n") in mod.__dict__
+
+        # pylint: disable=W0212
+        origstats = module_trace._callstats
+        module_trace._callstats = module_trace._CallStats()
+        try:
+            module_trace.wrap_module(mod, timing=True)
+            mod.outer()
+            mod.outer()
+            stats = module_trace._callstats.stats
+        finally:
+            module_trace._callstats = origstats
+        # pylint: enable=W0212
+
+        self.assertEquals(sorted(stats.keys()), ["inner", "outer"])
+        outercalls, outercum, outerself = stats["outer"]
+        innercalls, innercum, innerself = stats["inner"]
+        self.assertEquals(outercalls, 2)
+        self.assertEquals(innercalls, 4)
+
+        for cumtime, selftime in [(outercum, outerself),
+                                  (innercum, innerself)]:
+            self.assertTrue(0 <= selftime <= cumtime)
+        # inner calls nothing wrapped, and outer's time in inner isn't
+        # counted as its own
+        self.assertAlmostEquals(innerself, innercum, places=6)
+        self.assertAlmostEquals(outerself, outercum - innercum, places=6)
+        self.assertTrue(innercum >= .04)
@@ -0,0 +1,57 @@
+# Copyright (C) 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+
+import unittest
+
+from virtinst import rpcstats
+
+from tests import utils
+
+
+class TestRPCStats(unittest.TestCase):
+
+    def testCallAccounting(self):
+        """
+        Check calls on a connection and its objects are counted
+        against that connection only
+        """
+        rpcstats.enable()
+        conn = utils.open_testdefault()
+        otherconn = utils.open_testdefault()
+
+        stats = conn.get_rpc_stats()
+        start = stats.get_total_calls()
+
+        dom = conn.lookupByName("test")
+        xml = dom.XMLDesc(0)
+        dom.XMLDesc(0)
+        dom.info()
+
+        self.assertEquals(stats.get_total_calls() - start, 4)
+        bynames = dict((s[0], s) for s in stats.get_stats())
+        self.assertEquals(bynames["virDomain.XMLDesc"][1], 2)
+        self.assertEquals(bynames["virDomain.XMLDesc"][2], len(xml) * 2)
+        self.assertEquals(bynames["virDomain.info"][2], 0)
+        self.assertTrue("virConnect.lookupByName" in bynames)
+        self.assertTrue("virDomain.XMLDesc" in stats.format())
+
+        self.assertTrue("virDomain.XMLDesc" not in
+                        [s[0] for s in otherconn.get_rpc_stats().get_stats()])
+
+
+if __name__ == "__main__":
+    unittest.main()
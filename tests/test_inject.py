@@ -101,7 +101,7 @@ def _test_distro(distro):
 
     os.system("cp -f %s %s" % (originitrd, newinitrd))
     cleanup.append(newinitrd)
-    _perform_initrd_injections(newinitrd, [injectfile], ".")
+    _perform_initrd_injections(newinitrd, [injectfile])
 
     nic = distro.virtio and "virtio" or "rtl8139"
     append = "-append \"ks=file:/%s\"" % os.path.basename(injectfile)
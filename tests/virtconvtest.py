@@ -19,7 +19,14 @@ import unittest
 import virtconv
 import os
 import glob
+import shutil
+import struct
+import tarfile
+import tempfile
+import zlib
 from tests import utils
+from virtconv import diskcfg
+from virtconv import vmdk
 
 BASE = "tests/virtconv-files"
 
@@ -105,6 +112,25 @@ class TestVirtConv(unittest.TestCase):
 
         self._compare_files(base, in_type, out_type, in_dir, out_dir)
 
+    def testOVA2VirtImage(self):
+        # Same as the OVF test, but with the descriptor inside an OVA
+        tmpdir = tempfile.mkdtemp()
+        try:
+            ova = os.path.join(tmpdir, "test1.ova")
+            tar = tarfile.open(ova, "w")
+            tar.add(os.path.join(ovf_input, "test1.ovf"), "test1.ovf")
+            tar.close()
+
+            outfile = os.path.join(virtimage_output,
+                                   "ovf2virtimage_test1.virt-image")
+            self._convert_helper(ova, outfile, "ovf", "virt-image")
+
+            vmdef = virtconv.formats.parser_by_name("ovf").import_file(ova)
+            for disk in vmdef.disks.values():
+                self.assertEquals(disk.archive, ova)
+        finally:
+            shutil.rmtree(tmpdir)
+
     # For x2x conversion, we want to use already tested output, since ideally
     # we should be able to run a generated config continually through the
     # converter and it will generate the same result
@@ -121,3 +147,369 @@ class TestVirtConv(unittest.TestCase):
         in_dir = out_dir = virtimage_output
 
         self._compare_files(base, in_type, out_type, in_dir, out_dir)
+
+
+############################
+# Disk conversion fixtures #
+############################
+
+_SECTOR = 512
+_GRAIN_SECTORS = 128
+_GRAIN = _GRAIN_SECTORS * _SECTOR
+
+# 2112 sectors: not a whole number of grains or qcow2 clusters, so the
+# short last grain/cluster gets exercised
+_DISK_SECTORS = 2112
+
+
+def _make_disk_data():
+    """
+    Logical disk contents for the fixtures: some data, and zeros over
+    sectors 1024-1535 so the split VMDK can use a ZERO extent there
+    """
+    data = ["\0"] * (_DISK_SECTORS * _SECTOR)
+    def fill(start, length, char):
+        data[start:start + length] = [char] * length
+    fill(0, 8192, "a")
+    fill(300000, 10000, "b")
+    fill(1000000, _DISK_SECTORS * _SECTOR - 1000000, "c")
+    return "".join(data)
+
+
+def _write_file(path, data):
+    f = open(path, "wb")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+
+def _pad(data, size=_SECTOR):
+    return data + "\0" * (-len(data) % size)
+
+
+def _make_flat_vmdk(tmpdir, data):
+    """
+    twoGbMaxExtentFlat style descriptor: two flat extents, the second
+    at a non zero offset in its file, with a ZERO extent between them
+    """
+    s1, s2 = 1024, 512
+    s3 = _DISK_SECTORS - s1 - s2
+    _write_file(os.path.join(tmpdir, "flat-f001.vmdk"),
+                data[:s1 * _SECTOR])
+    _write_file(os.path.join(tmpdir, "flat-f002.vmdk"),
+                "x" * _SECTOR + data[(s1 + s2) * _SECTOR:])
+
+    path = os.path.join(tmpdir, "flat.vmdk")
+    _write_file(path, """# Disk DescriptorFile
+version=1
+CID=fffffffe
+parentCID=ffffffff
+createType="twoGbMaxExtentFlat"
+
+# Extent description
+RW %d FLAT "flat-f001.vmdk" 0
+RW %d ZERO
+RW %d FLAT "flat-f002.vmdk" 1
+""" % (s1, s2, s3))
+    return path
+
+
+def _sparse_header(flags, gd_offset, compress=0):
+    return _pad(struct.pack("<4sIIQQQQIQQQB4sH", "KDMV", 1, flags,
+                            _DISK_SECTORS, _GRAIN_SECTORS, 1, 1, 512,
+                            0, gd_offset, 0, 0, "\n \r\n", compress))
+
+
+def _grains(data):
+    for pos in range(0, len(data), _GRAIN):
+        grain = data[pos:pos + _GRAIN]
+        if grain.count("\0") != len(grain):
+            yield pos / _GRAIN, grain
+
+
+def _make_sparse_vmdk(tmpdir, data, name="sparse.vmdk"):
+    """
+    monolithicSparse: header, embedded descriptor, grain directory,
+    one grain table, then the allocated grains
+    """
+    descriptor = _pad('# Disk DescriptorFile\nversion=1\n'
+                      'createType="monolithicSparse"\n'
+                      'RW %d SPARSE "%s"\n' % (_DISK_SECTORS, name))
+    gd_sector, gt_sector, grain_sector = 2, 3, 7
+
+    table = [0] * 512
+    grains = []
+    for idx, grain in _grains(data):
+        table[idx] = grain_sector + len(grains) * _GRAIN_SECTORS
+        grains.append(_pad(grain, _GRAIN))
+
+    out = (_sparse_header(1, gd_sector) + descriptor +
+           _pad(struct.pack("<I", gt_sector)) +
+           _pad(struct.pack("<512I", *table)) +
+           "".join(grains))
+    assert len(out) == (grain_sector + len(grains) * _GRAIN_SECTORS) * 512
+
+    path = os.path.join(tmpdir, name)
+    _write_file(path, out)
+    return path
+
+
+def _make_stream_vmdk(tmpdir, data, name="stream.vmdk"):
+    """
+    streamOptimized: deflated grains, with the grain tables and
+    directory at the end and their location only in the footer
+    """
+    flags = 1 | (1 << 16) | (1 << 17)
+    descriptor = _pad('# Disk DescriptorFile\nversion=1\n'
+                      'createType="streamOptimized"\n'
+                      'RW %d SPARSE "%s"\n' % (_DISK_SECTORS, name))
+
+    out = _sparse_header(flags, 0xffffffffffffffff, 1) + descriptor
+    table = [0] * 512
+    for idx, grain in _grains(data):
+        table[idx] = len(out) / _SECTOR
+        compressed = zlib.compress(grain)
+        out += _pad(struct.pack("<QI", idx * _GRAIN_SECTORS,
+                                len(compressed)) + compressed)
+
+    gt_sector = len(out) / _SECTOR
+    out += _pad(struct.pack("<512I", *table))
+    gd_sector = len(out) / _SECTOR
+    out += _pad(struct.pack("<I", gt_sector))
+
+    # Footer marker, footer, end of stream marker
+    out += _pad(struct.pack("<QII", 1, 0, 3))
+    out += _sparse_header(flags, gd_sector, 1)
+    out += "\0" * _SECTOR
+
+    path = os.path.join(tmpdir, name)
+    _write_file(path, out)
+    return path
+
+
+def _read_qcow2(path):
+    """
+    Read back a qcow2 image, checking that every cluster in use has a
+    refcount of exactly 1 and no others are counted. Returns the guest
+    visible disk contents.
+    """
+    f = open(path, "rb")
+    try:
+        image = f.read()
+    finally:
+        f.close()
+
+    (magic, version, ignore, ignore, cluster_bits, size, ignore,
+     l1_size, l1_offset, rt_offset, rt_clusters, ignore, ignore) = \
+        struct.unpack(">IIQIIQIIQQIIQ", image[:72])
+    assert magic == 0x514649fb
+    assert version == 2
+    cluster = 1 << cluster_bits
+    assert len(image) % cluster == 0
+    mask = 0x00fffffffffffe00
+
+    def table(offset, count):
+        entries = struct.unpack(">%dQ" % count,
+                                image[offset:offset + count * 8])
+        return [e & mask for e in entries]
+    def clusters(offset, length):
+        return range(offset / cluster, (offset + length + cluster - 1) /
+                     cluster)
+
+    used = [0]
+    used += clusters(l1_offset, l1_size * 8)
+    used += clusters(rt_offset, rt_clusters * cluster)
+
+    refcounts = {}
+    rt = table(rt_offset, rt_clusters * cluster / 8)
+    for rt_idx, block in enumerate(rt):
+        if not block:
+            continue
+        used.append(block / cluster)
+        counts = struct.unpack(">%dH" % (cluster / 2),
+                               image[block:block + cluster])
+        for idx, count in enumerate(counts):
+            refcounts[rt_idx * cluster / 2 + idx] = count
+
+    data = ["\0" * cluster] * ((size + cluster - 1) / cluster)
+    l2_entries = cluster / 8
+    for l1_idx, l2_offset in enumerate(table(l1_offset, l1_size)):
+        if not l2_offset:
+            continue
+        used.append(l2_offset / cluster)
+        for l2_idx, offset in enumerate(table(l2_offset, l2_entries)):
+            if not offset:
+                continue
+            used.append(offset / cluster)
+            data[l1_idx * l2_entries + l2_idx] = \
+                image[offset:offset + cluster]
+
+    assert len(used) == len(set(used)), "Cluster used twice"
+    for idx in range(len(image) / cluster):
+        expect = idx in used and 1 or 0
+        assert refcounts.get(idx, 0) == expect, \
+            "Cluster %d refcount %d, expected %d" % (
+                idx, refcounts.get(idx, 0), expect)
+
+    return "".join(data)[:size]
+
+
+def _read_raw(path):
+    f = open(path, "rb")
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+class TestVMDKConvert(unittest.TestCase):
+    """
+    Native VMDK reading and raw/qcow2 writing, on small generated
+    images
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = _make_disk_data()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _check_convert(self, path):
+        for fmt, readfunc in [(diskcfg.DISK_FORMAT_RAW, _read_raw),
+                              (diskcfg.DISK_FORMAT_QCOW2, _read_qcow2)]:
+            out = os.path.join(self.tmpdir, "out")
+            reader = vmdk.VMDKReader(path)
+            try:
+                self.assertEquals(reader.size, len(self.data))
+                diskcfg.stream_convert(reader, out, fmt)
+            finally:
+                reader.close()
+
+            result = readfunc(out)
+            self.assertEquals(len(result), len(self.data))
+            self.assertTrue(result == self.data,
+                            "%s to %s contents differ" %
+                            (os.path.basename(path),
+                             diskcfg.qemu_formats[fmt]))
+            os.unlink(out)
+
+    def testFlatConvert(self):
+        path = _make_flat_vmdk(self.tmpdir, self.data)
+        self.assertEquals(
+            [os.path.basename(p) for p in vmdk.get_extent_files(path)],
+            ["flat-f001.vmdk", "flat-f002.vmdk"])
+        self._check_convert(path)
+
+    def testSparseConvert(self):
+        self._check_convert(_make_sparse_vmdk(self.tmpdir, self.data))
+
+    def testStreamOptimizedConvert(self):
+        self._check_convert(_make_stream_vmdk(self.tmpdir, self.data))
+
+    def testQcow2Empty(self):
+        out = os.path.join(self.tmpdir, "empty.qcow2")
+        writer = diskcfg.qcow2.Qcow2Writer(out, 10 * 1024 * 1024)
+        writer.write(0, "\0" * 1024)
+        writer.close()
+        self.assertEquals(_read_qcow2(out), "\0" * 10 * 1024 * 1024)
+
+    def _check_truncated(self, path, extent, cut):
+        _write_file(extent, _read_raw(extent)[:-cut])
+        reader = vmdk.VMDKReader(path)
+        try:
+            try:
+                for ignore in reader.blocks():
+                    pass
+            except IOError, e:
+                self.assertTrue(os.path.basename(extent) in str(e), str(e))
+                self.assertTrue("sector" in str(e), str(e))
+            else:
+                self.fail("Truncated extent %s was read" % path)
+        finally:
+            reader.close()
+
+    def testTruncatedExtents(self):
+        # The last grain only needs to cover the end of the disk, half
+        # of it. Chop off a sector more than that.
+        path = _make_sparse_vmdk(self.tmpdir, self.data)
+        self._check_truncated(path, path, _GRAIN / 2 + _SECTOR)
+
+        path = _make_flat_vmdk(self.tmpdir, self.data)
+        self._check_truncated(path,
+                              os.path.join(self.tmpdir, "flat-f002.vmdk"),
+                              _SECTOR)
+
+    def testTruncatedCompressedGrain(self):
+        path = _make_stream_vmdk(self.tmpdir, self.data)
+        # Make the first grain claim more compressed data than is left
+        # in the file, keeping the footer the reader needs to find the
+        # tables
+        image = _read_raw(path)
+        grain = 2 * _SECTOR
+        image = (image[:grain] +
+                 struct.pack("<QI", 0, len(image)) +
+                 image[grain + 12:])
+        _write_file(path, image)
+
+        reader = vmdk.VMDKReader(path)
+        try:
+            self.assertRaises(IOError, list, reader.blocks())
+        finally:
+            reader.close()
+
+
+class TestOVAConvert(unittest.TestCase):
+    """
+    Converting disks straight out of an OVA, with no extracted copy
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = _make_disk_data()
+
+        srcdir = os.path.join(self.tmpdir, "src")
+        os.mkdir(srcdir)
+        _write_file(os.path.join(srcdir, "disk2.raw"), self.data)
+        _make_sparse_vmdk(srcdir, self.data, name="disk1.vmdk")
+        _make_stream_vmdk(srcdir, self.data, name="disk3.vmdk")
+
+        self.ova = os.path.join(self.tmpdir, "test.ova")
+        tar = tarfile.open(self.ova, "w")
+        for name in ["disk1.vmdk", "disk2.raw", "disk3.vmdk"]:
+            tar.add(os.path.join(srcdir, name), name)
+        tar.close()
+        shutil.rmtree(srcdir)
+
+        self._origgetmembers = tarfile.TarFile.getmembers
+        self.listings = []
+        def getmembers(tar):
+            self.listings.append(tar.name)
+            return self._origgetmembers(tar)
+        tarfile.TarFile.getmembers = getmembers
+
+    def tearDown(self):
+        tarfile.TarFile.getmembers = self._origgetmembers
+        shutil.rmtree(self.tmpdir)
+
+    def testArchiveConvert(self):
+        formats = [(diskcfg.DISK_FORMAT_RAW, _read_raw),
+                   (diskcfg.DISK_FORMAT_QCOW2, _read_qcow2)]
+        for member, fmt in [("disk1.vmdk", diskcfg.DISK_FORMAT_VMDK),
+                            ("disk2.raw", diskcfg.DISK_FORMAT_RAW),
+                            ("disk3.vmdk", diskcfg.DISK_FORMAT_VMDK)]:
+            for out_format, readfunc in formats:
+                d = diskcfg.disk(path=member, fmt=fmt)
+                d.archive = self.ova
+                self.assertTrue(d.input_size(member) > 0)
+
+                out = os.path.join(self.tmpdir, "out")
+                d.archive_convert(member, out, out_format)
+                self.assertTrue(readfunc(out) == self.data,
+                                "%s to %s contents differ" %
+                                (member, diskcfg.qemu_formats[out_format]))
+                os.unlink(out)
+
+        # Nothing was extracted next to the output
+        self.assertEquals(sorted(os.listdir(self.tmpdir)), ["test.ova"])
+        # And the archive was only listed once for all those disks
+        self.assertEquals(self.listings, [self.ova])
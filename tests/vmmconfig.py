@@ -0,0 +1,116 @@
+# Copyright (C) 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+
+import os
+import threading
+import unittest
+
+# Keep the tests away from the user's real settings. The schema itself
+# is compiled and found through virtcli.cliconfig, see tests/__init__
+os.environ["GSETTINGS_BACKEND"] = "memory"
+
+# pylint: disable=E0611
+from gi.repository import Gio
+from gi.repository import GLib
+# pylint: enable=E0611
+
+from virtManager.config import SettingsWrapper
+
+# pylint: disable=W0212
+# Access to protected member, needed to unittest stuff
+
+_SCHEMA = "org.virt-manager.virt-manager"
+_KEY = "/stats/update-interval"
+
+
+def _drain():
+    context = GLib.MainContext.default()
+    while context.pending():
+        context.iteration(False)
+
+
+class TestSettingsCache(unittest.TestCase):
+    def setUp(self):
+        self.conf = SettingsWrapper(_SCHEMA)
+        self.conf.set(_KEY, 1)
+        _drain()
+
+    def tearDown(self):
+        Gio.Settings.new(_SCHEMA + ".stats").reset("update-interval")
+        _drain()
+
+    def testSet(self):
+        self.assertEquals(self.conf.get(_KEY), 1)
+        self.assertTrue(self.conf.is_cached(_KEY))
+
+        self.conf.set(_KEY, 5)
+        self.assertEquals(self.conf.get(_KEY), 5)
+
+    def testChanged(self):
+        self.assertEquals(self.conf.get(_KEY), 1)
+
+        # Someone else, like another virt-manager, changes the value
+        other = Gio.Settings.new(_SCHEMA + ".stats")
+        other.set_int("update-interval", 7)
+        _drain()
+        self.assertEquals(self.conf.get(_KEY), 7)
+
+    def testSetRacesGet(self):
+        """
+        The tick thread reads the old value, then the main thread sets
+        a new one before the read is cached. The old value must not
+        stick in the cache.
+        """
+        reading = threading.Event()
+        written = threading.Event()
+        origcmd = self.conf._cmd_helper
+        reader = []
+
+        def cmd_helper(cmd, key, *args, **kwargs):
+            ret = origcmd(cmd, key, *args, **kwargs)
+            if cmd == "get_value" and threading.currentThread() in reader:
+                reading.set()
+                written.wait(5)
+            elif cmd == "set_value":
+                written.set()
+            return ret
+        self.conf._cmd_helper = cmd_helper
+
+        self.assertFalse(self.conf.is_cached(_KEY))
+        thread = threading.Thread(target=self.conf.get, args=(_KEY,))
+        reader.append(thread)
+        thread.start()
+        reading.wait(5)
+
+        setter = threading.Thread(target=self.conf.set, args=(_KEY, 5))
+        setter.start()
+        thread.join()
+        setter.join()
+
+        self.assertEquals(self.conf.get(_KEY), 5)
+
+    def testPreload(self):
+        key = "/vms/00001111222233334444555566667777/scaling"
+        self.assertFalse(self.conf.is_cached(key))
+        self.conf.preload_vm_settings(key)
+        self.assertTrue(self.conf.is_cached(key))
+        self.assertTrue(self.conf.is_cached(
+            key.rsplit("/", 1)[0] + "/serial-capture"))
+
+        value = self.conf.get(key)
+        self.conf.set(key, value + 1)
+        self.assertEquals(self.conf.get(key), value + 1)
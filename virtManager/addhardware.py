@@ -101,10 +101,8 @@ class vmmAddHardware(vmmGObjectUI):
         })
         self.bind_escape_key_close()
 
-        self.fsDetails = vmmFSDetails(vm)
-        fsbox = self.widget("fs-box")
-        fsbox.add(self.fsDetails.topwin)
-        self.fsDetails.topwin.show_all()
+        # Parses its own .ui file, so wait until the page is first shown
+        self.fsDetails = None
 
         self.set_initial_state()
 
@@ -134,7 +132,9 @@ class vmmAddHardware(vmmGObjectUI):
             self.storage_browser.cleanup()
             self.storage_browser = None
 
-        self.fsDetails.cleanup()
+        if self.fsDetails:
+            self.fsDetails.cleanup()
+            self.fsDetails = None
 
     def is_visible(self):
         return self.topwin.get_visible()
@@ -302,9 +302,6 @@ class vmmAddHardware(vmmGObjectUI):
         combo = self.widget("watchdog-action")
         uihelpers.build_watchdogaction_combo(self.vm, combo)
 
-        # Filesystem widgets
-        self.fsDetails.set_initial_state()
-
         # Smartcard widgets
         combo = self.widget("smartcard-mode")
         uihelpers.build_smartcard_mode_combo(self.vm, combo)
@@ -483,7 +480,8 @@ class vmmAddHardware(vmmGObjectUI):
         self.widget("char-auto-socket").set_active(True)
 
         # FS params
-        self.fsDetails.reset_state()
+        if self.fsDetails:
+            self.fsDetails.reset_state()
 
         # Video params
         uihelpers.populate_video_combo(self.vm, self.widget("video-model"))
@@ -986,6 +984,13 @@ class vmmAddHardware(vmmGObjectUI):
             self.populate_host_device_model(devtype, devcap,
                                             subtype, subcap)
 
+        if page == PAGE_FILESYSTEM and self.fsDetails is None:
+            self.fsDetails = vmmFSDetails(self.vm)
+            self.fsDetails.set_initial_state()
+            self.fsDetails.reset_state()
+            self.widget("fs-box").add(self.fsDetails.topwin)
+            self.fsDetails.topwin.show_all()
+
         self.set_page_title(page)
         notebook.get_nth_page(page).show()
         notebook.set_current_page(page)
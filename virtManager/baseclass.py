@@ -18,9 +18,12 @@
 # MA 02110-1301 USA.
 #
 
+import collections
 import logging
 import os
 import sys
+import threading
+import time
 import traceback
 
 from virtManager import config
@@ -33,6 +36,80 @@ from gi.repository import Gtk
 # pylint: enable=E0611
 
 
+class _IdleEmitter(object):
+    """
+    Deliver vmmGObject.idle_emit signals from the main loop. Everything
+    emitted while a delivery is pending goes out from the same main loop
+    callback, so a tick that signals for hundreds of VMs costs a single
+    idle source instead of one each.
+
+    A repeat of an emission that is still queued is dropped, as long as
+    the same object hasn't queued that signal with other arguments
+    since. Delivery stops after BUDGET seconds, the rest waits for the
+    next main loop iteration so the UI gets to redraw.
+    """
+    BUDGET = .02
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # serial -> (obj, signal, args), in order of emission
+        self._queue = collections.OrderedDict()
+        # (obj, signal) -> (serial, args) of its last queued emission
+        self._last = {}
+        self._serial = 0
+        self._scheduled = False
+
+    def add(self, obj, signal, args):
+        self._lock.acquire()
+        try:
+            last = self._last.get((obj, signal))
+            if not (last and last[0] in self._queue and last[1] == args):
+                self._serial += 1
+                self._queue[self._serial] = (obj, signal, args)
+                self._last[(obj, signal)] = (self._serial, args)
+
+            if self._scheduled:
+                return
+            self._scheduled = True
+        finally:
+            self._lock.release()
+
+        GLib.idle_add(self._dispatch)
+
+    def _pop(self):
+        self._lock.acquire()
+        try:
+            if not self._queue:
+                self._scheduled = False
+                return None
+
+            serial, item = self._queue.popitem(last=False)
+            obj, signal, ignore = item
+            if self._last[(obj, signal)][0] == serial:
+                del self._last[(obj, signal)]
+            return item
+        finally:
+            self._lock.release()
+
+    def _dispatch(self):
+        end = time.time() + self.BUDGET
+        while True:
+            item = self._pop()
+            if item is None:
+                return False
+
+            obj, signal, args = item
+            try:
+                obj.emit(signal, *args)
+            except:
+                print traceback.format_exc()
+
+            if time.time() >= end:
+                return True
+
+_idle_emitter = _IdleEmitter()
+
+
 class vmmGObject(GObject.GObject):
     _leak_check = True
 
@@ -146,13 +223,10 @@ class vmmGObject(GObject.GObject):
 
     def idle_emit(self, signal, *args):
         """
-        Safe wrapper for using 'self.emit' with GLib.idle_add
+        Thread safe wrapper for 'self.emit', the signal is delivered
+        from the main loop. See _IdleEmitter
         """
-        def emitwrap(_s, *_a):
-            self.emit(_s, *_a)
-            return False
-
-        self.idle_add(emitwrap, signal, *args)
+        _idle_emitter.add(self, signal, args)
 
     def timeout_add(self, timeout, func, *args):
         """
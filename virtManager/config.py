@@ -19,6 +19,7 @@
 #
 import os
 import logging
+import threading
 
 # pylint: disable=E0611
 from gi.repository import Gio
@@ -36,11 +37,40 @@ class SettingsWrapper(object):
         self._root = settings_id
         self._settings = Gio.Settings.new(self._root)
 
-        self._settingsmap = {"": self._settings}
+        # Unpacked values we've read, keyed by key path minus the outer
+        # slashes. Entries are dropped when GSettings reports a change,
+        # so UI code can call get() as often as it likes.
+        #
+        # The tick thread reads settings too, so reading a value and
+        # caching it happen under _cache_lock. A set() from the main
+        # thread drops the entry only after writing the new value, so a
+        # racing read can't leave the old value in the cache.
+        self._value_cache = {}
+        self._cache_lock = threading.Lock()
+
+        self._settingsmap = {}
         self._handler_map = {}
+        self._add_settings("", self._settings)
         for child in self._settings.list_children():
             childschema = self._root + "." + child
-            self._settingsmap[child] = Gio.Settings.new(childschema)
+            self._add_settings(child, Gio.Settings.new(childschema))
+
+    def _add_settings(self, settingskey, settings):
+        self._settingsmap[settingskey] = settings
+        settings.connect("changed", self._settings_changed, settingskey)
+
+    def _settings_changed(self, settings, key, settingskey):
+        ignore = settings
+        if settingskey:
+            key = settingskey + "/" + key
+        self._uncache(key)
+
+    def _uncache(self, key):
+        self._cache_lock.acquire()
+        try:
+            self._value_cache.pop(key.strip("/"), None)
+        finally:
+            self._cache_lock.release()
 
 
     def _parse_key(self, key):
@@ -53,14 +83,40 @@ class SettingsWrapper(object):
     def make_vm_settings(self, key):
         settingskey = self._parse_key(key)[0]
 
-        if settingskey in self._settingsmap:
+        self._cache_lock.acquire()
+        try:
+            if settingskey in self._settingsmap:
+                return True
+
+            schema = self._root + ".vm"
+            path = ("/" + self._root.replace(".", "/") +
+                    key.rsplit("/", 1)[0] + "/")
+            self._add_settings(settingskey,
+                               Gio.Settings.new_with_path(schema, path))
             return True
+        finally:
+            self._cache_lock.release()
+
+    def preload_vm_settings(self, key):
+        """
+        Create the settings for the VM that key belongs to, and read
+        all of that VM's values into the cache
+        """
+        self.make_vm_settings(key)
+        settingskey = self._parse_key(key)[0]
+        settings = self._settingsmap[settingskey]
+        self._cache_lock.acquire()
+        try:
+            for subkey in settings.list_keys():
+                cachekey = settingskey + "/" + subkey
+                if cachekey not in self._value_cache:
+                    self._value_cache[cachekey] = settings.get_value(
+                        subkey).unpack()
+        finally:
+            self._cache_lock.release()
 
-        schema = self._root + ".vm"
-        path = "/" + self._root.replace(".", "/") + key.rsplit("/", 1)[0] + "/"
-        self._settingsmap[settingskey] = Gio.Settings.new_with_path(schema,
-                                                                    path)
-        return True
+    def is_cached(self, key):
+        return key.strip("/") in self._value_cache
 
     def _find_settings(self, key):
         settingskey, value = self._parse_key(key)
@@ -82,12 +138,27 @@ class SettingsWrapper(object):
         return settings.disconnect(h)
 
     def get(self, key):
-        return self._cmd_helper("get_value", key).unpack()
+        cachekey = key.strip("/")
+        self._cache_lock.acquire()
+        try:
+            if cachekey not in self._value_cache:
+                self._value_cache[cachekey] = self._cmd_helper(
+                    "get_value", key).unpack()
+            ret = self._value_cache[cachekey]
+        finally:
+            self._cache_lock.release()
+
+        if type(ret) is list:
+            # Don't let callers modify the cached copy
+            ret = ret[:]
+        return ret
     def set(self, key, value, *args, **kwargs):
         fmt = self._cmd_helper("get_value", key).get_type_string()
-        return self._cmd_helper("set_value", key,
-                                GLib.Variant(fmt, value),
-                                *args, **kwargs)
+        ret = self._cmd_helper("set_value", key,
+                               GLib.Variant(fmt, value),
+                               *args, **kwargs)
+        self._uncache(key)
+        return ret
 
 
 class vmmConfig(object):
@@ -171,7 +242,7 @@ class vmmConfig(object):
 
         self._objects = []
 
-        self.support_inspection = self.check_inspection()
+        self._support_inspection = None
 
         self._spice_error = None
 
@@ -179,6 +250,14 @@ class vmmConfig(object):
         running_config = self
 
 
+    def _get_support_inspection(self):
+        # Loading guestfs and launching a handle is slow, so don't check
+        # until something asks
+        if self._support_inspection is None:
+            self._support_inspection = self.check_inspection()
+        return self._support_inspection
+    support_inspection = property(_get_support_inspection)
+
     def check_inspection(self):
         try:
             # Check we can open the Python guestfs module.
@@ -229,9 +308,20 @@ class vmmConfig(object):
 
     def get_pervm(self, uuid, key):
         key = self._make_pervm_key(uuid, key)
-        self.conf.make_vm_settings(key)
+        if not self.conf.is_cached(key):
+            self.conf.make_vm_settings(key)
         return self.conf.get(key)
 
+    def preload_pervm(self, uuids):
+        """
+        Load the settings of all the passed VMs in one go, so later
+        get_pervm calls don't need to touch GSettings
+        """
+        for uuid in uuids:
+            # Any of the VM's keys will do, all of them get loaded
+            key = self._make_pervm_key(uuid, "/scaling")
+            self.conf.preload_vm_settings(key)
+
 
     ###################
     # General helpers #
@@ -386,6 +476,11 @@ class vmmConfig(object):
     def set_auto_redirection(self, state):
         self.conf.set("/console/auto-redirect", state)
 
+    def get_serial_capture_max_size(self):
+        return self.conf.get("/console/serial-capture-max-size")
+    def get_serial_capture_backups(self):
+        return self.conf.get("/console/serial-capture-backups")
+
     # Show VM details toolbar
     def get_details_show_toolbar(self):
         res = self.conf.get("/details/show-toolbar")
@@ -33,6 +33,7 @@ import traceback
 import libvirt
 import virtinst
 from virtinst import pollhelpers
+from virtinst import rpcstats
 from virtinst import util
 
 from virtManager import connectauth
@@ -45,6 +46,9 @@ from virtManager.network import vmmNetwork
 from virtManager.nodedev import vmmNodeDevice
 from virtManager.storagepool import vmmStoragePool
 
+# How often to log the libvirt call stats of each connection, in seconds
+_RPC_LOG_INTERVAL = 300
+
 
 class vmmConnection(vmmGObject):
     __gsignals__ = {
@@ -88,7 +92,13 @@ class vmmConnection(vmmGObject):
         self.state = self.STATE_DISCONNECTED
         self.connectThread = None
         self.connectError = None
+
+        # Count libvirt calls, see get_rpc_stats
+        rpcstats.enable()
         self._backend = virtinst.VirtualConnection(self._uri)
+        self._rpc_tick_calls = 0
+        self._rpc_log_time = 0
+        self._hostspace = None
 
         self._caps = None
         self._caps_xml = None
@@ -211,6 +221,24 @@ class vmmConnection(vmmGObject):
     def get_backend(self):
         return self._backend
 
+    def get_rpc_stats(self):
+        return self._backend.get_rpc_stats()
+    def get_rpc_tick_calls(self):
+        """
+        Number of libvirt calls made while the last tick ran
+        """
+        return self._rpc_tick_calls
+
+    def get_host_space(self):
+        """
+        The vmmHostSpace tracking free space in the default storage
+        location
+        """
+        if not self._hostspace:
+            from virtManager.hostspace import vmmHostSpace
+            self._hostspace = vmmHostSpace(self)
+        return self._hostspace
+
     def invalidate_caps(self):
         return self._backend.invalidate_caps()
     caps = property(lambda self: getattr(self, "_backend").caps)
@@ -835,9 +863,14 @@ class vmmConnection(vmmGObject):
             for dev in devs.values():
                 dev.cleanup()
 
+        self._log_rpc_stats(force=True)
         self._backend.close()
         self.record = []
 
+        if self._hostspace:
+            self._hostspace.cleanup()
+            self._hostspace = None
+
         cleanup(self.nodedevs)
         self.nodedevs = {}
 
@@ -1031,6 +1064,9 @@ class vmmConnection(vmmGObject):
         if not pollvm:
             stats_update = False
 
+        callstats = self.get_rpc_stats()
+        rpcstart = callstats and callstats.get_total_calls() or 0
+
         self.hostinfo = self._backend.getInfo()
 
         (goneNets, newNets, nets) = self._update_nets(pollnet)
@@ -1068,6 +1104,10 @@ class vmmConnection(vmmGObject):
             for uuid, obj in goneVMs.items():
                 self.emit("vm-removed", uuid)
                 obj.cleanup()
+            if newVMs:
+                # The details and manager windows read per-VM settings for
+                # every new VM, fetch them all up front
+                self.config.preload_pervm(newVMs.keys())
             for uuid, obj in newVMs.items():
                 ignore = obj
                 self.emit("vm-added", uuid)
@@ -1153,12 +1193,30 @@ class vmmConnection(vmmGObject):
                                   "connection doesn't seem to have dropped. "
                                   "Ignoring.")
 
+        if callstats:
+            self._rpc_tick_calls = callstats.get_total_calls() - rpcstart
+            self._log_rpc_stats()
+
         if stats_update:
             self._recalculate_stats(updateVMs.values())
             self.idle_emit("resources-sampled")
 
         return 1
 
+    def _log_rpc_stats(self, force=False):
+        callstats = self.get_rpc_stats()
+        if not callstats:
+            return
+
+        now = time.time()
+        if not force and now - self._rpc_log_time < _RPC_LOG_INTERVAL:
+            return
+        self._rpc_log_time = now
+
+        logging.debug("libvirt calls for %s: %d total, %d in last tick\n%s",
+                      self.get_uri(), callstats.get_total_calls(),
+                      self._rpc_tick_calls, callstats.format(count=15))
+
     def _recalculate_stats(self, vms):
         if not self._backend.is_open():
             return
@@ -31,12 +31,17 @@ from gi.repository import SpiceClientGLib
 
 import libvirt
 
+import atexit
+import hashlib
 import logging
 import os
-import Queue
+import shutil
 import signal
 import socket
+import subprocess
+import tempfile
 import threading
+import time
 
 import virtManager.uihelpers as uihelpers
 from virtManager.autodrawer import AutoDrawer
@@ -116,40 +121,197 @@ class ConnectionInfo(object):
         return True
 
 
-class _TunnelScheduler(object):
+class _SSHMaster(object):
     """
-    If the user is using Spice + SSH URI + no SSH keys, we need to
-    serialize connection opening otherwise ssh-askpass gets all angry.
-    This handles the locking and scheduling.
+    A persistent 'ssh -M' connection to one host. Tunnels are run as
+    ssh sessions multiplexed over it, so only the first console opened
+    to a host pays for the ssh handshake and authentication, and any
+    number of tunnels can be set up at once.
+    """
+    # How long we wait for the master to authenticate, in seconds
+    START_TIMEOUT = 300
+
+    def __init__(self, ctlpath, host, port, user):
+        self.ctlpath = ctlpath
+        self.host = host
+        self.port = port
+        self.user = user
+
+        self._proc = None
+        self._errfile = None
+        self._lock = threading.Lock()
+
+    def _build_argv(self, batch):
+        argv = ["ssh", "-N",
+                "-o", "ControlMaster=yes",
+                "-o", "ControlPath=%s" % self.ctlpath]
+        if batch:
+            argv += ["-o", "BatchMode=yes"]
+        if self.port:
+            argv += ["-p", str(self.port)]
+        if self.user:
+            argv += ["-l", self.user]
+        argv += [self.host]
+        return argv
+
+    def _start(self, batch):
+        argv = self._build_argv(batch)
+        logging.debug("Starting SSH master: %s", " ".join(argv))
+        # stderr goes to a file rather than a pipe. Nothing reads from
+        # the master once it's up, and a full pipe would block it along
+        # with every tunnel multiplexed over it.
+        self._errfile = tempfile.TemporaryFile(prefix="virt-manager-ssh")
+        devnull = open(os.devnull, "r+")
+        try:
+            self._proc = subprocess.Popen(argv, stdin=devnull,
+                                          stdout=devnull,
+                                          stderr=self._errfile,
+                                          close_fds=True)
+        finally:
+            devnull.close()
+
+        # The control socket shows up once the master is authenticated
+        endtime = time.time() + self.START_TIMEOUT
+        while time.time() < endtime:
+            if os.path.exists(self.ctlpath):
+                return True
+            if self._proc.poll() is not None:
+                break
+            time.sleep(.1)
+
+        errout = None
+        if self._proc.poll() is not None:
+            self._errfile.seek(0)
+            errout = self._errfile.read()
+        logging.debug("SSH master for %s failed to start: %s",
+                      self.host, errout or "timed out")
+        self.close()
+        return False
+
+    def is_running(self):
+        return bool(self._proc and self._proc.poll() is None and
+                    os.path.exists(self.ctlpath))
+
+    def start(self, askpass_lock):
+        """
+        Make sure the master is running, starting it if needed. Blocks
+        until it is ready, so call it from a thread. Returns False if
+        the master couldn't be started.
+
+        We first try without any prompting, which lets masters for
+        different hosts authenticate in parallel. If that fails, we
+        allow password prompts, but only one at a time across the app,
+        otherwise ssh-askpass gets all angry.
+        """
+        self._lock.acquire()
+        try:
+            if self.is_running():
+                return True
+            self.close()
+
+            if self._start(True):
+                return True
+
+            askpass_lock.acquire()
+            try:
+                return self._start(False)
+            finally:
+                askpass_lock.release()
+        finally:
+            self._lock.release()
+
+    def get_client_args(self):
+        return ["-o", "ControlMaster=no",
+                "-o", "ControlPath=%s" % self.ctlpath]
+
+    def close(self):
+        if self._proc and self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+        self._proc = None
+
+        if self._errfile:
+            self._errfile.close()
+            self._errfile = None
+
+        if os.path.exists(self.ctlpath):
+            os.unlink(self.ctlpath)
+
+
+class _TunnelManager(object):
+    """
+    Sets up console tunnels, each from its own thread so they don't
+    wait on each other. Tunnels to the same host share one _SSHMaster,
+    which is kept around for the whole app run so reopening a console
+    is quick.
+
+    If we can't get a master running, we fall back to a standalone ssh
+    process per tunnel. If the user is using Spice + SSH URI + no SSH
+    keys, we need to serialize those, otherwise ssh-askpass gets all
+    angry, so such launches hold a lock until the viewer unlocks it.
 
-    It's only instantiated once for the whole app, because we serialize
-    independent of connection, vm, etc.
+    It's only instantiated once for the whole app.
     """
     def __init__(self):
-        self._thread = threading.Thread(name="Tunnel thread",
-                                        target=self._handle_queue,
-                                        args=())
-        self._thread.daemon = True
-        self._queue = Queue.Queue()
+        self._masters = {}
         self._lock = threading.Lock()
+        self._askpass_lock = threading.Lock()
+        self._ctldir = None
 
-    def _handle_queue(self):
-        while True:
-            cb, args, = self._queue.get()
-            self.lock()
-            vmmGObject.idle_add(cb, *args)
-
-    def schedule(self, cb, *args):
-        if not self._thread.is_alive():
-            self._thread.start()
-        self._queue.put((cb, args))
+    def _get_master(self, ginfo):
+        host, port, ignore = ginfo.get_conn_host()
+        key = (host, port, ginfo.connuser)
 
-    def lock(self):
         self._lock.acquire()
+        try:
+            if key not in self._masters:
+                if not self._ctldir:
+                    self._ctldir = tempfile.mkdtemp(prefix="virt-manager-ssh")
+                    atexit.register(self.close_all)
+
+                # Socket paths are length limited, so keep it short
+                name = hashlib.sha1(repr(key)).hexdigest()[:16]
+                self._masters[key] = _SSHMaster(
+                    os.path.join(self._ctldir, name),
+                    host, port, ginfo.connuser)
+            return self._masters[key]
+        finally:
+            self._lock.release()
+
+    def _launch(self, tunnel, ginfo):
+        master = self._get_master(ginfo)
+        if master.start(self._askpass_lock):
+            vmmGObject.idle_add(tunnel.launch, ginfo,
+                                master.get_client_args())
+            return
+
+        self._askpass_lock.acquire()
+        tunnel.locked = True
+        vmmGObject.idle_add(tunnel.launch, ginfo, [])
+
+    def schedule(self, tunnel, ginfo):
+        thread = threading.Thread(name="Tunnel thread",
+                                  target=self._launch,
+                                  args=(tunnel, ginfo))
+        thread.daemon = True
+        thread.start()
+
     def unlock(self):
-        self._lock.release()
+        self._askpass_lock.release()
 
-_tunnel_sched = _TunnelScheduler()
+    def close_all(self):
+        self._lock.acquire()
+        try:
+            for master in self._masters.values():
+                master.close()
+            self._masters = {}
+            if self._ctldir:
+                shutil.rmtree(self._ctldir, ignore_errors=True)
+            self._ctldir = None
+        finally:
+            self._lock.release()
+
+_tunnel_manager = _TunnelManager()
 
 
 class _Tunnel(object):
@@ -161,11 +323,14 @@ class _Tunnel(object):
         self._errfds = None
         self.closed = False
 
-    def open(self, ginfo):
+        # Whether launching this tunnel took the askpass lock
+        self.locked = False
+
+    def open(self):
         self._outfds = socket.socketpair()
         self._errfds = socket.socketpair()
 
-        return self._outfds[0].fileno(), self._launch_tunnel, ginfo
+        return self._outfds[0].fileno()
 
     def close(self):
         if self.closed:
@@ -213,14 +378,14 @@ class _Tunnel(object):
 
         return errout
 
-    def _launch_tunnel(self, ginfo):
+    def launch(self, ginfo, sshopts):
         if self.closed:
             return -1
 
         host, port, ignore = ginfo.get_conn_host()
 
         # Build SSH cmd
-        argv = ["ssh", "ssh"]
+        argv = ["ssh", "ssh"] + sshopts
         if port:
             argv += ["-p", str(port)]
 
@@ -296,9 +461,9 @@ class Tunnels(object):
 
     def open_new(self):
         t = _Tunnel()
-        fd, cb, args = t.open(self.ginfo)
+        fd = t.open()
         self._tunnels.append(t)
-        _tunnel_sched.schedule(cb, args)
+        _tunnel_manager.schedule(t, self.ginfo)
 
         return fd
 
@@ -312,8 +477,16 @@ class Tunnels(object):
             errout += l.get_err_output()
         return errout
 
-    lock = _tunnel_sched.lock
-    unlock = _tunnel_sched.unlock
+    def unlock(self):
+        """
+        Called by the viewer once a tunnel is connected. Releases the
+        askpass lock if one of our tunnels was launched holding it.
+        """
+        for t in self._tunnels:
+            if t.locked:
+                t.locked = False
+                _tunnel_manager.unlock()
+                return
 
 
 class Viewer(vmmGObject):
@@ -0,0 +1,356 @@
+#
+# Copyright (C) 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+#
+
+"""
+Capture of serial console output to an append only log file.
+
+Next to each log we keep a line index: a file of little endian 64 bit
+byte offsets, one for the start of every INDEX_INTERVAL'th line. That
+lets us read any range of lines of a large capture without scanning
+it from the start.
+"""
+
+import logging
+import os
+import Queue
+import struct
+import threading
+
+INDEX_INTERVAL = 256
+_INDEX_ENTRY = "<Q"
+_INDEX_ENTRY_SIZE = struct.calcsize(_INDEX_ENTRY)
+
+
+def _index_path(path):
+    return path + ".idx"
+
+
+def _rotated_path(path, num):
+    return "%s.%d" % (path, num)
+
+
+class _LineCounter(object):
+    """
+    Track line starts in a stream of data, recording the offset of
+    every INDEX_INTERVAL'th one
+    """
+    def __init__(self, offset=0, lines=0):
+        self.offset = offset
+        self.lines = lines
+
+    def feed(self, data):
+        """
+        Account for data, returning the offsets of any indexed line
+        starts in it
+        """
+        ret = []
+        newlines = data.count("\n")
+        nextmark = (self.lines / INDEX_INTERVAL + 1) * INDEX_INTERVAL
+
+        if self.lines + newlines >= nextmark:
+            pos = -1
+            for ignore in range(newlines):
+                pos = data.index("\n", pos + 1)
+                self.lines += 1
+                if self.lines % INDEX_INTERVAL == 0:
+                    ret.append(self.offset + pos + 1)
+        else:
+            self.lines += newlines
+
+        self.offset += len(data)
+        return ret
+
+
+def _read_index(path):
+    if not os.path.exists(_index_path(path)):
+        return []
+
+    f = file(_index_path(path), "rb")
+    try:
+        data = f.read()
+    finally:
+        f.close()
+
+    count = len(data) / _INDEX_ENTRY_SIZE
+    return list(struct.unpack("<%dQ" % count,
+                              data[:count * _INDEX_ENTRY_SIZE]))
+
+
+def get_capture_files(path):
+    """
+    Return the paths of the capture log and whichever of its rotated
+    predecessors exist, oldest first
+    """
+    ret = []
+    num = 1
+    while os.path.exists(_rotated_path(path, num)):
+        ret.insert(0, _rotated_path(path, num))
+        num += 1
+    if os.path.exists(path):
+        ret.append(path)
+    return ret
+
+
+def _build_index(path):
+    """
+    Scan a capture file to recreate its index, returning the counter
+    state at the end of the file
+    """
+    counter = _LineCounter()
+    offsets = [0]
+    f = file(path, "rb")
+    try:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            offsets += counter.feed(data)
+    finally:
+        f.close()
+
+    out = file(_index_path(path), "wb")
+    try:
+        out.write(struct.pack("<%dQ" % len(offsets), *offsets))
+    finally:
+        out.close()
+    return counter
+
+
+class ConsoleCapture(object):
+    """
+    Append console output to path from a background thread, so slow
+    disks never hold up the UI. Once the log grows past maxsize it is
+    rotated to path.1, path.1 to path.2 and so on, keeping 'backups'
+    old logs.
+    """
+    def __init__(self, path, maxsize, backups):
+        self.path = path
+        self.maxsize = maxsize
+        self.backups = backups
+
+        self._queue = Queue.Queue()
+        self._fobj = None
+        self._idxobj = None
+        self._counter = None
+
+        self._thread = threading.Thread(target=self._run,
+                                        name="Console capture %s" % path)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, data):
+        """
+        Queue data to be appended to the log. Safe to call from the UI
+        """
+        if data:
+            self._queue.put(data)
+
+    def close(self):
+        """
+        Write out anything queued, and stop the writer thread
+        """
+        if not self._thread:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+
+    #################
+    # Writer thread #
+    #################
+
+    def _open(self):
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname, 0700)
+
+        if os.path.exists(self.path):
+            # Appending to an older capture, pick up where it left off
+            index = _read_index(self.path)
+            if index and index[-1] <= os.path.getsize(self.path):
+                self._counter = _LineCounter(index[-1],
+                                             (len(index) - 1) *
+                                             INDEX_INTERVAL)
+                f = file(self.path, "rb")
+                try:
+                    f.seek(index[-1])
+                    offsets = self._counter.feed(f.read())
+                finally:
+                    f.close()
+
+                if offsets:
+                    f = file(_index_path(self.path), "ab")
+                    f.write(struct.pack("<%dQ" % len(offsets), *offsets))
+                    f.close()
+            else:
+                self._counter = _build_index(self.path)
+        else:
+            self._counter = _LineCounter()
+            f = file(_index_path(self.path), "wb")
+            f.write(struct.pack(_INDEX_ENTRY, 0))
+            f.close()
+
+        self._fobj = file(self.path, "ab")
+        self._idxobj = file(_index_path(self.path), "ab")
+
+    def _close_files(self):
+        for f in [self._fobj, self._idxobj]:
+            if f:
+                f.close()
+        self._fobj = None
+        self._idxobj = None
+
+    def _rotate(self):
+        self._close_files()
+        logging.debug("Rotating console capture %s", self.path)
+
+        for num in range(self.backups, 0, -1):
+            src = num > 1 and _rotated_path(self.path, num - 1) or self.path
+            dest = _rotated_path(self.path, num)
+            for s, d in [(src, dest), (_index_path(src), _index_path(dest))]:
+                if os.path.exists(s):
+                    os.rename(s, d)
+
+        for p in [self.path, _index_path(self.path)]:
+            if os.path.exists(p):
+                os.unlink(p)
+        self._open()
+
+    def _append(self, data):
+        if (self._counter.offset and
+            self._counter.offset + len(data) > self.maxsize):
+            self._rotate()
+
+        self._fobj.write(data)
+        self._fobj.flush()
+
+        offsets = self._counter.feed(data)
+        if offsets:
+            self._idxobj.write(struct.pack("<%dQ" % len(offsets), *offsets))
+            self._idxobj.flush()
+
+    def _run(self):
+        try:
+            self._open()
+        except Exception:
+            logging.exception("Error opening console capture %s", self.path)
+            self._open_failed()
+            return
+
+        try:
+            while True:
+                data = self._queue.get()
+                if data is None:
+                    break
+
+                # Batch up whatever else arrived while we were busy
+                chunks = [data]
+                done = False
+                while True:
+                    try:
+                        data = self._queue.get_nowait()
+                    except Queue.Empty:
+                        break
+                    if data is None:
+                        done = True
+                        break
+                    chunks.append(data)
+
+                self._append("".join(chunks))
+                if done:
+                    break
+        except Exception:
+            logging.exception("Error writing console capture %s", self.path)
+        self._close_files()
+
+    def _open_failed(self):
+        # Drain the queue so write() callers don't keep memory pinned
+        while self._queue.get() is not None:
+            pass
+
+
+class CaptureReader(object):
+    """
+    Random access to the lines of a capture log, via its index
+    """
+    def __init__(self, path):
+        self.path = path
+        self._index = _read_index(path)
+        if not self._index:
+            _build_index(path)
+            self._index = _read_index(path)
+
+    def _open_at_line(self, lineno):
+        """
+        Return a file object positioned at the start of line lineno
+        """
+        mark = min(lineno / INDEX_INTERVAL, len(self._index) - 1)
+        f = file(self.path, "rb")
+        f.seek(self._index[mark])
+        for ignore in xrange(lineno - mark * INDEX_INTERVAL):
+            if not f.readline():
+                break
+        return f
+
+    def get_line_count(self):
+        f = self._open_at_line((len(self._index) - 1) * INDEX_INTERVAL)
+        try:
+            count = (len(self._index) - 1) * INDEX_INTERVAL
+            for ignore in f:
+                count += 1
+            return count
+        finally:
+            f.close()
+
+    def read_lines(self, first, count):
+        """
+        Return up to count lines, starting with line number first
+        """
+        ret = []
+        f = self._open_at_line(first)
+        try:
+            for ignore in xrange(count):
+                line = f.readline()
+                if not line:
+                    break
+                ret.append(line)
+        finally:
+            f.close()
+        return ret
+
+    def search(self, text, first=0, maxresults=None):
+        """
+        Return a list of (line number, line) for the lines containing
+        text, case insensitively, starting from line number first
+        """
+        text = text.lower()
+        ret = []
+        f = self._open_at_line(first)
+        try:
+            lineno = first
+            for line in f:
+                if text in line.lower():
+                    ret.append((lineno, line))
+                    if maxresults and len(ret) >= maxresults:
+                        break
+                lineno += 1
+        finally:
+            f.close()
+        return ret
@@ -18,6 +18,7 @@
 # MA 02110-1301 USA.
 #
 
+import bisect
 import logging
 import traceback
 
@@ -380,8 +381,11 @@ class vmmDetails(vmmGObjectUI):
 
         from virtManager.console import vmmConsolePages
         self.console = vmmConsolePages(self.vm, self.builder, self.topwin)
-        self.snapshots = vmmSnapshotPage(self.vm, self.builder, self.topwin)
-        self.widget("snapshot-placeholder").add(self.snapshots.top_box)
+
+        # These parse their own .ui files, so wait until their page is
+        # first shown
+        self.snapshots = None
+        self.fsDetails = None
 
         # Set default window size
         w, h = self.vm.get_details_window_size()
@@ -389,6 +393,11 @@ class vmmDetails(vmmGObjectUI):
 
         self.oldhwkey = None
         self.addhwmenu = None
+
+        # Set when the VM changed while the hardware pages weren't
+        # showing, so they get refreshed once they are
+        self._details_dirty = True
+
         self.keycombo_menu = None
         self.init_menus()
         self.init_details()
@@ -554,17 +563,11 @@ class vmmDetails(vmmGObjectUI):
         self.vm.connect("config-changed", self.refresh_vm_state)
         self.vm.connect("resources-sampled", self.refresh_resources)
 
-        self.fsDetails = vmmFSDetails(self.vm)
-        self.fsDetails.set_initial_state()
-        fsAlignment = self.widget("fs-alignment")
-        fsAlignment.add(self.fsDetails.topwin)
-        self.fsDetails.connect("changed", lambda *x: self.enable_apply(x,
-                                           EDIT_FS))
-
         self.populate_hw_list()
         self.repopulate_boot_list()
 
-        self.hw_selected()
+        # Pages are filled in when first shown, see page_refresh
+        self.set_hw_selection(0)
         self.refresh_vm_state()
 
     def _cleanup(self):
@@ -585,14 +588,17 @@ class vmmDetails(vmmGObjectUI):
 
         self.console.cleanup()
         self.console = None
-        self.snapshots.cleanup()
-        self.snapshots = None
+        if self.snapshots:
+            self.snapshots.cleanup()
+            self.snapshots = None
 
         self.vm = None
         self.conn = None
         self.addhwmenu = None
 
-        self.fsDetails.cleanup()
+        if self.fsDetails:
+            self.fsDetails.cleanup()
+            self.fsDetails = None
 
     def show(self):
         logging.debug("Showing VM details: %s", self.vm)
@@ -601,8 +607,6 @@ class vmmDetails(vmmGObjectUI):
         if vis:
             return
 
-        self.fsDetails.topwin.show_all()
-
         self.emit("details-opened")
         self.refresh_vm_state()
 
@@ -1181,9 +1185,19 @@ class vmmDetails(vmmGObjectUI):
             self.oldhwkey = newrow[HW_LIST_COL_DEVICE]
             self.hw_selected()
 
+    def _details_showing(self):
+        return (self.is_visible() and
+                self.widget("details-pages").get_current_page() ==
+                DETAILS_PAGE_DETAILS)
+
     def hw_selected(self, page=None):
         pagetype = self.force_get_hw_pagetype(page)
 
+        if not self.is_visible():
+            # Nobody is looking, fill in the page when they do
+            self._details_dirty = True
+            return
+
         self.widget("config-remove").set_sensitive(True)
         self.widget("hw-panel").set_sensitive(True)
         self.widget("hw-panel").show()
@@ -1265,6 +1279,11 @@ class vmmDetails(vmmGObjectUI):
         if is_details:
             pages.set_current_page(DETAILS_PAGE_DETAILS)
         elif is_snapshot:
+            if self.snapshots is None:
+                self.snapshots = vmmSnapshotPage(self.vm, self.builder,
+                                                 self.topwin)
+                self.widget("snapshot-placeholder").add(
+                    self.snapshots.top_box)
             self.snapshots.show_page()
             pages.set_current_page(DETAILS_PAGE_SNAPSHOTS)
         else:
@@ -1295,7 +1314,8 @@ class vmmDetails(vmmGObjectUI):
             self.ignoreDetails = False
 
     def switch_page(self, ignore1=None, ignore2=None, newpage=None):
-        self.page_refresh(newpage)
+        if self._details_dirty:
+            self.page_refresh(newpage)
 
         self.sync_details_console_view(newpage)
         self.console.set_allow_fullscreen()
@@ -2486,14 +2506,14 @@ class vmmDetails(vmmGObjectUI):
     ########################
 
     def refresh_resources(self, ignore):
-        details = self.widget("details-pages")
-        page = details.get_current_page()
+        # Nothing to show while the dialog is hidden
+        if not self.is_visible():
+            return
 
         # If the dialog is visible, we want to make sure the XML is always
         # up to date
         try:
-            if self.is_visible():
-                self.vm.refresh_xml()
+            self.vm.refresh_xml()
         except libvirt.libvirtError, e:
             if uihelpers.exception_is_libvirt_error(e, "VIR_ERR_NO_DOMAIN"):
                 self.close()
@@ -2501,13 +2521,16 @@ class vmmDetails(vmmGObjectUI):
             raise
 
         # Stats page needs to be refreshed every tick
-        if (page == DETAILS_PAGE_DETAILS and
+        if (self._details_showing() and
             self.get_hw_selection(HW_LIST_COL_TYPE) == HW_LIST_TYPE_STATS):
             self.refresh_stats_page()
 
     def page_refresh(self, page):
-        if page != DETAILS_PAGE_DETAILS:
+        if page != DETAILS_PAGE_DETAILS or not self.is_visible():
+            # Catch up when the hardware pages are shown
+            self._details_dirty = True
             return
+        self._details_dirty = False
 
         # This function should only be called when the VM xml actually
         # changes (not everytime it is refreshed). This saves us from blindly
@@ -3354,6 +3377,14 @@ class vmmDetails(vmmGObjectUI):
         if not dev:
             return
 
+        if self.fsDetails is None:
+            self.fsDetails = vmmFSDetails(self.vm)
+            self.fsDetails.set_initial_state()
+            self.fsDetails.connect("changed",
+                                   lambda *x: self.enable_apply(x, EDIT_FS))
+            self.widget("fs-alignment").add(self.fsDetails.topwin)
+            self.fsDetails.topwin.show_all()
+
         self.fsDetails.set_dev(dev)
         self.fsDetails.update_fs_rows()
 
@@ -3482,17 +3513,26 @@ class vmmDetails(vmmGObjectUI):
 
         currentDevices = []
 
-        def dev_cmp(origdev, newdev):
-            if isinstance(origdev, str):
-                return False
-
-            if origdev == newdev:
-                return True
-
-            if not origdev.get_root_xpath():
-                return False
+        # Index the existing rows, so each device below is matched and
+        # placed without scanning the whole list. Rows are kept sorted
+        # by type.
+        rowtypes = []
+        xpathrows = {}
+        for row in hw_list_model:
+            rowtypes.append(row[HW_LIST_COL_TYPE])
+            rowdev = row[HW_LIST_COL_DEVICE]
+            if not isinstance(rowdev, str) and rowdev.get_root_xpath():
+                xpathrows[rowdev.get_root_xpath()] = row
+
+        def find_row(newdev):
+            if newdev.get_root_xpath():
+                return xpathrows.get(newdev.get_root_xpath())
 
-            return origdev.get_root_xpath() == newdev.get_root_xpath()
+            for row in hw_list_model:
+                rowdev = row[HW_LIST_COL_DEVICE]
+                if not isinstance(rowdev, str) and rowdev == newdev:
+                    return row
+            return None
 
         def add_hw_list_option(idx, name, page_id, info, icon_name):
             hw_list_model.insert(idx, [name, icon_name,
@@ -3506,21 +3546,18 @@ class vmmDetails(vmmGObjectUI):
             """
             currentDevices.append(info)
 
-            insertAt = 0
-            for row in hw_list_model:
-                rowdev = row[HW_LIST_COL_DEVICE]
-                if dev_cmp(rowdev, info):
-                    # Update existing HW info
-                    row[HW_LIST_COL_DEVICE] = info
-                    row[HW_LIST_COL_LABEL] = name
-                    row[HW_LIST_COL_ICON_NAME] = icon_name
-                    return
-
-                if row[HW_LIST_COL_TYPE] <= hwtype:
-                    insertAt += 1
+            row = find_row(info)
+            if row is not None:
+                # Update existing HW info
+                row[HW_LIST_COL_DEVICE] = info
+                row[HW_LIST_COL_LABEL] = name
+                row[HW_LIST_COL_ICON_NAME] = icon_name
+                return
 
             # Add the new HW row
+            insertAt = bisect.bisect_right(rowtypes, hwtype)
             add_hw_list_option(insertAt, name, hwtype, info, icon_name)
+            rowtypes.insert(insertAt, hwtype)
 
         # Populate list of disks
         for disk in self.vm.get_disk_devices():
@@ -1678,6 +1678,11 @@ class vmmDomain(vmmLibvirtObject):
         return self.config.set_pervm(self.uuid, "/console-password",
                                      (username, keyid))
 
+    def get_serial_capture(self):
+        return self.config.get_pervm(self.uuid, "/serial-capture")
+    def set_serial_capture(self, value):
+        self.config.set_pervm(self.uuid, "/serial-capture", value)
+
     def get_cache_dir(self):
         ret = os.path.join(self.conn.get_cache_dir(), self.get_uuid())
         if not os.path.exists(ret):
@@ -34,21 +34,16 @@ from virtinst import util
 
 from virtManager import packageutils
 from virtManager import uihelpers
-from virtManager.about import vmmAbout
 from virtManager.baseclass import vmmGObject
-from virtManager.clone import vmmCloneVM
-from virtManager.connect import vmmConnect
 from virtManager.connection import vmmConnection
-from virtManager.preferences import vmmPreferences
 from virtManager.manager import vmmManager
-from virtManager.migrate import vmmMigrateDialog
-from virtManager.details import vmmDetails
 from virtManager.asyncjob import vmmAsyncJob
-from virtManager.create import vmmCreate
-from virtManager.host import vmmHost
 from virtManager.error import vmmErrorDialog
 from virtManager.systray import vmmSystray
-from virtManager.delete import vmmDeleteDialog
+
+# The other dialogs, and whatever they pull in (console viewers, the
+# osinfo database, URL fetching, the cloner), are only imported when
+# first opened, to keep startup fast.
 
 # Enable this to get a report of leaked objects on app shutdown
 # gtk3/pygobject has issues here as of Fedora 18
@@ -100,8 +95,9 @@ class vmmEngine(vmmGObject):
         self._tick_thread.daemon = True
         self._tick_queue = Queue.PriorityQueue(100)
 
+        # Checking for libguestfs is slow, so wait until the UI is up
         self.inspection = None
-        self._create_inspection_thread()
+        self.idle_add(self._create_inspection_thread)
 
         # Counter keeping track of how many manager and details windows
         # are open. When it is decremented to 0, close the app or
@@ -445,6 +441,8 @@ class vmmEngine(vmmGObject):
         self.inspection.start()
         self.connect("conn-added", self.inspection.conn_added)
         self.connect("conn-removed", self.inspection.conn_removed)
+        for conninfo in self.conns.values():
+            self.inspection.conn_added(self, conninfo["conn"])
         return
 
 
@@ -632,6 +630,7 @@ class vmmEngine(vmmGObject):
     def _do_show_about(self, src):
         try:
             if self.windowAbout is None:
+                from virtManager.about import vmmAbout
                 self.windowAbout = vmmAbout()
             self.windowAbout.show()
         except Exception, e:
@@ -641,6 +640,7 @@ class vmmEngine(vmmGObject):
         if self.windowPreferences:
             return self.windowPreferences
 
+        from virtManager.preferences import vmmPreferences
         obj = vmmPreferences()
         self.windowPreferences = obj
         return self.windowPreferences
@@ -656,6 +656,7 @@ class vmmEngine(vmmGObject):
             return self.conns[uri]["windowHost"]
 
         con = self._lookup_conn(uri)
+        from virtManager.host import vmmHost
         obj = vmmHost(con)
 
         obj.connect("action-exit-app", self.exit_app)
@@ -686,6 +687,7 @@ class vmmEngine(vmmGObject):
             if len(self.conns.keys()) == 0:
                 self.exit_app(src)
 
+        from virtManager.connect import vmmConnect
         obj = vmmConnect()
         obj.connect("completed", completed)
         obj.connect("cancelled", cancelled)
@@ -712,6 +714,7 @@ class vmmEngine(vmmGObject):
 
         con = self._lookup_conn(uri)
 
+        from virtManager.details import vmmDetails
         obj = vmmDetails(con.get_vm(uuid))
         obj.connect("action-save-domain", self._do_save_domain)
         obj.connect("action-destroy-domain", self._do_destroy_domain)
@@ -819,6 +822,7 @@ class vmmEngine(vmmGObject):
         if self.windowCreate:
             return self.windowCreate
 
+        from virtManager.create import vmmCreate
         obj = vmmCreate(self)
         obj.connect("action-show-domain", self._do_show_vm)
         self.windowCreate = obj
@@ -836,6 +840,7 @@ class vmmEngine(vmmGObject):
             vm = conn.get_vm(uuid)
 
             if not self.windowMigrate:
+                from virtManager.migrate import vmmMigrateDialog
                 self.windowMigrate = vmmMigrateDialog(vm, self)
 
             self.windowMigrate.set_state(vm)
@@ -850,6 +855,7 @@ class vmmEngine(vmmGObject):
 
         try:
             if clone_window is None:
+                from virtManager.clone import vmmCloneVM
                 clone_window = vmmCloneVM(orig_vm)
                 self.conns[uri]["windowClone"] = clone_window
             else:
@@ -1122,5 +1128,6 @@ class vmmEngine(vmmGObject):
         vm = conn.get_vm(uuid)
 
         if not self.delete_dialog:
+            from virtManager.delete import vmmDeleteDialog
             self.delete_dialog = vmmDeleteDialog()
         self.delete_dialog.show(vm, src.topwin)
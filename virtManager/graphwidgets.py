@@ -16,6 +16,10 @@
 # MA 02110-1301 USA.
 #
 
+import collections
+
+import cairo
+
 # pylint: disable=E0611
 from gi.repository import GObject
 from gi.repository import Gtk
@@ -101,6 +105,130 @@ def draw_fill(cairo_ct, x, y, w, h, points, taper=False):
     cairo_ct.fill()
 
 
+# Indent of the gray border around a cell sparkline
+_BORDER_PADDING = 2
+# Indent of graph from border
+_GRAPH_INDENT = 2
+_GRAPH_PAD = (_BORDER_PADDING + _GRAPH_INDENT)
+
+# Max number of graph images each CellRendererSparkline caches
+_SPARKLINE_CACHE_SIZE = 1000
+
+
+class _SparklineGraph(object):
+    """
+    Point layout of a CellRendererSparkline graph, in coordinates
+    relative to the graph border
+    """
+    def __init__(self, values, pixels_per_point, width, height):
+        self.values = values
+        self.pixels_per_point = pixels_per_point
+        self.width = width
+        self.height = height
+
+    def get_x(self, index):
+        return int((index * self.pixels_per_point) + _GRAPH_INDENT)
+
+    def get_points(self, start=0):
+        baseline_y = _GRAPH_INDENT + self.height
+
+        points = []
+        for index in range(start, len(self.values)):
+            y = baseline_y - (self.height * self.values[index])
+            y = max(_GRAPH_INDENT, y)
+            y = min(baseline_y, y)
+
+            points.append((self.get_x(index), int(y)))
+        return points
+
+    def find_shift(self, newvalues):
+        """
+        If newvalues is our data moved on by a few new samples, return
+        how many, otherwise 0
+        """
+        count = len(self.values)
+        for shift in range(1, count / 2):
+            if self.values[shift:] == newvalues[:count - shift]:
+                return shift
+        return 0
+
+    def draw(self, cr, start=0):
+        """
+        Draw the graph, or only the part from point index start on
+        """
+        points = self.get_points(start)
+
+        # Set color to dark blue for the actual sparkline
+        cr.set_line_width(2)
+        cr.set_source_rgb(0.421875, 0.640625, 0.73046875)
+        draw_line(cr,
+                  _GRAPH_INDENT, _GRAPH_INDENT,
+                  self.width, self.height,
+                  points)
+
+        # Set color to light blue for the fill
+        cr.set_source_rgba(0.71484375, 0.84765625, 0.89453125, .5)
+        draw_fill(cr,
+                  _GRAPH_INDENT, _GRAPH_INDENT,
+                  self.width, self.height,
+                  points)
+
+
+class _SparklineImage(object):
+    """
+    Cached rendering of a _SparklineGraph, on a transparent surface
+    that is painted over the white graph box
+    """
+    def __init__(self, cr, width, height):
+        self.size = (width, height)
+        self.graph = None
+        self.surface = cr.get_target().create_similar(
+            cairo.CONTENT_COLOR_ALPHA, width, height)
+
+    def _new_context(self):
+        cr = cairo.Context(self.surface)
+        cr.set_line_cap(cairo.LINE_CAP_ROUND)
+        return cr
+
+    def _clear(self, cr):
+        cr.save()
+        cr.set_operator(cairo.OPERATOR_CLEAR)
+        cr.paint()
+        cr.restore()
+
+    def draw(self, graph):
+        cr = self._new_context()
+        self._clear(cr)
+        graph.draw(cr)
+        self.graph = graph
+
+    def shift(self, graph, shift):
+        """
+        Move the image over by shift samples, and draw only the
+        segment that holds the new ones
+        """
+        width, height = self.size
+        old = self.surface
+        self.surface = old.create_similar(cairo.CONTENT_COLOR_ALPHA,
+                                          width, height)
+
+        cr = self._new_context()
+        cr.set_source_surface(old, -shift * graph.pixels_per_point, 0)
+        cr.paint()
+
+        # Redraw from just before the old last point, so its line cap
+        # and fill edge get replaced by the continued line. Start the
+        # path a couple points earlier, so it enters the clip the same
+        # way a full redraw would.
+        first = len(graph.values) - shift - 1
+        clip_x = graph.get_x(first) - 2
+        cr.rectangle(clip_x, 0, width - clip_x, height)
+        cr.clip()
+        self._clear(cr)
+        graph.draw(cr, max(0, first - 2))
+        self.graph = graph
+
+
 class CellRendererSparkline(Gtk.CellRenderer):
     __gproperties__ = {
         # 'name' : (GObject.TYPE_*,
@@ -113,17 +241,34 @@ class CellRendererSparkline(Gtk.CellRenderer):
         'reversed': (GObject.TYPE_BOOLEAN, "Reverse data",
                      "Process data from back to front.",
                      0, GObject.PARAM_READWRITE),
+        'cache_key': (GObject.TYPE_PYOBJECT, "Cache key",
+                      "Key to cache the rendered graph under, usually "
+                      "one per row. Unset means no caching.",
+                      GObject.PARAM_READWRITE),
     }
 
     def __init__(self):
         Gtk.CellRenderer.__init__(self)
 
         self.data_array = []
+        self.cache_key = None
         self.num_sets = 0
         self.filled = True
         self.reversed = False
         self.rgb = None
 
+        # cache_key -> _SparklineImage, least recently drawn first
+        self._images = collections.OrderedDict()
+
+    def clear_cache(self, key=None):
+        """
+        Drop the cached graph image for key, or all of them
+        """
+        if key is None:
+            self._images.clear()
+        else:
+            self._images.pop(key, None)
+
     def do_render(self, cr, widget, background_area, cell_area,
                   flags):
         # cr                : Cairo context
@@ -137,21 +282,13 @@ class CellRendererSparkline(Gtk.CellRenderer):
         ignore = background_area
         ignore = flags
 
-        # Indent of the gray border around the graph
-        BORDER_PADDING = 2
-        # Indent of graph from border
-        GRAPH_INDENT = 2
-        GRAPH_PAD = (BORDER_PADDING + GRAPH_INDENT)
-
         # We don't use yalign, since we expand to the entire height
         ignore = self.get_property("yalign")
         xalign = self.get_property("xalign")
 
         # Set up graphing bounds
-        graph_x      = (cell_area.x + GRAPH_PAD)
-        graph_y      = (cell_area.y + GRAPH_PAD)
-        graph_width  = (cell_area.width - (GRAPH_PAD * 2))
-        graph_height = (cell_area.height - (GRAPH_PAD * 2))
+        graph_width  = (cell_area.width - (_GRAPH_PAD * 2))
+        graph_height = (cell_area.height - (_GRAPH_PAD * 2))
 
         pixels_per_point = (graph_width / max(1, len(self.data_array) - 1))
 
@@ -160,14 +297,16 @@ class CellRendererSparkline(Gtk.CellRenderer):
         graph_width = (pixels_per_point * max(1, len(self.data_array) - 1))
 
         # Recalculate border width based on the amount we are graphing
-        border_width = graph_width + (GRAPH_INDENT * 2)
+        border_width = graph_width + (_GRAPH_INDENT * 2)
+        border_height = cell_area.height - (_BORDER_PADDING * 2)
 
         # Align the widget
-        empty_space = cell_area.width - border_width - (BORDER_PADDING * 2)
+        empty_space = cell_area.width - border_width - (_BORDER_PADDING * 2)
         if empty_space:
-            xalign_space = int(empty_space * xalign)
-            cell_area.x += xalign_space
-            graph_x += xalign_space
+            cell_area.x += int(empty_space * xalign)
+
+        border_x = cell_area.x + _BORDER_PADDING
+        border_y = cell_area.y + _BORDER_PADDING
 
         cr.set_line_width(3)
         # 1 == LINE_CAP_ROUND
@@ -175,64 +314,66 @@ class CellRendererSparkline(Gtk.CellRenderer):
 
         # Draw gray graph border
         cr.set_source_rgb(0.8828125, 0.8671875, 0.8671875)
-        cr.rectangle(cell_area.x + BORDER_PADDING,
-                     cell_area.y + BORDER_PADDING,
-                     border_width,
-                     cell_area.height - (BORDER_PADDING * 2))
+        cr.rectangle(border_x, border_y, border_width, border_height)
         cr.stroke()
 
         # Fill in white box inside graph outline
         cr.set_source_rgb(1, 1, 1)
-        cr.rectangle(cell_area.x + BORDER_PADDING,
-                     cell_area.y + BORDER_PADDING,
-                     border_width,
-                     cell_area.height - (BORDER_PADDING * 2))
+        cr.rectangle(border_x, border_y, border_width, border_height)
         cr.fill()
 
-        def get_y(index):
-            baseline_y = graph_y + graph_height
-
-            if self.reversed:
-                n = (len(self.data_array) - index - 1)
-            else:
-                n = index
-
-            val = self.data_array[n]
-            y = baseline_y - (graph_height * val)
-
-            y = max(graph_y, y)
-            y = min(graph_y + graph_height, y)
-            return y
-
-        points = []
-        for index in range(0, len(self.data_array)):
-            x = int(((index * pixels_per_point) + graph_x))
-            y = int(get_y(index))
-
-            points.append((x, y))
+        # Data points in the order they are drawn, left to right
+        values = list(self.data_array)
+        if self.reversed:
+            values.reverse()
 
+        graph = _SparklineGraph(values, pixels_per_point,
+                                graph_width, graph_height)
 
-        cell_area.x = graph_x
-        cell_area.y = graph_y
-        cell_area.width = graph_width
-        cell_area.height = graph_height
-
-        # Set color to dark blue for the actual sparkline
-        cr.set_line_width(2)
-        cr.set_source_rgb(0.421875, 0.640625, 0.73046875)
-        draw_line(cr,
-                  cell_area.x, cell_area.y,
-                  cell_area.width, cell_area.height,
-                  points)
+        if self.cache_key is None:
+            cr.save()
+            cr.translate(border_x, border_y)
+            graph.draw(cr)
+            cr.restore()
+            return
 
-        # Set color to light blue for the fill
-        cr.set_source_rgba(0.71484375, 0.84765625, 0.89453125, .5)
-        draw_fill(cr,
-                  cell_area.x, cell_area.y,
-                  cell_area.width, cell_area.height,
-                  points)
+        image = self._get_image(cr, border_width, border_height, graph)
+        cr.set_source_surface(image.surface, border_x, border_y)
+        cr.rectangle(border_x, border_y, border_width, border_height)
+        cr.fill()
         return
 
+    def _get_image(self, cr, width, height, graph):
+        """
+        Return the cached image of the graph for cache_key, updating
+        it as needed. When the data has only moved on by a few new
+        samples, the old image is shifted over and only the newest
+        segment is drawn.
+        """
+        image = self._images.pop(self.cache_key, None)
+        self._images[self.cache_key] = image
+        while len(self._images) > _SPARKLINE_CACHE_SIZE:
+            self._images.popitem(last=False)
+
+        if (image is None or
+            image.size != (width, height) or
+            image.graph.pixels_per_point != graph.pixels_per_point or
+            len(image.graph.values) != len(graph.values)):
+            image = _SparklineImage(cr, width, height)
+            self._images[self.cache_key] = image
+        elif image.graph.values == graph.values:
+            return image
+        elif graph.pixels_per_point >= 3:
+            # Partial redraws need segments a few pixels wide, so the
+            # path they draw starts outside of the clip. See shift()
+            shift = image.graph.find_shift(graph.values)
+            if shift:
+                image.shift(graph, shift)
+                return image
+
+        image.draw(graph)
+        return image
+
     def do_get_size(self, widget, cell_area=None):
         ignore = widget
 
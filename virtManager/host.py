@@ -129,6 +129,8 @@ class vmmHost(vmmGObjectUI):
             "on_interface_list_changed": self.interface_selected,
 
             "on_config_autoconnect_toggled": self.toggle_autoconnect,
+            "on_rpc_expander_activate": (lambda *x:
+                self.idle_add(self.refresh_rpc_stats)),
         })
 
         self.repopulate_networks()
@@ -290,6 +292,29 @@ class vmmHost(vmmGObjectUI):
         self.memory_usage_graph.show()
         self.widget("performance-memory-align").add(self.memory_usage_graph)
 
+        # API name, calls, XML bytes, total ms, average ms
+        rpcList = self.widget("rpc-list")
+        rpcModel = Gtk.ListStore(str, int, GObject.TYPE_INT64, float, float)
+        rpcList.set_model(rpcModel)
+
+        def add_col(title, idx, fmt=None):
+            txt = Gtk.CellRendererText()
+            col = Gtk.TreeViewColumn(title, txt, text=idx)
+            col.set_sort_column_id(idx)
+            if fmt:
+                txt.set_property("xalign", 1)
+                col.set_cell_data_func(txt,
+                    lambda c, r, m, i, d: r.set_property(
+                        "text", fmt % m.get_value(i, idx)))
+            rpcList.append_column(col)
+
+        add_col(_("API"), 0)
+        add_col(_("Calls"), 1, "%d")
+        add_col(_("XML bytes"), 2, "%d")
+        add_col(_("Total ms"), 3, "%.1f")
+        add_col(_("Average ms"), 4, "%.2f")
+        rpcModel.set_sort_column_id(1, Gtk.SortType.DESCENDING)
+
 
     def show(self):
         logging.debug("Showing host details: %s", self.conn)
@@ -385,6 +410,34 @@ class vmmHost(vmmGObjectUI):
 
         self.cpu_usage_graph.set_property("data_array", cpu_vector)
         self.memory_usage_graph.set_property("data_array", memory_vector)
+        self.refresh_rpc_stats()
+
+    def refresh_rpc_stats(self):
+        if (not self.is_visible() or
+            not self.widget("rpc-expander").get_expanded()):
+            return
+
+        stats = self.conn.get_rpc_stats()
+        if not stats:
+            self.widget("rpc-summary").set_text(_("No connection"))
+            self.widget("rpc-list").get_model().clear()
+            return
+
+        self.widget("rpc-summary").set_text(
+            _("%(total)d calls, %(tick)d during the last update") %
+            {"total": stats.get_total_calls(),
+             "tick": self.conn.get_rpc_tick_calls()})
+
+        model = self.widget("rpc-list").get_model()
+        rows = dict((row[0], row.iter) for row in model)
+        for api, calls, nbytes, elapsed in stats.get_stats():
+            values = [api, calls, nbytes, elapsed * 1000,
+                      elapsed * 1000 / calls]
+            if api in rows:
+                if model[rows[api]][1] != calls:
+                    model[rows[api]] = values
+            else:
+                model.append(values)
 
     def conn_state_changed(self, ignore1=None):
         conn_active = (self.conn.get_state() == vmmConnection.STATE_ACTIVE)
@@ -0,0 +1,141 @@
+#
+# Copyright (C) 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+#
+
+import logging
+import threading
+import time
+
+from virtManager import uihelpers
+from virtManager.baseclass import vmmGObject
+
+
+class vmmHostSpace(vmmGObject):
+    """
+    Free space in the connection's default storage location. Refreshing
+    the default pool can take seconds on NFS or LVM, so it's done in a
+    background thread and the result is cached for CACHE_TIMEOUT
+    seconds. Labels passed to add_label are updated whenever a new
+    value comes in.
+    """
+    CACHE_TIMEOUT = 30
+
+    # Which tracker each label is showing. Dialogs are hidden and
+    # reused with other connections, so a label has to move between
+    # trackers rather than be shown by every connection it was used with
+    _label_owners = {}
+
+    def __init__(self, conn):
+        vmmGObject.__init__(self)
+
+        self.conn = conn
+        self._avail = None
+        self._timestamp = 0
+        self._thread = None
+        self._labels = {}
+
+    def _cleanup(self):
+        for widget in self._labels.keys():
+            self.remove_label(widget)
+        self.conn = None
+
+    def get_available(self):
+        """
+        Last known free space in GB, or None if we don't know it yet
+        """
+        return self._avail
+
+    def is_stale(self):
+        return (self._avail is None or
+                time.time() - self._timestamp > self.CACHE_TIMEOUT)
+
+    def refresh(self, force=False):
+        """
+        Start a background refresh, unless the cached value is still
+        fresh or one is already running
+        """
+        if self._thread:
+            return
+        if not force and not self.is_stale():
+            return
+
+        self._thread = threading.Thread(target=self._refresh_thread,
+                                        name="Host space thread")
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _refresh_thread(self):
+        avail = None
+        try:
+            avail = uihelpers.host_disk_space(self.conn)
+        except:
+            logging.exception("Error determining host disk space")
+        self.idle_add(self._refresh_done, avail)
+
+    def _refresh_done(self, avail):
+        self._thread = None
+        if self.conn is None or avail is None:
+            return
+
+        self._avail = avail
+        self._timestamp = time.time()
+        for label in self._labels:
+            self._set_label(label)
+
+
+    ##########
+    # Labels #
+    ##########
+
+    def add_label(self, widget):
+        """
+        Show the free space in widget, now if we have a cached value and
+        again every time it's refreshed
+        """
+        owner = self._label_owners.get(widget)
+        if owner and owner is not self:
+            owner.remove_label(widget)
+
+        if widget not in self._labels:
+            self._labels[widget] = widget.connect("destroy",
+                                                  self.remove_label)
+            self._label_owners[widget] = self
+
+        self._set_label(widget)
+        self.refresh()
+
+    def remove_label(self, widget):
+        """
+        Stop updating widget
+        """
+        handle = self._labels.pop(widget, None)
+        if handle is None:
+            return
+        widget.disconnect(handle)
+        if self._label_owners.get(widget) is self:
+            del(self._label_owners[widget])
+
+    def _set_label(self, widget):
+        if self._avail is None:
+            widget.set_markup("")
+            return
+
+        hd_label = ("%.1f GB available in the default location" %
+                    float(self._avail))
+        hd_label = ("<span color='#484848'>%s</span>" % hd_label)
+        widget.set_markup(hd_label)
@@ -18,21 +18,123 @@
 #
 
 from Queue import Queue, Empty
-from threading import Thread
+from threading import Lock, Thread
+import base64
+import json
 import logging
 import os
 import re
+import tempfile
+
+import libvirt
 
 from guestfs import GuestFS  # pylint: disable=F0401
 
+from virtinst import util
+
 from virtManager.baseclass import vmmGObject
 from virtManager.domain import vmmInspectionData
 
+# Number of guests inspected at once. Each one runs its own libguestfs
+# appliance, so keep this modest.
+_WORKERS = 2
+
+_DATA_FIELDS = ["type", "distro", "major_version", "minor_version",
+                "hostname", "product_name", "product_variant",
+                "applications", "error"]
+
+
+class _InspectionCache(object):
+    """
+    Inspection results saved across virt-manager runs, so unchanged
+    guests get their OS info right away at startup. Entries are keyed
+    by VM UUID, and only used if the path, size and mtime of every
+    disk still match what was inspected.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self._entries = None
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            f = file(self.path)
+            try:
+                self._entries = json.load(f)
+            finally:
+                f.close()
+        except Exception:
+            logging.debug("Error reading inspection cache %s",
+                          self.path, exc_info=True)
+
+    def _save(self):
+        dirname = os.path.dirname(self.path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname, 0755)
+
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".inspection.")
+        f = os.fdopen(fd, "w")
+        try:
+            json.dump(self._entries, f)
+        finally:
+            f.close()
+        os.rename(tmpname, self.path)
+
+    def lookup(self, uuid, stamp):
+        self._lock.acquire()
+        try:
+            self._load()
+            entry = self._entries.get(uuid)
+            if not entry or entry["stamp"] != stamp:
+                return None
+
+            data = vmmInspectionData()
+            for field in _DATA_FIELDS:
+                setattr(data, field, entry["data"].get(field))
+            if entry["data"].get("icon"):
+                data.icon = base64.b64decode(entry["data"]["icon"])
+            return data
+        finally:
+            self._lock.release()
+
+    def store(self, uuid, stamp, data):
+        entry = {}
+        for field in _DATA_FIELDS:
+            entry[field] = getattr(data, field)
+        entry["icon"] = data.icon and base64.b64encode(data.icon) or None
+
+        self._lock.acquire()
+        try:
+            self._load()
+            self._entries[uuid] = {"stamp": stamp, "data": entry}
+            try:
+                self._save()
+            except Exception:
+                logging.debug("Error writing inspection cache %s",
+                              self.path, exc_info=True)
+        finally:
+            self._lock.release()
+
 
 class vmmInspection(vmmGObject):
+    """
+    Keeps guest inspection data up to date. Guests are only looked at
+    when something happens that could change the result: they show up,
+    their disks change, or they shut off after running. Inactive
+    guests also get their disk mtimes checked every _RECHECK_INTERVAL
+    seconds, to catch offline edits.
+    """
     # Can't find a way to make Thread release our reference
     _leak_check = False
 
+    _RECHECK_INTERVAL = 5 * 60
+
     def __init__(self):
         vmmGObject.__init__(self)
 
@@ -42,33 +144,69 @@ class vmmInspection(vmmGObject):
 
         self._q = Queue()
         self._conns = {}
-        self._vmseen = {}
-        self._cached_data = {}
+
+        # uuid -> (conn, vm) for every VM we are tracking, and the
+        # disk stamp their current inspection data is for
+        self._vms = {}
+        self._stamps = {}
+
+        # Guests waiting for an inspection worker
+        self._jobs = Queue()
+        self._pending = set()
+        self._pending_lock = Lock()
+        self._workers = []
+        self._cache = _InspectionCache(os.path.join(util.get_cache_dir(),
+                                                    "inspection.json"))
 
     def _cleanup(self):
         self._thread = None
         self._q = Queue()
         self._conns = {}
-        self._vmseen = {}
-        self._cached_data = {}
+        self._vms = {}
+        self._stamps = {}
+        self._jobs = Queue()
+        self._pending = set()
+        self._workers = []
 
     # Called by the main thread whenever a connection is added or
-    # removed.  We tell the inspection thread, so it can track
-    # connections.
+    # removed.  We hook up to its VM signals, and tell the inspection
+    # thread about any VMs it already has.
     def conn_added(self, engine_ignore, conn):
-        obj = ("conn_added", conn)
-        self._q.put(obj)
+        if not conn or conn.is_remote():
+            return
+
+        self._conns[conn.get_uri()] = conn
+        conn.connect("vm-added", self.vm_added)
+        conn.connect("vm-removed", self.vm_removed)
+        for uuid in conn.list_vm_uuids():
+            self.vm_added(conn, uuid)
 
     def conn_removed(self, engine_ignore, uri):
-        obj = ("conn_removed", uri)
-        self._q.put(obj)
+        if self._conns.pop(uri, None):
+            self._q.put(("conn_removed", uri))
 
-    # Called by the main thread whenever a VM is added to vmlist.
+    # Called by the main thread whenever a VM is added to or removed
+    # from a connection's vmlist.
     def vm_added(self, conn, uuid):
+        vm = conn.get_vm(uuid)
+        vm.connect("status-changed", self._vm_status_changed, conn)
+        vm.connect("config-changed", self._vm_config_changed, conn)
+        self._q.put(("vm_check", conn, vm, False))
+
+    def vm_removed(self, conn, uuid):
         ignore = conn
-        ignore = uuid
-        obj = ("vm_added")
-        self._q.put(obj)
+        self._q.put(("vm_removed", uuid))
+
+    def _vm_status_changed(self, vm, oldstatus, status, conn):
+        # The guest may have been changed by whatever it was running,
+        # e.g. an OS upgrade, so look again once it's off
+        if (status == libvirt.VIR_DOMAIN_SHUTOFF and
+            oldstatus != libvirt.VIR_DOMAIN_SHUTOFF):
+            self._q.put(("vm_check", conn, vm, True))
+
+    def _vm_config_changed(self, vm, conn):
+        # Only does something if the disks have changed
+        self._q.put(("vm_check", conn, vm, False))
 
     def start(self):
         # Wait a few seconds before we do anything.  This prevents
@@ -77,6 +215,12 @@ class vmmInspection(vmmGObject):
         # all).
         def cb():
             self._thread.start()
+            for idx in range(_WORKERS):
+                worker = Thread(name="inspection worker %d" % idx,
+                                target=self._run_worker)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
             return 0
 
         logging.debug("waiting")
@@ -84,78 +228,134 @@ class vmmInspection(vmmGObject):
 
     def _run(self):
         while True:
-            self._process_queue()
-            self._process_vms()
-
-    # Process everything on the queue.  If the queue is empty when
-    # called, block.
-    def _process_queue(self):
-        first_obj = self._q.get()
-        self._process_queue_item(first_obj)
-        self._q.task_done()
-        try:
-            while True:
-                obj = self._q.get(False)
+            try:
+                obj = self._q.get(timeout=self._RECHECK_INTERVAL)
+            except Empty:
+                self._recheck_inactive()
+                continue
+
+            try:
                 self._process_queue_item(obj)
-                self._q.task_done()
-        except Empty:
-            pass
+            except:
+                logging.exception("Error processing inspection event %s",
+                                  obj[0])
 
     def _process_queue_item(self, obj):
-        if obj[0] == "conn_added":
-            conn = obj[1]
-            if conn and not (conn.is_remote()):
-                uri = conn.get_uri()
-                self._conns[uri] = conn
-                conn.connect("vm-added", self.vm_added)
+        if obj[0] == "vm_check":
+            conn, vm, force = obj[1:]
+            self._vms[vm.get_uuid()] = (conn, vm)
+            self._check_vm(conn, vm, force)
+        elif obj[0] == "vm_removed":
+            self._vms.pop(obj[1], None)
+            self._stamps.pop(obj[1], None)
         elif obj[0] == "conn_removed":
-            uri = obj[1]
-            del self._conns[uri]
-        elif obj[0] == "vm_added":
-            # Nothing - just a signal for the inspection thread to wake up.
-            pass
-
-    # Any VMs we've not seen yet?  If so, process them.
-    def _process_vms(self):
-        for conn in self._conns.itervalues():
-            for vmuuid in conn.list_vm_uuids():
-                if not conn.is_active():
-                    break
-
-                def set_inspection_error(vm):
-                    data = vmmInspectionData()
-                    data.error = True
-                    self._set_vm_inspection_data(vm, data)
-
-                prettyvm = vmuuid
+            for uuid, (conn, ignore) in self._vms.items():
+                if conn.get_uri() == obj[1]:
+                    del(self._vms[uuid])
+                    self._stamps.pop(uuid, None)
+
+    def _recheck_inactive(self):
+        for conn, vm in self._vms.values():
+            try:
+                if conn.is_active() and not vm.is_active():
+                    self._check_vm(conn, vm, False)
+            except:
+                logging.exception("Error rechecking %s", vm.get_name())
+
+    def _check_vm(self, conn, vm, force):
+        """
+        Queue vm for inspection if its disks changed since it was last
+        inspected, or if force is set. Saved results are used instead
+        if they match the current disks.
+        """
+        if not conn.is_active():
+            return
+
+        vmuuid = vm.get_uuid()
+        prettyvm = conn.get_uri() + ":" + vm.get_name()
+        stamp = self._get_disk_stamp(vm)
+
+        if vmuuid in self._stamps and not force:
+            old = self._stamps[vmuuid]
+            if old == stamp:
+                return
+            if (vm.is_active() and old and stamp and
+                [d[0] for d in old] == [d[0] for d in stamp]):
+                # A running guest's disks change all the time; wait
+                # until it shuts off unless the set of disks changed
+                return
+
+        self._stamps[vmuuid] = stamp
+        data = stamp and self._cache.lookup(vmuuid, stamp)
+        if data:
+            logging.debug("Found saved inspection data for %s", prettyvm)
+            self._set_vm_inspection_data(vm, data)
+            return
+
+        self._pending_lock.acquire()
+        try:
+            if vmuuid in self._pending:
+                return
+            self._pending.add(vmuuid)
+        finally:
+            self._pending_lock.release()
+
+        logging.debug("Queueing %s for inspection", prettyvm)
+        self._jobs.put((conn, vm, vmuuid, stamp))
+
+    def _run_worker(self):
+        while True:
+            conn, vm, vmuuid, stamp = self._jobs.get()
+            self._pending_lock.acquire()
+            self._pending.discard(vmuuid)
+            self._pending_lock.release()
+
+            prettyvm = vmuuid
+            try:
+                prettyvm = conn.get_uri() + ":" + vm.get_name()
                 try:
-                    vm = conn.get_vm(vmuuid)
-                    prettyvm = conn.get_uri() + ":" + vm.get_name()
-
-                    if vmuuid in self._vmseen:
-                        data = self._cached_data.get(vmuuid)
-                        if not data:
-                            continue
-
-                        if vm.inspection != data:
-                            logging.debug("Found cached data for %s", prettyvm)
-                            self._set_vm_inspection_data(vm, data)
-                        continue
-
-                    # Whether success or failure, we've "seen" this VM now.
-                    self._vmseen[vmuuid] = True
-                    try:
-                        data = self._process(conn, vm, vmuuid)
-                        if data:
-                            self._set_vm_inspection_data(vm, data)
-                        else:
-                            set_inspection_error(vm)
-                    except:
-                        set_inspection_error(vm)
-                        raise
+                    data = self._process(conn, vm, vmuuid)
                 except:
-                    logging.exception("%s: exception while processing",
-                                      prettyvm)
+                    self._set_vm_inspection_data(vm, self._error_data())
+                    raise
+
+                if not data:
+                    data = self._error_data()
+                self._set_vm_inspection_data(vm, data)
+                if stamp:
+                    self._cache.store(vmuuid, stamp, data)
+            except:
+                logging.exception("%s: exception while processing",
+                                  prettyvm)
+
+    def _error_data(self):
+        data = vmmInspectionData()
+        data.error = True
+        return data
+
+    def _get_disks(self, vm):
+        disks = []
+        for disk in vm.get_disk_devices():
+            if (disk.path and
+                (disk.type == "block" or disk.type == "file") and
+                not disk.device == "cdrom"):
+                disks.append(disk)
+        return disks
+
+    def _get_disk_stamp(self, vm):
+        """
+        Return a list of [path, size, mtime] for the VM's disks, which
+        tells us whether saved inspection results are still valid. None
+        if a disk can't be stat'd.
+        """
+        stamp = []
+        for disk in self._get_disks(vm):
+            try:
+                st = os.stat(disk.path)
+            except OSError:
+                return None
+            stamp.append([disk.path, st.st_size, st.st_mtime])
+        return stamp
 
     def _process(self, conn, vm, vmuuid):
         if re.search(r"^guestfs-", vm.get_name()):
@@ -167,13 +367,7 @@ class vmmInspection(vmmGObject):
         prettyvm = conn.get_uri() + ":" + vm.get_name()
         ignore = vmuuid
 
-        disks = []
-        for disk in vm.get_disk_devices():
-            if (disk.path and
-                (disk.type == "block" or disk.type == "file") and
-                not disk.device == "cdrom"):
-                disks.append(disk)
-
+        disks = self._get_disks(vm)
         if not disks:
             logging.debug("%s: nothing to inspect", prettyvm)
             return None
@@ -268,7 +462,7 @@ class vmmInspection(vmmGObject):
             logging.debug("# apps: %d", len(apps))
 
         data = vmmInspectionData()
-        data.type = str(type)
+        data.type = str(typ)
         data.distro = str(distro)
         data.major_version = int(major_version)
         data.minor_version = int(minor_version)
@@ -284,4 +478,3 @@ class vmmInspection(vmmGObject):
     def _set_vm_inspection_data(self, vm, data):
         vm.inspection = data
         vm.inspection_data_updated()
-        self._cached_data[vm.get_uuid()] = data
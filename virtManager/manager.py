@@ -50,7 +50,15 @@ ROW_IS_CONN_CONNECTED,
 ROW_IS_VM,
 ROW_IS_VM_RUNNING,
 ROW_COLOR,
-ROW_INSPECTION_OS_ICON) = range(11)
+ROW_INSPECTION_OS_ICON,
+ROW_GUEST_CPU,
+ROW_HOST_CPU,
+ROW_MEM,
+ROW_DISK,
+ROW_NETWORK) = range(16)
+
+# Model columns holding the cached stats values we sort on
+_STATS_ROWS = [ROW_GUEST_CPU, ROW_HOST_CPU, ROW_MEM, ROW_DISK, ROW_NETWORK]
 
 # Columns in the tree view
 (COL_NAME,
@@ -121,6 +129,20 @@ class vmmManager(vmmGObjectUI):
         # allow O(1) access instead of O(n)
         self.rows = {}
 
+        # Row key -> dict of the column values last written to the
+        # model, so updates only touch what changed
+        self._row_values = {}
+
+        # Row key -> (object, full) updates waiting for the next
+        # _flush_row_updates
+        self._pending_rows = {}
+        self._flush_queued = False
+        self._selection_changed = False
+
+        # Row key -> graph data vectors for the current stats sample
+        self._graph_data = {}
+        self._sparklines = []
+
         w, h = self.config.get_manager_window_size()
         self.topwin.set_default_size(w or 550, h or 550)
         self.prev_position = None
@@ -231,6 +253,10 @@ class vmmManager(vmmGObjectUI):
 
     def _cleanup(self):
         self.rows = None
+        self._row_values = None
+        self._pending_rows = None
+        self._graph_data = None
+        self._sparklines = None
 
         self.diskcol = None
         self.guestcpucol = None
@@ -345,6 +371,11 @@ class vmmManager(vmmGObjectUI):
         rowtypes.insert(ROW_IS_VM_RUNNING, bool)  # if VM is running
         rowtypes.insert(ROW_COLOR, str)  # row markup color string
         rowtypes.insert(ROW_INSPECTION_OS_ICON, GdkPixbuf.Pixbuf)  # OS icon
+        rowtypes.insert(ROW_GUEST_CPU, float)  # guest CPU usage
+        rowtypes.insert(ROW_HOST_CPU, float)  # host CPU usage
+        rowtypes.insert(ROW_MEM, float)  # memory usage
+        rowtypes.insert(ROW_DISK, float)  # disk I/O rate
+        rowtypes.insert(ROW_NETWORK, float)  # network I/O rate
 
         model = Gtk.TreeStore(*rowtypes)
         vmlist.set_model(model)
@@ -357,7 +388,7 @@ class vmmManager(vmmGObjectUI):
         nameCol.set_expand(True)
         nameCol.set_sizing(Gtk.TreeViewColumnSizing.AUTOSIZE)
         nameCol.set_spacing(6)
-        nameCol.set_sort_column_id(COL_NAME)
+        nameCol.set_sort_column_id(ROW_SORT_KEY)
 
         vmlist.append_column(nameCol)
 
@@ -383,7 +414,7 @@ class vmmManager(vmmGObjectUI):
         self.spacer_txt.set_property("visible", False)
         nameCol.pack_end(self.spacer_txt, False)
 
-        def make_stats_column(title, colnum):
+        def make_stats_column(title, sortcol):
             col = Gtk.TreeViewColumn(title)
             col.set_min_width(140)
 
@@ -398,24 +429,22 @@ class vmmManager(vmmGObjectUI):
             img.set_property("reversed", True)
             col.pack_start(img, True)
             col.add_attribute(img, 'visible', ROW_IS_VM)
+            self._sparklines.append(img)
 
-            col.set_sort_column_id(colnum)
+            col.set_sort_column_id(sortcol)
             vmlist.append_column(col)
             return col
 
-        self.guestcpucol = make_stats_column(_("CPU usage"), COL_GUEST_CPU)
-        self.hostcpucol = make_stats_column(_("Host CPU usage"), COL_HOST_CPU)
-        self.memcol = make_stats_column(_("Memory usage"), COL_MEM)
-        self.diskcol = make_stats_column(_("Disk I/O"), COL_DISK)
-        self.netcol = make_stats_column(_("Network I/O"), COL_NETWORK)
+        self.guestcpucol = make_stats_column(_("CPU usage"), ROW_GUEST_CPU)
+        self.hostcpucol = make_stats_column(_("Host CPU usage"), ROW_HOST_CPU)
+        self.memcol = make_stats_column(_("Memory usage"), ROW_MEM)
+        self.diskcol = make_stats_column(_("Disk I/O"), ROW_DISK)
+        self.netcol = make_stats_column(_("Network I/O"), ROW_NETWORK)
 
-        model.set_sort_func(COL_NAME, self.vmlist_name_sorter)
-        model.set_sort_func(COL_GUEST_CPU, self.vmlist_guest_cpu_usage_sorter)
-        model.set_sort_func(COL_HOST_CPU, self.vmlist_host_cpu_usage_sorter)
-        model.set_sort_func(COL_MEM, self.vmlist_memory_usage_sorter)
-        model.set_sort_func(COL_DISK, self.vmlist_disk_io_sorter)
-        model.set_sort_func(COL_NETWORK, self.vmlist_network_usage_sorter)
-        model.set_sort_column_id(COL_NAME, Gtk.SortType.ASCENDING)
+        # Sort on the cached model values with the stock compare
+        # function. Unlike a custom sort func, the store then only
+        # re-sorts a row when the column it is sorted on changes.
+        model.set_sort_column_id(ROW_SORT_KEY, Gtk.SortType.ASCENDING)
 
     ##################
     # Helper methods #
@@ -611,16 +640,10 @@ class vmmManager(vmmGObjectUI):
         self._append_vm(model, vm, conn)
 
     def vm_removed(self, conn, vmuuid):
-        vmlist = self.widget("vm-list")
-        model = vmlist.get_model()
-
-        parent = self.rows[conn.get_uri()].iter
-        for row in range(model.iter_n_children(parent)):
-            vm = model.get_value(model.iter_nth_child(parent, row), ROW_HANDLE)
-            if vm.get_uuid() == vmuuid:
-                model.remove(model.iter_nth_child(parent, row))
-                del self.rows[self.vm_row_key(vm)]
-                break
+        row_key = vmuuid + ":" + conn.get_uri()
+        if row_key not in self.rows:
+            return
+        self._remove_row(self.widget("vm-list").get_model(), row_key)
 
     def _build_conn_hint(self, conn):
         hint = conn.get_uri()
@@ -651,63 +674,104 @@ class vmmManager(vmmGObjectUI):
         statetext   = "<span size='smaller'>%s</span>" % status
         return domtext + "\n" + statetext
 
+    def _get_conn_values(self, conn, name):
+        return {
+            ROW_SORT_KEY: name,
+            ROW_MARKUP: self._build_conn_markup(conn, name),
+            ROW_HINT: util.xml_escape(self._build_conn_hint(conn)),
+            ROW_IS_CONN_CONNECTED: conn.state != conn.STATE_DISCONNECTED,
+            ROW_COLOR: self._build_conn_color(conn),
+        }
+
+    def _get_vm_values(self, vm):
+        name = vm.get_name_or_title()
+        desc = vm.get_description()
+        if not uihelpers.can_set_row_none:
+            desc = desc or ""
+
+        return {
+            ROW_SORT_KEY: name,
+            ROW_MARKUP: self._build_vm_markup(name, vm.run_status()),
+            ROW_STATUS_ICON: vm.run_status_icon_name(),
+            ROW_HINT: util.xml_escape(desc),
+            ROW_IS_VM_RUNNING: vm.is_active(),
+        }
+
+    def _get_stats_values(self, obj):
+        return {
+            ROW_GUEST_CPU: float(obj.guest_cpu_time_percentage()),
+            ROW_HOST_CPU: float(obj.host_cpu_time_percentage()),
+            ROW_MEM: float(obj.stats_memory()),
+            ROW_DISK: float(obj.disk_io_rate()),
+            ROW_NETWORK: float(obj.network_traffic_rate()),
+        }
+
     def _build_row(self, conn, vm):
+        """
+        Return the model row for conn or vm, and the dict of column
+        values we cache for it
+        """
         if conn:
-            name = conn.get_pretty_desc_inactive(False)
-            markup = self._build_conn_markup(conn, name)
-            status = ("<span size='smaller'>%s</span>" %
-                      conn.get_state_text())
-            status_icon = None
-            hint = self._build_conn_hint(conn)
-            color = self._build_conn_color(conn)
+            values = self._get_conn_values(conn,
+                                    conn.get_pretty_desc_inactive(False))
+            values[ROW_STATUS_ICON] = None
+            values[ROW_IS_VM_RUNNING] = False
             os_icon = None
         else:
-            name = vm.get_name_or_title()
-            status = vm.run_status()
-            markup = self._build_vm_markup(name, status)
-            status_icon = vm.run_status_icon_name()
-            hint = vm.get_description()
-            color = None
+            values = self._get_vm_values(vm)
+            values[ROW_IS_CONN_CONNECTED] = False
+            values[ROW_COLOR] = None
             os_icon = _get_inspection_icon_pixbuf(vm, 16, 16)
+        values.update(self._get_stats_values(conn or vm))
 
         row = []
         row.insert(ROW_HANDLE, conn or vm)
-        row.insert(ROW_SORT_KEY, name)
-        row.insert(ROW_MARKUP, markup)
-        row.insert(ROW_STATUS_ICON, status_icon)
-        row.insert(ROW_HINT, util.xml_escape(hint))
+        row.insert(ROW_SORT_KEY, values[ROW_SORT_KEY])
+        row.insert(ROW_MARKUP, values[ROW_MARKUP])
+        row.insert(ROW_STATUS_ICON, values[ROW_STATUS_ICON])
+        row.insert(ROW_HINT, values[ROW_HINT])
         row.insert(ROW_IS_CONN, bool(conn))
-        row.insert(ROW_IS_CONN_CONNECTED,
-                   bool(conn) and conn.state != conn.STATE_DISCONNECTED)
+        row.insert(ROW_IS_CONN_CONNECTED, values[ROW_IS_CONN_CONNECTED])
         row.insert(ROW_IS_VM, bool(vm))
-        row.insert(ROW_IS_VM_RUNNING, bool(vm) and vm.is_active())
-        row.insert(ROW_COLOR, color)
+        row.insert(ROW_IS_VM_RUNNING, values[ROW_IS_VM_RUNNING])
+        row.insert(ROW_COLOR, values[ROW_COLOR])
         row.insert(ROW_INSPECTION_OS_ICON, os_icon)
+        for col in _STATS_ROWS:
+            row.insert(col, values[col])
+
+        return row, values
+
+    def _add_row(self, model, parent, row_key, conn, vm):
+        row, values = self._build_row(conn, vm)
+
+        _iter = model.append(parent, row)
+        path = model.get_path(_iter)
+        self.rows[row_key] = model[path]
+        self._row_values[row_key] = values
+        return _iter
 
-        return row
+    def _remove_row(self, model, row_key):
+        row = self.rows.pop(row_key)
+        self._row_values.pop(row_key, None)
+        self._pending_rows.pop(row_key, None)
+        self._graph_data.pop(row_key, None)
+        for img in self._sparklines:
+            img.clear_cache(row_key)
+        model.remove(row.iter)
 
     def _append_vm(self, model, vm, conn):
         row_key = self.vm_row_key(vm)
         if row_key in self.rows:
             return
 
-        row = self._build_row(None, vm)
         parent = self.rows[conn.get_uri()].iter
-
-        _iter = model.append(parent, row)
-        path = model.get_path(_iter)
-        self.rows[row_key] = model[path]
+        self._add_row(model, parent, row_key, None, vm)
 
         # Expand a connection when adding a vm to it
         self.widget("vm-list").expand_row(model.get_path(parent), False)
 
     def _append_conn(self, model, conn):
-        row = self._build_row(conn, None)
-
-        _iter = model.append(None, row)
-        path = model.get_path(_iter)
-        self.rows[conn.get_uri()] = model[path]
-        return _iter
+        return self._add_row(model, None, conn.get_uri(), conn, None)
 
     def add_conn(self, engine_ignore, conn):
         # Make sure error page isn't showing
@@ -726,14 +790,10 @@ class vmmManager(vmmGObjectUI):
         row = self._append_conn(vmlist.get_model(), conn)
         vmlist.get_selection().select_iter(row)
 
-        # Try to make sure that 2 row descriptions don't collide
-        connrows = []
-        descs = []
-        for row in self.rows.values():
-            if row[ROW_IS_CONN]:
-                connrows.append(row)
-        for row in connrows:
-            descs.append(row[ROW_SORT_KEY])
+        # Try to make sure that 2 row descriptions don't collide. Only
+        # the top level rows are connections.
+        connrows = list(vmlist.get_model())
+        descs = [row[ROW_SORT_KEY] for row in connrows]
 
         for row in connrows:
             conn = row[ROW_HANDLE]
@@ -744,77 +804,120 @@ class vmmManager(vmmGObjectUI):
             newname = conn.get_pretty_desc_inactive(False, True)
             self.conn_state_changed(conn, newname=newname)
 
-    def remove_conn(self, engine_ignore, uri):
-        model = self.widget("vm-list").get_model()
+    def _remove_conn_children(self, model, uri):
         parent = self.rows[uri].iter
-
-        if parent is None:
-            return
-
         child = model.iter_children(parent)
         while child is not None:
-            del self.rows[self.vm_row_key(model.get_value(child, ROW_HANDLE))]
-            model.remove(child)
+            vm = model.get_value(child, ROW_HANDLE)
+            self._remove_row(model, self.vm_row_key(vm))
             child = model.iter_children(parent)
-        model.remove(parent)
 
-        del self.rows[uri]
+    def remove_conn(self, engine_ignore, uri):
+        if uri not in self.rows:
+            return
+
+        model = self.widget("vm-list").get_model()
+        self._remove_conn_children(model, uri)
+        self._remove_row(model, uri)
 
 
     #############################
     # State/UI updating methods #
     #############################
 
-    def vm_row_updated(self, vm):
-        row = self.rows.get(self.vm_row_key(vm), None)
-        if row is None:
+    def _set_row_values(self, model, row_key, values):
+        """
+        Write the values that differ from our cache of the row to the
+        model, in a single store update. Returns True if anything
+        changed.
+        """
+        cache = self._row_values[row_key]
+        args = []
+        for col, val in values.items():
+            if col in cache and cache[col] == val:
+                continue
+            cache[col] = val
+            args += [col, val]
+
+        if not args:
+            return False
+        model.set(self.rows[row_key].iter, *args)
+        return True
+
+    def _queue_row_update(self, row_key, obj, full):
+        """
+        Queue an update of obj's row, for the next _flush_row_updates.
+        full=False only refreshes the stats values, as used for every
+        resources-sampled, full=True also rebuilds name and status.
+        """
+        if row_key not in self.rows:
             return
-        self.widget("vm-list").get_model().row_changed(row.path, row.iter)
 
-    def vm_config_changed(self, vm):
-        row = self.rows.get(self.vm_row_key(vm), None)
-        if row is None:
+        if row_key in self._pending_rows:
+            full = full or self._pending_rows[row_key][1]
+        self._pending_rows[row_key] = (obj, full)
+
+        if not self._flush_queued:
+            self._flush_queued = True
+            self.idle_add(self._flush_row_updates)
+
+    def _flush_row_updates(self):
+        """
+        Apply every queued row update in one pass. A stats tick signals
+        each VM in turn, this turns that into a single model update.
+        """
+        self._flush_queued = False
+        if self.rows is None:
             return
 
-        try:
-            name = vm.get_name_or_title()
-            status = vm.run_status()
+        pending = self._pending_rows
+        self._pending_rows = {}
+        model = self.widget("vm-list").get_model()
+        graphs_visible = any([c.get_visible() for c in
+            [self.netcol, self.diskcol, self.memcol,
+             self.guestcpucol, self.hostcpucol]])
 
-            row[ROW_SORT_KEY] = name
-            row[ROW_STATUS_ICON] = vm.run_status_icon_name()
-            row[ROW_IS_VM_RUNNING] = vm.is_active()
-            row[ROW_MARKUP] = self._build_vm_markup(name, status)
+        for row_key, (obj, full) in pending.items():
+            if row_key not in self.rows:
+                continue
+            self._graph_data.pop(row_key, None)
+
+            try:
+                values = self._get_stats_values(obj)
+                if full:
+                    values.update(self._get_vm_values(obj))
+                changed = self._set_row_values(model, row_key, values)
+            except libvirt.libvirtError, e:
+                if not uihelpers.exception_is_libvirt_error(e,
+                                                    "VIR_ERR_NO_DOMAIN"):
+                    logging.exception("Error updating manager row %s",
+                                      row_key)
+                continue
+
+            if not changed and graphs_visible:
+                # Stats history moved on, redraw the sparklines
+                row = self.rows[row_key]
+                model.row_changed(row.path, row.iter)
 
-            desc = vm.get_description()
-            if not uihelpers.can_set_row_none:
-                desc = desc or ""
-            row[ROW_HINT] = util.xml_escape(desc)
-        except libvirt.libvirtError, e:
-            if uihelpers.exception_is_libvirt_error(e, "VIR_ERR_NO_DOMAIN"):
-                return
-            raise
+        if self._selection_changed:
+            self._selection_changed = False
+            self.update_current_selection()
+
+    def vm_row_updated(self, vm):
+        self._queue_row_update(self.vm_row_key(vm), vm, False)
 
-        self.vm_row_updated(vm)
+    def vm_config_changed(self, vm):
+        self._queue_row_update(self.vm_row_key(vm), vm, True)
 
     def vm_status_changed(self, vm, oldstatus, newstatus):
         ignore = newstatus
         ignore = oldstatus
-        parent = self.rows[vm.conn.get_uri()].iter
-        vmlist = self.widget("vm-list")
-        model = vmlist.get_model()
 
-        missing = True
-        for row in range(model.iter_n_children(parent)):
-            _iter = model.iter_nth_child(parent, row)
-            if model.get_value(_iter, ROW_HANDLE) == vm:
-                missing = False
-                break
-
-        if missing:
-            self._append_vm(model, vm, vm.conn)
+        if self.vm_row_key(vm) not in self.rows:
+            self._append_vm(self.widget("vm-list").get_model(), vm, vm.conn)
 
         # Update run/shutdown/pause button states
-        self.update_current_selection()
+        self._selection_changed = True
         self.vm_config_changed(vm)
 
     def vm_inspection_changed(self, vm):
@@ -827,41 +930,26 @@ class vmmManager(vmmGObjectUI):
             new_icon = new_icon or ""
         row[ROW_INSPECTION_OS_ICON] = new_icon
 
-        self.vm_row_updated(vm)
-
     def conn_state_changed(self, conn, newname=None):
-        row = self.rows[conn.get_uri()]
-        if newname:
-            row[ROW_SORT_KEY] = newname
-        row[ROW_MARKUP] = self._build_conn_markup(conn, row[ROW_SORT_KEY])
-        row[ROW_IS_CONN_CONNECTED] = conn.state != conn.STATE_DISCONNECTED
-        row[ROW_COLOR] = self._build_conn_color(conn)
-        row[ROW_HINT] = self._build_conn_hint(conn)
+        uri = conn.get_uri()
+        model = self.widget("vm-list").get_model()
+        name = newname or self._row_values[uri][ROW_SORT_KEY]
+        self._set_row_values(model, uri, self._get_conn_values(conn, name))
 
         if conn.get_state() in [vmmConnection.STATE_DISCONNECTED,
                                 vmmConnection.STATE_CONNECTING]:
             # Connection went inactive, delete any VM child nodes
-            parent = row.iter
-            if parent is not None:
-                model = self.widget("vm-list").get_model()
-                child = model.iter_children(parent)
-                while child is not None:
-                    vm = model[child][ROW_HANDLE]
-                    del self.rows[self.vm_row_key(vm)]
-                    model.remove(child)
-                    child = model.iter_children(parent)
+            self._remove_conn_children(model, uri)
 
         self.conn_row_updated(conn)
         self.update_current_selection()
 
     def conn_row_updated(self, conn):
-        row = self.rows[conn.get_uri()]
-
         self.max_disk_rate = max(self.max_disk_rate, conn.disk_io_max_rate())
         self.max_net_rate = max(self.max_net_rate,
                                 conn.network_traffic_max_rate())
 
-        self.widget("vm-list").get_model().row_changed(row.path, row.iter)
+        self._queue_row_update(conn.get_uri(), conn, False)
 
     def change_run_text(self, can_restore):
         if can_restore:
@@ -952,43 +1040,6 @@ class vmmManager(vmmGObjectUI):
     # Stats methods #
     #################
 
-    def vmlist_name_sorter(self, model, iter1, iter2, ignore):
-        return cmp(model.get_value(iter1, ROW_SORT_KEY),
-                   model.get_value(iter2, ROW_SORT_KEY))
-
-    def vmlist_guest_cpu_usage_sorter(self, model, iter1, iter2, ignore):
-        obj1 = model.get_value(iter1, ROW_HANDLE)
-        obj2 = model.get_value(iter2, ROW_HANDLE)
-
-        return cmp(obj1.guest_cpu_time_percentage(),
-                   obj2.guest_cpu_time_percentage())
-
-    def vmlist_host_cpu_usage_sorter(self, model, iter1, iter2, ignore):
-        obj1 = model.get_value(iter1, ROW_HANDLE)
-        obj2 = model.get_value(iter2, ROW_HANDLE)
-
-        return cmp(obj1.host_cpu_time_percentage(),
-                   obj2.host_cpu_time_percentage())
-
-    def vmlist_memory_usage_sorter(self, model, iter1, iter2, ignore):
-        obj1 = model.get_value(iter1, ROW_HANDLE)
-        obj2 = model.get_value(iter2, ROW_HANDLE)
-
-        return cmp(obj1.stats_memory(),
-                   obj2.stats_memory())
-
-    def vmlist_disk_io_sorter(self, model, iter1, iter2, ignore):
-        obj1 = model.get_value(iter1, ROW_HANDLE)
-        obj2 = model.get_value(iter2, ROW_HANDLE)
-
-        return cmp(obj1.disk_io_rate(), obj2.disk_io_rate())
-
-    def vmlist_network_usage_sorter(self, model, iter1, iter2, ignore):
-        obj1 = model.get_value(iter1, ROW_HANDLE)
-        obj2 = model.get_value(iter2, ROW_HANDLE)
-
-        return cmp(obj1.network_traffic_rate(), obj2.network_traffic_rate())
-
     def enable_polling(self, column):
         if column == COL_DISK:
             widgn = "menu_view_stats_disk"
@@ -1071,42 +1122,54 @@ class vmmManager(vmmGObjectUI):
     def toggle_stats_visible_network(self, src):
         self.toggle_stats_visible(src, COL_NETWORK)
 
+    def _set_graph_data(self, cell, obj, func, *args):
+        """
+        Hand the cell func(GRAPH_LEN, *args) for obj. The vectors are
+        computed at most once per stats update, and the row key lets
+        the cell reuse its image of the graph.
+        """
+        row_key = self.vm_row_key(obj)
+        cache = self._graph_data.setdefault(row_key, {})
+        key = (func.__name__,) + args
+        if key not in cache:
+            cache[key] = func(GRAPH_LEN, *args)
+
+        cell.set_property('data_array', cache[key])
+        cell.set_property('cache_key', row_key)
+
     def guest_cpu_usage_img(self, column_ignore, cell, model, _iter, data):
-        obj = model[_iter][ROW_HANDLE]
+        obj = model.get_value(_iter, ROW_HANDLE)
         if obj is None or not hasattr(obj, "conn"):
             return
 
-        data = obj.guest_cpu_time_vector_limit(GRAPH_LEN)
-        cell.set_property('data_array', data)
+        self._set_graph_data(cell, obj, obj.guest_cpu_time_vector_limit)
 
     def host_cpu_usage_img(self, column_ignore, cell, model, _iter, data):
-        obj = model[_iter][ROW_HANDLE]
+        obj = model.get_value(_iter, ROW_HANDLE)
         if obj is None or not hasattr(obj, "conn"):
             return
 
-        data = obj.host_cpu_time_vector_limit(GRAPH_LEN)
-        cell.set_property('data_array', data)
+        self._set_graph_data(cell, obj, obj.host_cpu_time_vector_limit)
 
     def memory_usage_img(self, column_ignore, cell, model, _iter, data):
-        obj = model[_iter][ROW_HANDLE]
+        obj = model.get_value(_iter, ROW_HANDLE)
         if obj is None or not hasattr(obj, "conn"):
             return
 
-        data = obj.memory_usage_vector_limit(GRAPH_LEN)
-        cell.set_property('data_array', data)
+        self._set_graph_data(cell, obj, obj.memory_usage_vector_limit)
 
     def disk_io_img(self, column_ignore, cell, model, _iter, data):
-        obj = model[_iter][ROW_HANDLE]
+        obj = model.get_value(_iter, ROW_HANDLE)
         if obj is None or not hasattr(obj, "conn"):
             return
 
-        data = obj.disk_io_vector_limit(GRAPH_LEN, self.max_disk_rate)
-        cell.set_property('data_array', data)
+        self._set_graph_data(cell, obj, obj.disk_io_vector_limit,
+                             self.max_disk_rate)
 
     def network_traffic_img(self, column_ignore, cell, model, _iter, data):
-        obj = model[_iter][ROW_HANDLE]
+        obj = model.get_value(_iter, ROW_HANDLE)
         if obj is None or not hasattr(obj, "conn"):
             return
 
-        data = obj.network_traffic_vector_limit(GRAPH_LEN, self.max_net_rate)
-        cell.set_property('data_array', data)
+        self._set_graph_data(cell, obj, obj.network_traffic_vector_limit,
+                             self.max_net_rate)
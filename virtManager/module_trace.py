@@ -21,10 +21,18 @@
 # This module provides a simple way to trace any activity on a specific
 # python class or module. The trace output is logged using the regular
 # logging infrastructure. Invoke this with virt-manager --trace-libvirt
+#
+# virt-manager --trace-libvirt=timing instead only counts calls and sums
+# up their cumulative and self time, with the busiest functions logged
+# periodically. That's cheap enough to leave on against a large host.
+#
+# It also hooks up the virt-manager specific parts of the startup
+# profile, see virtcli/startupprofile.py and --profile-startup
 
 import logging
 import time
 import re
+import threading
 import traceback
 
 from types import FunctionType
@@ -32,6 +40,74 @@ from types import ClassType
 from types import MethodType
 
 
+class _CallStats(object):
+    """
+    Aggregate call counts and times for timing wrappers
+    """
+    def __init__(self):
+        # name -> [calls, cumulative time, self time]
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get_stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def add(self, name, elapsed, selftime):
+        self._lock.acquire()
+        try:
+            entry = self.stats.get(name)
+            if entry is None:
+                entry = self.stats[name] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] += selftime
+        finally:
+            self._lock.release()
+
+    def top(self, count):
+        self._lock.acquire()
+        try:
+            items = [(name, entry[:]) for name, entry in self.stats.items()]
+        finally:
+            self._lock.release()
+
+        items.sort(key=lambda i: i[1][2], reverse=True)
+        return items[:count]
+
+_callstats = _CallStats()
+
+
+def dump_stats(count=20):
+    """
+    Log the count functions with the highest self time
+    """
+    lines = ["%-50s %10s %12s %12s" % ("function", "calls",
+                                       "cumulative", "self")]
+    for name, (calls, cumtime, selftime) in _callstats.top(count):
+        lines.append("%-50s %10d %12.6f %12.6f" %
+                     (name, calls, cumtime, selftime))
+    logging.debug("TRACE STATS top %d by self time:\n%s",
+                  count, "\n".join(lines))
+
+
+def start_stats_dump(interval=60, count=20):
+    """
+    Call dump_stats every interval seconds from a background thread
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            dump_stats(count)
+
+    thread = threading.Thread(target=run, name="module_trace stats dump")
+    thread.daemon = True
+    thread.start()
+
+
 def generate_wrapper(origfunc, name, do_tb):
     def newfunc(*args, **kwargs):
         tb = do_tb and ("\n%s" % "".join(traceback.format_stack())) or ""
@@ -42,38 +118,101 @@ def generate_wrapper(origfunc, name, do_tb):
     return newfunc
 
 
-def wrap_func(module, funcobj, tb):
+def generate_timing_wrapper(origfunc, name):
+    def newfunc(*args, **kwargs):
+        stack = _callstats.get_stack()
+        stack.append(0.0)
+        start = time.time()
+        try:
+            return origfunc(*args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            childtime = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            _callstats.add(name, elapsed, elapsed - childtime)
+
+    return newfunc
+
+
+def _generate(origfunc, name, tb, timing):
+    if timing:
+        return generate_timing_wrapper(origfunc, name)
+    return generate_wrapper(origfunc, name, tb)
+
+
+def wrap_func(module, funcobj, tb, timing=False):
     name = funcobj.__name__
     logging.debug("wrapfunc %s %s", funcobj, name)
 
-    newfunc = generate_wrapper(funcobj, name, tb)
+    newfunc = _generate(funcobj, name, tb, timing)
     setattr(module, name, newfunc)
 
 
-def wrap_method(classobj, methodobj, tb):
+def wrap_method(classobj, methodobj, tb, timing=False):
     name = methodobj.__name__
     fullname = classobj.__name__ + "." + name
     logging.debug("wrapmeth %s", fullname)
 
-    newfunc = generate_wrapper(methodobj, fullname, tb)
+    newfunc = _generate(methodobj, fullname, tb, timing)
     setattr(classobj, name, newfunc)
 
 
-def wrap_class(classobj, tb):
+def wrap_class(classobj, tb, timing=False):
     logging.debug("wrapclas %s %s", classobj, classobj.__name__)
 
     for name in dir(classobj):
         obj = getattr(classobj, name)
         if type(obj) is MethodType:
-            wrap_method(classobj, obj, tb)
+            wrap_method(classobj, obj, tb, timing)
 
 
-def wrap_module(module, regex=None, tb=False):
+def wrap_module(module, regex=None, tb=False, timing=False):
     for name in dir(module):
         if regex and not re.match(regex, name):
             continue
         obj = getattr(module, name)
         if type(obj) is FunctionType:
-            wrap_func(module, obj, tb)
+            wrap_func(module, obj, tb, timing)
         if type(obj) is ClassType or type(obj) is type:
-            wrap_class(obj, tb)
+            wrap_class(obj, tb, timing)
+
+
+def profile_startup(profile):
+    """
+    Time connection opening and ticks, and record when the first tick
+    finished and the first window was drawn. The report is rewritten
+    after each of those, so it's useful without quitting the app.
+    """
+    # pylint: disable=E0611
+    from gi.repository import GLib
+    from gi.repository import GObject
+    from gi.repository import Gtk
+    # pylint: enable=E0611
+    from virtManager.connection import vmmConnection
+
+    def write_report():
+        profile.write()
+        return False
+
+    profile.wrap_method(vmmConnection, "_open_thread", "conn-open-thread")
+    profile.wrap_method(vmmConnection, "tick", "conn-tick")
+
+    timedtick = vmmConnection.tick
+    ticked = []
+    def tick(self, *args, **kwargs):
+        ret = timedtick(self, *args, **kwargs)
+        if not ticked and self.is_active():
+            ticked.append(True)
+            profile.mark("first-tick")
+            GLib.idle_add(write_report)
+        return ret
+    vmmConnection.tick = tick
+
+    def first_draw(*args):
+        ignore = args
+        profile.mark("first-paint")
+        GLib.idle_add(write_report)
+        # Returning False removes the hook
+        return False
+    GObject.add_emission_hook(Gtk.Window, "draw", first_draw)
@@ -18,6 +18,7 @@
 # MA 02110-1301 USA.
 #
 
+import collections
 import os
 import termios
 import tty
@@ -29,12 +30,32 @@ import logging
 from gi.repository import Gdk
 from gi.repository import GLib
 from gi.repository import Gtk
+from gi.repository import Pango
 from gi.repository import Vte
 # pylint: enable=E0611
 
 import libvirt
 
 from virtManager.baseclass import vmmGObject
+from virtManager.consolelog import (ConsoleCapture, CaptureReader,
+                                    get_capture_files)
+
+# Most data we read from a console stream in one go
+_RECV_SIZE = 64 * 1024
+# Stop reading from the stream once this much output is waiting for
+# the terminal, so the guest is throttled rather than the UI. Reading
+# resumes once the backlog drops to half of this.
+_MAX_PENDING = 1024 * 1024
+# Queued output is fed to the terminal at most this often (in ms), and
+# at most _FEED_SIZE bytes at a time, so VTE parses big batches instead
+# of lots of tiny ones without starving the rest of the UI
+_FEED_INTERVAL = 1000 / 30
+_FEED_SIZE = 256 * 1024
+
+# Lines of captured output shown around a search result, and the most
+# search results we list
+_CAPTURE_CONTEXT = 200
+_CAPTURE_MAX_RESULTS = 1000
 
 
 class ConsoleConnection(vmmGObject):
@@ -44,11 +65,15 @@ class ConsoleConnection(vmmGObject):
         self.vm = vm
         self.conn = vm.conn
 
+        # ConsoleCapture that gets a copy of everything the guest prints
+        self.capture = None
+
     def _cleanup(self):
         self.close()
 
         self.vm = None
         self.conn = None
+        self.capture = None
 
     def is_open(self):
         raise NotImplementedError()
@@ -132,21 +157,114 @@ class LocalConsoleConnection(ConsoleConnection):
 
         data = os.read(self.fd, 1024)
         terminal.feed(data)
+        if self.capture:
+            self.capture.write(data)
         return True
 
 
+class _ChunkQueue(object):
+    """
+    FIFO byte buffer that keeps the chunks appended to it, so queueing
+    and consuming data never copies what is already queued
+    """
+    def __init__(self):
+        self._chunks = collections.deque()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self, data):
+        if data:
+            self._chunks.append(data)
+            self._len += len(data)
+
+    def peek(self):
+        """
+        Return the first queued chunk, without removing it
+        """
+        return self._chunks and self._chunks[0] or ""
+
+    def consume(self, count):
+        """
+        Drop count bytes from the front of the first chunk
+        """
+        chunk = self._chunks.popleft()
+        if count < len(chunk):
+            self._chunks.appendleft(chunk[count:])
+        self._len -= min(count, len(chunk))
+
+    def get(self, maxlen):
+        """
+        Remove and return up to maxlen bytes from the front of the queue
+        """
+        ret = []
+        size = 0
+        while self._chunks and size < maxlen:
+            chunk = self._chunks.popleft()
+            if size + len(chunk) > maxlen:
+                self._chunks.appendleft(chunk[maxlen - size:])
+                chunk = chunk[:maxlen - size]
+            ret.append(chunk)
+            size += len(chunk)
+
+        self._len -= size
+        return "".join(ret)
+
+    def clear(self):
+        self._chunks.clear()
+        self._len = 0
+
+
 class LibvirtConsoleConnection(ConsoleConnection):
     def __init__(self, vm):
         ConsoleConnection.__init__(self, vm)
 
         self.stream = None
+        self.terminal = None
 
-        self.streamToTerminal = ""
-        self.terminalToStream = ""
+        self.streamToTerminal = _ChunkQueue()
+        self.terminalToStream = _ChunkQueue()
+
+        self._events = 0
+        self._reading = True
+        self._feed_source = None
+
+    def _cleanup(self):
+        ConsoleConnection._cleanup(self)
+        self.terminal = None
+
+    def _update_events(self):
+        """
+        Only ask for the stream events we can handle right now: stop
+        reading while the terminal is behind, and only wait for the
+        stream to become writable if we have something to send.
+        """
+        if not self.stream:
+            return
+
+        pending = len(self.streamToTerminal)
+        if self._reading and pending >= _MAX_PENDING:
+            logging.debug("Console output backlog is %d bytes, "
+                          "pausing stream reads", pending)
+            self._reading = False
+        elif not self._reading and pending <= _MAX_PENDING / 2:
+            self._reading = True
+
+        events = (libvirt.VIR_STREAM_EVENT_ERROR |
+                  libvirt.VIR_STREAM_EVENT_HANGUP)
+        if self._reading:
+            events |= libvirt.VIR_STREAM_EVENT_READABLE
+        if self.terminalToStream:
+            events |= libvirt.VIR_STREAM_EVENT_WRITABLE
+
+        if events != self._events:
+            self.stream.eventUpdateCallback(events)
+            self._events = events
 
     def _event_on_stream(self, stream, events, opaque):
         ignore = stream
-        terminal = opaque
+        ignore = opaque
 
         if (events & libvirt.VIR_EVENT_HANDLE_ERROR or
             events & libvirt.VIR_EVENT_HANDLE_HANGUP):
@@ -154,9 +272,9 @@ class LibvirtConsoleConnection(ConsoleConnection):
             self.close()
             return
 
-        if events & libvirt.VIR_EVENT_HANDLE_READABLE:
+        if events & libvirt.VIR_EVENT_HANDLE_READABLE and self._reading:
             try:
-                got = self.stream.recv(1024 * 100)
+                got = self.stream.recv(_RECV_SIZE)
             except:
                 logging.exception("Error receiving stream data")
                 self.close()
@@ -170,16 +288,18 @@ class LibvirtConsoleConnection(ConsoleConnection):
                 self.close()
                 return
 
-            queued_text = bool(self.streamToTerminal)
-            self.streamToTerminal += got
-            if not queued_text:
-                self.idle_add(self.display_data, terminal)
+            self.streamToTerminal.append(got)
+            if self.capture:
+                self.capture.write(got)
+            if self._feed_source is None:
+                self._feed_source = self.timeout_add(_FEED_INTERVAL,
+                                                     self.display_data)
 
         if (events & libvirt.VIR_EVENT_HANDLE_WRITABLE and
             self.terminalToStream):
 
             try:
-                done = self.stream.send(self.terminalToStream)
+                done = self.stream.send(self.terminalToStream.peek())
             except:
                 logging.exception("Error sending stream data")
                 self.close()
@@ -189,12 +309,9 @@ class LibvirtConsoleConnection(ConsoleConnection):
                 # This is basically EAGAIN
                 return
 
-            self.terminalToStream = self.terminalToStream[done:]
+            self.terminalToStream.consume(done)
 
-        if not self.terminalToStream:
-            self.stream.eventUpdateCallback(libvirt.VIR_STREAM_EVENT_READABLE |
-                                            libvirt.VIR_STREAM_EVENT_ERROR |
-                                            libvirt.VIR_STREAM_EVENT_HANGUP)
+        self._update_events()
 
 
     def is_open(self):
@@ -213,10 +330,13 @@ class LibvirtConsoleConnection(ConsoleConnection):
         stream = self.conn.get_backend().newStream(libvirt.VIR_STREAM_NONBLOCK)
         self.vm.open_console(name, stream)
         self.stream = stream
+        self.terminal = terminal
 
-        self.stream.eventAddCallback((libvirt.VIR_STREAM_EVENT_READABLE |
-                                      libvirt.VIR_STREAM_EVENT_ERROR |
-                                      libvirt.VIR_STREAM_EVENT_HANGUP),
+        self._reading = True
+        self._events = (libvirt.VIR_STREAM_EVENT_READABLE |
+                        libvirt.VIR_STREAM_EVENT_ERROR |
+                        libvirt.VIR_STREAM_EVENT_HANGUP)
+        self.stream.eventAddCallback(self._events,
                                      self._event_on_stream,
                                      terminal)
 
@@ -232,6 +352,14 @@ class LibvirtConsoleConnection(ConsoleConnection):
                 logging.exception("Error finishing stream")
 
         self.stream = None
+        self._events = 0
+
+        # Show whatever the guest sent before going away
+        self._stop_feed()
+        if self.terminal and self.streamToTerminal:
+            self.terminal.feed(self.streamToTerminal.get(_MAX_PENDING))
+        self.streamToTerminal.clear()
+        self.terminalToStream.clear()
 
     def send_data(self, src, text, length, terminal):
         ignore = src
@@ -241,19 +369,34 @@ class LibvirtConsoleConnection(ConsoleConnection):
         if self.stream is None:
             return
 
-        self.terminalToStream += text
-        if self.terminalToStream:
-            self.stream.eventUpdateCallback(libvirt.VIR_STREAM_EVENT_READABLE |
-                                            libvirt.VIR_STREAM_EVENT_WRITABLE |
-                                            libvirt.VIR_STREAM_EVENT_ERROR |
-                                            libvirt.VIR_STREAM_EVENT_HANGUP)
+        self.terminalToStream.append(text)
+        self._update_events()
 
-    def display_data(self, terminal):
-        if not self.streamToTerminal:
-            return
+    def _stop_feed(self):
+        handle = self._feed_source
+        self._feed_source = None
+        # cleanup() may have removed it already
+        if handle in self._gobject_timeouts:
+            self.remove_gobject_timeout(handle)
 
-        terminal.feed(self.streamToTerminal)
-        self.streamToTerminal = ""
+    def display_data(self):
+        """
+        Feed the next batch of queued output to the terminal. Runs as
+        a timeout while there is output left.
+        """
+        keep = False
+        try:
+            data = self.streamToTerminal.get(_FEED_SIZE)
+            if data:
+                self.terminal.feed(data)
+
+            self._update_events()
+            keep = bool(self.streamToTerminal)
+            return keep
+        finally:
+            if not keep:
+                # Also on error, so the next output schedules a new feed
+                self._stop_feed()
 
 
 class vmmSerialConsole(vmmGObject):
@@ -313,6 +456,8 @@ class vmmSerialConsole(vmmGObject):
         self.serial_copy = None
         self.serial_paste = None
         self.serial_close = None
+        self.serial_capture = None
+        self.serial_search = None
         self.init_popup()
 
         self.terminal = None
@@ -322,6 +467,17 @@ class vmmSerialConsole(vmmGObject):
         self.error_label = None
         self.init_ui()
 
+        self.search_dialog = None
+        self.search_entry = None
+        self.search_results = None
+        self.search_status = None
+        self.search_view = None
+        # Capture file path -> CaptureReader, for the last search
+        self.capture_readers = {}
+
+        if self.vm.get_serial_capture():
+            self.start_capture()
+
         self.vm.connect("status-changed", self.vm_status_changed)
 
     def init_terminal(self):
@@ -351,6 +507,18 @@ class vmmSerialConsole(vmmGObject):
         self.serial_paste.connect("activate", self.serial_paste_text)
         self.serial_popup.add(self.serial_paste)
 
+        self.serial_popup.add(Gtk.SeparatorMenuItem())
+
+        self.serial_capture = Gtk.CheckMenuItem.new_with_mnemonic(
+            _("Ca_pture Output to Log"))
+        self.serial_capture.connect("toggled", self.serial_capture_toggled)
+        self.serial_popup.add(self.serial_capture)
+
+        self.serial_search = Gtk.MenuItem.new_with_mnemonic(
+            _("_Search Captured Output..."))
+        self.serial_search.connect("activate", self.show_capture_search)
+        self.serial_popup.add(self.serial_search)
+
     def init_ui(self):
         self.box = Gtk.Notebook()
         self.box.set_show_tabs(False)
@@ -379,9 +547,15 @@ class vmmSerialConsole(vmmGObject):
         self.box.show_all()
 
     def _cleanup(self):
+        self.stop_capture()
         self.console.cleanup()
         self.console = None
 
+        if self.search_dialog:
+            self.search_dialog.destroy()
+        self.search_dialog = None
+        self.capture_readers = {}
+
         self.vm = None
         self.terminal = None
         self.box = None
@@ -448,6 +622,9 @@ class vmmSerialConsole(vmmGObject):
             self.serial_copy.set_sensitive(True)
         else:
             self.serial_copy.set_sensitive(False)
+        self.serial_capture.set_active(bool(self.console.capture))
+        self.serial_search.set_sensitive(
+            bool(get_capture_files(self.get_capture_path())))
         self.serial_popup.popup(None, None, None, None, 0, event.time)
 
     def serial_copy_text(self, src_ignore):
@@ -455,3 +632,162 @@ class vmmSerialConsole(vmmGObject):
 
     def serial_paste_text(self, src_ignore):
         self.terminal.paste_clipboard()
+
+
+    ##########################
+    # Output capture support #
+    ##########################
+
+    def get_capture_path(self):
+        return os.path.join(self.vm.get_cache_dir(),
+                            "serial%s.log" % self.target_port)
+
+    def start_capture(self):
+        if self.console.capture:
+            return
+
+        path = self.get_capture_path()
+        logging.debug("Capturing serial console output to %s", path)
+        maxsize = self.config.get_serial_capture_max_size() * 1024 * 1024
+        self.console.capture = ConsoleCapture(
+            path, maxsize, self.config.get_serial_capture_backups())
+
+    def stop_capture(self):
+        if not self.console.capture:
+            return
+
+        self.console.capture.close()
+        self.console.capture = None
+
+    def serial_capture_toggled(self, src):
+        active = src.get_active()
+        if active == bool(self.console.capture):
+            return
+
+        self.vm.set_serial_capture(active)
+        if active:
+            self.start_capture()
+        else:
+            self.stop_capture()
+
+    def init_capture_search(self):
+        self.search_dialog = Gtk.Dialog(_("Search %s Output") % self.name)
+        self.search_dialog.add_button(Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE)
+        self.search_dialog.set_default_size(700, 500)
+        self.search_dialog.connect("response",
+                                   lambda d, r: d.hide())
+        self.search_dialog.connect("delete-event",
+                                   lambda d, e: d.hide_on_delete())
+
+        self.search_entry = Gtk.Entry()
+        self.search_entry.connect("activate", self.capture_search)
+        findbutton = Gtk.Button.new_from_stock(Gtk.STOCK_FIND)
+        findbutton.connect("clicked", self.capture_search)
+        entrybox = Gtk.HBox(spacing=6)
+        entrybox.pack_start(self.search_entry, True, True, 0)
+        entrybox.pack_start(findbutton, False, False, 0)
+
+        # Log name, line number, text, log path
+        model = Gtk.ListStore(str, int, str, str)
+        self.search_results = Gtk.TreeView(model)
+        for idx, title in enumerate([_("Log"), _("Line"), _("Text")]):
+            col = Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=idx)
+            self.search_results.append_column(col)
+        selection = self.search_results.get_selection()
+        selection.connect("changed", self.capture_result_selected)
+        resultscroll = Gtk.ScrolledWindow()
+        resultscroll.add(self.search_results)
+
+        self.search_view = Gtk.TextView()
+        self.search_view.set_editable(False)
+        self.search_view.override_font(Pango.FontDescription("monospace"))
+        viewscroll = Gtk.ScrolledWindow()
+        viewscroll.add(self.search_view)
+
+        paned = Gtk.VPaned()
+        paned.pack1(resultscroll, True, False)
+        paned.pack2(viewscroll, True, False)
+        paned.set_position(180)
+
+        self.search_status = Gtk.Label()
+        self.search_status.set_alignment(0, 0.5)
+
+        vbox = self.search_dialog.get_content_area()
+        vbox.set_spacing(6)
+        vbox.pack_start(entrybox, False, False, 0)
+        vbox.pack_start(paned, True, True, 0)
+        vbox.pack_start(self.search_status, False, False, 0)
+
+    def show_capture_search(self, src_ignore):
+        if not self.search_dialog:
+            self.init_capture_search()
+
+        toplevel = self.box.get_toplevel()
+        if isinstance(toplevel, Gtk.Window):
+            self.search_dialog.set_transient_for(toplevel)
+        self.search_dialog.show_all()
+        self.search_dialog.present()
+
+    def capture_search(self, src_ignore):
+        text = self.search_entry.get_text()
+        model = self.search_results.get_model()
+        model.clear()
+        self.search_view.get_buffer().set_text("")
+        if not text:
+            self.search_status.set_text("")
+            return
+
+        # Search the rotated logs too, oldest first
+        self.capture_readers = {}
+        count = 0
+        try:
+            for path in get_capture_files(self.get_capture_path()):
+                reader = CaptureReader(path)
+                self.capture_readers[path] = reader
+                results = reader.search(
+                    text, maxresults=_CAPTURE_MAX_RESULTS - count)
+
+                for lineno, line in results:
+                    model.append([os.path.basename(path), lineno + 1,
+                                  line.rstrip("\r\n").decode("utf-8",
+                                                              "replace"),
+                                  path])
+                count += len(results)
+                if count >= _CAPTURE_MAX_RESULTS:
+                    break
+        except (IOError, OSError), e:
+            logging.debug("Error searching serial capture: %s", e)
+            self.search_status.set_text(
+                _("Error reading captured output: %s") % e)
+            return
+
+        if count >= _CAPTURE_MAX_RESULTS:
+            msg = _("Showing the first %d matches") % count
+        else:
+            msg = _("%d matches") % count
+        self.search_status.set_text(msg)
+
+    def capture_result_selected(self, selection):
+        model, treeiter = selection.get_selected()
+        if not treeiter:
+            return
+        reader = self.capture_readers.get(model[treeiter][3])
+        if not reader:
+            return
+
+        # Only load the lines around the match, not the whole capture
+        lineno = model[treeiter][1] - 1
+        first = max(0, lineno - _CAPTURE_CONTEXT / 2)
+        try:
+            lines = reader.read_lines(first, _CAPTURE_CONTEXT)
+        except (IOError, OSError), e:
+            logging.debug("Error reading serial capture: %s", e)
+            return
+
+        buf = self.search_view.get_buffer()
+        buf.set_text("".join(lines).decode("utf-8", "replace"))
+        start = buf.get_iter_at_line(lineno - first)
+        end = start.copy()
+        end.forward_to_line_end()
+        buf.select_range(start, end)
+        self.search_view.scroll_to_mark(buf.get_insert(), 0.0, True, 0.0, 0.5)
@@ -76,6 +76,11 @@ def set_sparse_tooltip(widget):
 
 
 def host_disk_space(conn):
+    """
+    Free space in GB in the default storage location. This can block
+    for a long time refreshing the pool, so the UI should go through
+    vmmHostSpace instead.
+    """
     pool = get_default_pool(conn)
     path = get_default_dir(conn)
 
@@ -84,7 +89,9 @@ def host_disk_space(conn):
         # FIXME: make sure not inactive?
         # FIXME: use a conn specific function after we send pool-added
         pool.refresh()
-        avail = int(pool.get_available())
+        # refresh() only updates the pool XML from an idle callback,
+        # so ask libvirt directly: info() is [state, cap, alloc, avail]
+        avail = int(pool.get_backend().info()[3])
 
     elif not conn.is_remote() and os.path.exists(path):
         vfs = os.statvfs(os.path.dirname(path))
@@ -94,19 +101,11 @@ def host_disk_space(conn):
 
 
 def update_host_space(conn, widget):
-    try:
-        max_storage = host_disk_space(conn)
-    except:
-        logging.exception("Error determining host disk space")
-        return
-
-    def pretty_storage(size):
-        return "%.1f GB" % float(size)
-
-    hd_label = ("%s available in the default location" %
-                pretty_storage(max_storage))
-    hd_label = ("<span color='#484848'>%s</span>" % hd_label)
-    widget.set_markup(hd_label)
+    """
+    Show the free space in the default location in widget. The value
+    is filled in asynchronously and kept up to date.
+    """
+    conn.get_host_space().add_label(widget)
 
 
 def check_default_pool_active(err, conn):
@@ -0,0 +1,279 @@
+#
+# Copyright (C) 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+#
+
+"""
+Startup profiling for virt-manager and the command line tools, enabled
+with --profile-startup=FILE. We record how long every module takes to
+import, how long selected calls take, and when named events happen,
+then write it all to FILE as JSON.
+
+This needs to be started before the app imports anything heavy, so
+the scripts call early_init() right at the top, before argument
+parsing. The option is then accepted again by the real parser so it
+shows up in --help.
+"""
+
+import __builtin__
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+OPTION = "--profile-startup"
+
+# Only the first calls of each label are listed individually, the rest
+# are just counted
+_MAX_CALLS = 20
+
+_profile = None
+
+
+def _find_path(argv):
+    for idx, arg in enumerate(argv):
+        if arg == OPTION and idx + 1 < len(argv):
+            return argv[idx + 1]
+        if arg.startswith(OPTION + "="):
+            return arg.split("=", 1)[1]
+    return None
+
+
+class StartupProfile(object):
+    """
+    Collects the timings. All times in the report are in seconds, and
+    points in time are relative to when the profile was created.
+    """
+    def __init__(self, path, appname):
+        self.path = path
+        self.appname = appname
+        self.start = time.time()
+
+        self._imports = []
+        self._events = []
+        self._calls = {}
+        self._wrapped = set()
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origimport = None
+
+    def _offset(self, now=None):
+        return (now or time.time()) - self.start
+
+
+    ##################
+    # Import timings #
+    ##################
+
+    def install_import_hook(self):
+        if self._origimport:
+            return
+        self._origimport = __builtin__.__import__
+        __builtin__.__import__ = self._import
+
+    def remove_import_hook(self):
+        if not self._origimport:
+            return
+        __builtin__.__import__ = self._origimport
+        self._origimport = None
+
+    def _import(self, name, globs=None, locs=None, fromlist=None, level=-1):
+        origimport = self._origimport or __builtin__.__import__
+
+        # Work out which modules this import could load. Only time the
+        # ones that actually do something, everything else is just a
+        # sys.modules lookup.
+        bases = [name]
+        if level != 0 and globs and globs.get("__name__"):
+            pkg = globs["__name__"]
+            if "__path__" not in globs:
+                pkg = pkg.rpartition(".")[0]
+            if pkg:
+                bases.append(pkg + "." + name)
+
+        candidates = bases[:]
+        for base in bases:
+            for sub in (fromlist or []):
+                if sub != "*":
+                    candidates.append(base + "." + sub)
+
+        new = [c for c in candidates if c not in sys.modules]
+        if not new:
+            return origimport(name, globs, locs, fromlist, level)
+
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+
+        start = time.time()
+        stack.append(0.0)
+        try:
+            return origimport(name, globs, locs, fromlist, level)
+        finally:
+            elapsed = time.time() - start
+            childtime = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+
+            loaded = [c for c in new if sys.modules.get(c) is not None]
+            if loaded:
+                self._add_import("+".join(loaded), start,
+                                 elapsed, elapsed - childtime)
+
+    def _add_import(self, name, start, elapsed, selftime):
+        self._lock.acquire()
+        try:
+            self._imports.append({
+                "module": name,
+                "start": self._offset(start),
+                "time": elapsed,
+                "self": selftime,
+            })
+        finally:
+            self._lock.release()
+
+
+    ##########################
+    # Events and call timing #
+    ##########################
+
+    def mark(self, name):
+        """
+        Record that the named event happened now
+        """
+        self._lock.acquire()
+        try:
+            self._events.append({"name": name, "time": self._offset()})
+        finally:
+            self._lock.release()
+
+    def add_call(self, label, start, elapsed):
+        self._lock.acquire()
+        try:
+            info = self._calls.setdefault(label,
+                {"count": 0, "total": 0.0, "calls": []})
+            info["count"] += 1
+            info["total"] += elapsed
+            if len(info["calls"]) < _MAX_CALLS:
+                info["calls"].append({"start": self._offset(start),
+                                      "time": elapsed})
+        finally:
+            self._lock.release()
+
+    def wrap_method(self, classobj, name, label=None):
+        """
+        Replace classobj.name with a wrapper that records how long each
+        call takes, like module_trace does for logging
+        """
+        label = label or "%s.%s" % (classobj.__name__, name)
+        if (classobj, name) in self._wrapped:
+            return
+        self._wrapped.add((classobj, name))
+        origfunc = getattr(classobj, name)
+
+        def newfunc(*args, **kwargs):
+            start = time.time()
+            try:
+                return origfunc(*args, **kwargs)
+            finally:
+                self.add_call(label, start, time.time() - start)
+
+        newfunc.__name__ = name
+        setattr(classobj, name, newfunc)
+
+
+    ##########
+    # Report #
+    ##########
+
+    def get_report(self):
+        self._lock.acquire()
+        try:
+            imports = self._imports[:]
+            events = self._events[:]
+            calls = dict((label, dict(info, calls=info["calls"][:]))
+                         for label, info in self._calls.items())
+        finally:
+            self._lock.release()
+
+        imports.sort(key=lambda i: i["start"])
+        return {
+            "app": self.appname,
+            "argv": sys.argv,
+            "pid": os.getpid(),
+            "start": self.start,
+            "duration": self._offset(),
+            "import_count": len(imports),
+            "import_self_total": sum([i["self"] for i in imports]),
+            "imports": imports,
+            "events": events,
+            "calls": calls,
+        }
+
+    def write(self):
+        """
+        Write the report collected so far. Can be called multiple times,
+        every call replaces the previous report.
+        """
+        try:
+            report = self.get_report()
+            tmppath = self.path + ".tmp"
+            f = file(tmppath, "w")
+            try:
+                json.dump(report, f, indent=2, sort_keys=True)
+            finally:
+                f.close()
+            os.rename(tmppath, self.path)
+        except Exception, e:
+            logging.debug("Error writing startup profile to %s: %s",
+                          self.path, e)
+            return
+
+        logging.debug("Wrote startup profile to %s: %d imports, %.3fs",
+                      self.path, report["import_count"], report["duration"])
+
+
+def early_init(appname, argv=None):
+    """
+    Start profiling if --profile-startup was passed on the command line.
+    Returns the profile, or None if profiling wasn't requested.
+    """
+    global _profile
+    if _profile:
+        return _profile
+
+    path = _find_path(argv is None and sys.argv or argv)
+    if not path:
+        return None
+
+    _profile = StartupProfile(os.path.abspath(path), appname)
+    _profile.install_import_hook()
+    atexit.register(_profile.write)
+    return _profile
+
+
+def get_profile():
+    return _profile
+
+
+def mark(name):
+    if _profile:
+        _profile.mark(name)
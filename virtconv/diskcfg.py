@@ -20,12 +20,19 @@
 #
 
 import subprocess
+import tarfile
 import shutil
 import errno
 import sys
 import os
 import re
 import logging
+import threading
+
+import urlgrabber.progress
+
+from virtconv import qcow2
+from virtconv import vmdk
 
 
 DISK_FORMAT_NONE = 0
@@ -80,6 +87,13 @@ checksum_types = {
     CSUM_SHA256 : "sha256",
 }
 
+# Default number of disks convert_disks() converts at once
+CONVERT_WORKERS = 2
+
+# (archive path, mtime) -> {member name: TarInfo}
+_archive_members = {}
+_archive_lock = threading.Lock()
+
 
 def ensuredirs(path):
     """
@@ -93,6 +107,28 @@ def ensuredirs(path):
             raise
 
 
+def get_archive_members(archive):
+    """
+    Return a dict mapping the normalized member names of a tar archive
+    to their TarInfo. Listing a tar means reading every header in it,
+    so this is done once per archive and shared by all its disks.
+    """
+    key = (os.path.abspath(archive), os.path.getmtime(archive))
+    _archive_lock.acquire()
+    try:
+        if key not in _archive_members:
+            tar = tarfile.open(archive, "r:")
+            try:
+                _archive_members[key] = dict(
+                    [(os.path.normpath(m.name), m)
+                     for m in tar.getmembers()])
+            finally:
+                tar.close()
+        return _archive_members[key]
+    finally:
+        _archive_lock.release()
+
+
 def run_cmd(cmd):
     """
     Return the exit status and output to stdout and stderr.
@@ -105,6 +141,56 @@ def run_cmd(cmd):
     return ret, proc.stdout.readlines(), proc.stderr.readlines()
 
 
+def run_qemu_img(args, meter, size):
+    """
+    Run qemu-img (or kvm-img) with the passed args, which must include
+    -p. Its progress output is turned into meter updates, scaled to
+    size. Returns (exit status, stderr output).
+    """
+    for binary in ["qemu-img", "kvm-img"]:
+        cmd = [binary] + args
+        logging.debug("Running command: %s", " ".join(cmd))
+        try:
+            proc = subprocess.Popen(cmd, stderr=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    close_fds=True)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                continue
+            raise
+
+        # stderr is drained in a thread so a chatty qemu-img can't
+        # block while we wait on its progress output
+        stderr = []
+        errthread = threading.Thread(target=lambda:
+                                     stderr.append(proc.stderr.read()))
+        errthread.daemon = True
+        errthread.start()
+
+        # Progress lines look like '    (12.34/100%)\r'
+        buff = ""
+        while True:
+            char = proc.stdout.read(1)
+            if not char:
+                break
+            if char not in "\r\n":
+                buff += char
+                continue
+
+            match = re.search(r"\(([\d.]+)/100%\)", buff)
+            buff = ""
+            if match:
+                meter.update(int(size * float(match.group(1)) / 100))
+
+        ret = proc.wait()
+        errthread.join()
+        if ret == 127:
+            continue
+        return ret, "".join(stderr)
+
+    return 127, "qemu-img not found"
+
+
 def run_vdiskadm(args):
     """Run vdiskadm, returning the output."""
     ret, stdout, stderr = run_cmd(["/usr/sbin/vdiskadm"] + args)
@@ -130,6 +216,10 @@ class disk(object):
         self.clean = []
         self.csum_dict = {}
 
+        # OVA archive the disk is stored in. If set, path is the name of
+        # the disk within the archive
+        self.archive = None
+
     def cleanup(self):
         """
         Remove any generated output.
@@ -144,11 +234,24 @@ class disk(object):
         self.clean = []
 
     def copy_file(self, infile, outfile):
-        """Copy an individual file."""
+        """
+        Copy an individual file. For a VMDK descriptor, the extent files
+        it refers to are copied alongside it.
+        """
         self.clean += [outfile]
         ensuredirs(outfile)
         shutil.copy(infile, outfile)
 
+        if self.format != DISK_FORMAT_VMDK:
+            return
+        for extent in vmdk.get_extent_files(infile):
+            dest = os.path.join(os.path.dirname(outfile),
+                                os.path.basename(extent))
+            if os.path.abspath(extent) == os.path.abspath(dest):
+                continue
+            self.clean += [dest]
+            shutil.copy(extent, dest)
+
     def out_file(self, out_format):
         """Return the relative path of the output file."""
         if not out_format:
@@ -172,7 +275,7 @@ class disk(object):
 
         run_vdiskadm(["import", "-fp", absin, absout])
 
-    def qemu_convert(self, absin, absout, out_format):
+    def qemu_convert(self, absin, absout, out_format, meter=None):
         """
         Use qemu-img to convert the given disk.  Note that at least some
         version of qemu-img cannot handle multi-file VMDKs, so this can
@@ -182,17 +285,20 @@ class disk(object):
         """
 
         self.clean += [absout]
-
-        ret, ignore, stderr = run_cmd(["qemu-img", "convert", "-O",
-            qemu_formats[out_format], absin, absout])
-        if ret == 127:
-            ret, ignore, stderr = run_cmd(["kvm-img", "convert", "-O",
-                qemu_formats[out_format], absin, absout])
+        if meter is None:
+            meter = urlgrabber.progress.BaseMeter()
+
+        size = os.path.getsize(absin)
+        meter.start(size=size, text=_("Converting %s") %
+                    os.path.basename(absin))
+        ret, stderr = run_qemu_img(["convert", "-p", "-O",
+            qemu_formats[out_format], absin, absout], meter, size)
         if ret != 0:
             raise RuntimeError("Disk conversion failed with "
-                "exit status %d: %s" % (ret, "".join(stderr)))
-        if len(stderr):
-            print >> sys.stderr, stderr
+                "exit status %d: %s" % (ret, stderr))
+        if stderr:
+            logging.debug("qemu-img stderr: %s", stderr)
+        meter.end(size)
 
     def copy(self, indir, outdir, out_format):
         """
@@ -225,7 +331,7 @@ class disk(object):
         # in the disk filename and we're done.
         #
         if indir == outdir:
-            if relin != relout:
+            if relin != relout and not need_conversion:
                 # vdisks cannot have spaces
                 if self.format == DISK_FORMAT_VDISK:
                     raise RuntimeError("Disk conversion failed: "
@@ -237,7 +343,6 @@ class disk(object):
 
         #
         # If we're not performing any conversion, just copy the file.
-        # XXX: This can go wrong for multi-part disks!
         #
         if not need_conversion:
             self.clean += [absout]
@@ -251,14 +356,15 @@ class disk(object):
         #
         return False, True
 
-    def convert(self, indir, outdir, output_format):
+    def _prepare_convert(self, indir, outdir, output_format):
         """
-        Convert a disk into the requested format if possible, in the
-        given output directory.  Raises RuntimeError or other failures.
+        Do any copying needed before conversion, and return an
+        (absin, absout, out_format) tuple describing the conversion
+        left to do, or None if there is nothing to convert.
         """
 
         if self.type != DISK_TYPE_DISK:
-            return
+            return None
 
         out_format = disk_format_names[output_format]
 
@@ -275,11 +381,21 @@ class disk(object):
         indir = os.path.normpath(os.path.abspath(indir))
         outdir = os.path.normpath(os.path.abspath(outdir))
 
+        if self.archive:
+            # Even with no conversion, the disk has to come out of the
+            # archive, so there's always something to do
+            absout = os.path.join(outdir, self.out_file(out_format))
+            ensuredirs(absout)
+            if os.getenv("VIRTCONV_TEST_NO_DISK_CONVERSION"):
+                self._finish_convert(out_format)
+                return None
+            return self.path, absout, out_format
+
         input_in_outdir, need_conversion = self.copy(indir, outdir, out_format)
 
         if not need_conversion:
             assert(input_in_outdir)
-            return
+            return None
 
         if os.path.isabs(self.path):
             raise NotImplementedError(_("Cannot convert disk with absolute"
@@ -298,15 +414,264 @@ class disk(object):
         if os.getenv("VIRTCONV_TEST_NO_DISK_CONVERSION"):
             self.format = out_format
             self.path = self.out_file(self.format)
-            return
+            return None
 
-        if out_format == DISK_FORMAT_VDISK:
+        return absin, absout, out_format
+
+    def vmdk_convert(self, absin, absout, out_format, meter=None):
+        """
+        Convert a VMDK split over several extent files with our own
+        reader, in one sequential pass over the extents.
+        """
+        self.clean += [absout]
+        reader = vmdk.VMDKReader(absin)
+        try:
+            stream_convert(reader, absout, out_format, meter=meter,
+                           text=_("Converting %s") % os.path.basename(absin))
+        finally:
+            reader.close()
+
+    def archive_convert(self, member, absout, out_format, meter=None):
+        """
+        Convert a disk stored in an OVA archive, reading it in place
+        rather than extracting it first, where possible.
+        """
+        self.clean += [absout]
+        text = _("Converting %s") % os.path.basename(member)
+
+        members = get_archive_members(self.archive)
+        size = members[os.path.normpath(member)].size
+        tar = tarfile.open(self.archive, "r:")
+        try:
+            def opener(name):
+                name = os.path.join(os.path.dirname(member), name)
+                return tar.extractfile(members[os.path.normpath(name)])
+
+            if out_format in [DISK_FORMAT_NONE, self.format]:
+                fobj = opener(os.path.basename(member))
+                stream_copy(fobj, size, absout, meter=meter, text=text)
+                return
+
+            if (self.format == DISK_FORMAT_RAW and
+                out_format == DISK_FORMAT_QCOW2):
+                reader = RawReader(opener(os.path.basename(member)), size)
+                stream_convert(reader, absout, out_format,
+                               meter=meter, text=text)
+                return
+
+            if (self.format == DISK_FORMAT_VMDK and
+                out_format in [DISK_FORMAT_RAW, DISK_FORMAT_QCOW2]):
+                try:
+                    reader = vmdk.VMDKReader(member, opener=opener)
+                    try:
+                        stream_convert(reader, absout, out_format,
+                                       meter=meter, text=text)
+                    finally:
+                        reader.close()
+                    return
+                except NotImplementedError, e:
+                    logging.debug("Native VMDK conversion not possible, "
+                                  "falling back to qemu-img: %s", e)
+
+            # qemu-img needs a real file, so this is the one case where
+            # the disk is extracted before converting
+            tmpfile = absout + ".extract"
+            self.clean += [tmpfile]
+            fobj = opener(os.path.basename(member))
+            stream_copy(fobj, size, tmpfile)
+            try:
+                self.qemu_convert(tmpfile, absout, out_format, meter=meter)
+            finally:
+                os.unlink(tmpfile)
+        finally:
+            tar.close()
+
+    def input_size(self, absin):
+        """Return the size of the input file for a conversion."""
+        if not self.archive:
+            return os.path.getsize(absin)
+
+        member = get_archive_members(self.archive).get(
+            os.path.normpath(absin))
+        if not member:
+            raise IOError(_("%s not found in archive %s") %
+                          (absin, self.archive))
+        return member.size
+
+    def _finish_convert(self, out_format):
+        self.path = self.out_file(out_format)
+        if out_format != DISK_FORMAT_NONE:
+            self.format = out_format
+        self.archive = None
+
+    def _run_convert(self, absin, absout, out_format, meter=None):
+        if self.archive:
+            self.archive_convert(absin, absout, out_format, meter=meter)
+        elif out_format == DISK_FORMAT_VDISK:
             self.vdisk_convert(absin, absout)
+        elif (self.format == DISK_FORMAT_VMDK and
+              out_format in [DISK_FORMAT_RAW, DISK_FORMAT_QCOW2] and
+              len(vmdk.get_extent_files(absin)) > 1):
+            try:
+                self.vmdk_convert(absin, absout, out_format, meter=meter)
+            except NotImplementedError, e:
+                logging.debug("Native VMDK conversion not possible, "
+                              "falling back to qemu-img: %s", e)
+                self.qemu_convert(absin, absout, out_format, meter=meter)
         else:
-            self.qemu_convert(absin, absout, out_format)
+            self.qemu_convert(absin, absout, out_format, meter=meter)
+
+        self._finish_convert(out_format)
+
+    def convert(self, indir, outdir, output_format, meter=None):
+        """
+        Convert a disk into the requested format if possible, in the
+        given output directory.  Raises RuntimeError or other failures.
+        """
+        job = self._prepare_convert(indir, outdir, output_format)
+        if job:
+            self._run_convert(*job, meter=meter)
+
+
+def stream_copy(fobj, size, absout, meter=None, text=None):
+    """
+    Copy size bytes from file object fobj to a new file absout
+    """
+    if meter is None:
+        meter = urlgrabber.progress.BaseMeter()
+    meter.start(size=size, text=text)
 
-        self.format = out_format
-        self.path = relout
+    out = file(absout, "wb")
+    try:
+        done = 0
+        while done < size:
+            buff = fobj.read(min(1024 * 1024, size - done))
+            if not buff:
+                raise IOError(_("Unexpected end of file copying to %s") %
+                              absout)
+            out.write(buff)
+            done += len(buff)
+            meter.update(done)
+    finally:
+        out.close()
+
+    meter.end(size)
+
+
+class RawReader(object):
+    """
+    stream_convert reader for a raw disk image in a file object, which
+    only needs to support read()
+    """
+    def __init__(self, fobj, size):
+        self._fobj = fobj
+        self.size = size
+
+    def blocks(self, blocksize=1024 * 1024):
+        pos = 0
+        while pos < self.size:
+            data = self._fobj.read(min(blocksize, self.size - pos))
+            if not data:
+                raise IOError(_("Unexpected end of raw disk image at "
+                                "offset %d") % pos)
+            yield pos, data
+            pos += len(data)
+
+
+def stream_convert(reader, absout, out_format, meter=None, text=None):
+    """
+    Write out the disk contents from reader as a raw or qcow2 image.
+    reader must have a 'size' and a blocks() method yielding
+    (offset, data) pairs in increasing offset order, like
+    vmdk.VMDKReader. Zero blocks are skipped, so the output is sparse.
+    """
+    if meter is None:
+        meter = urlgrabber.progress.BaseMeter()
+    meter.start(size=reader.size, text=text)
+
+    if out_format == DISK_FORMAT_QCOW2:
+        writer = qcow2.Qcow2Writer(absout, reader.size)
+        for offset, data in reader.blocks():
+            writer.write(offset, data)
+            meter.update(offset + len(data))
+        writer.close()
+
+    elif out_format == DISK_FORMAT_RAW:
+        f = file(absout, "wb")
+        try:
+            for offset, data in reader.blocks():
+                if data.count("\0") != len(data):
+                    f.seek(offset)
+                    f.write(data)
+                meter.update(offset + len(data))
+            f.truncate(reader.size)
+        finally:
+            f.close()
+
+    else:
+        raise NotImplementedError(_("Cannot stream convert to disk "
+                                    "format %s") % qemu_formats[out_format])
+
+    meter.end(reader.size)
+
+
+def convert_disks(disks, indir, outdir, output_format, meter=None,
+                  workers=None):
+    """
+    Convert several disks at once, running up to 'workers' conversions
+    in parallel. Each disk is converted straight from its source file.
+    meter is an optional urlgrabber MultiFileMeter, which gets a child
+    meter per disk. The first failure is raised once all running
+    conversions have finished.
+    """
+    jobs = []
+    for d in disks:
+        job = d._prepare_convert(indir, outdir, output_format)
+        if job:
+            jobs.append((d, job))
+    if not jobs:
+        return
+
+    if meter:
+        meter.start(numfiles=len(jobs),
+                    total_size=sum([d.input_size(job[0])
+                                    for d, job in jobs]))
+
+    lock = threading.Lock()
+    queue = jobs[:]
+    errors = []
+
+    def worker():
+        while True:
+            lock.acquire()
+            try:
+                if not queue or errors:
+                    return
+                d, job = queue.pop(0)
+                submeter = meter and meter.newMeter() or None
+            finally:
+                lock.release()
+
+            try:
+                d._run_convert(*job, meter=submeter)
+            except Exception, e:
+                logging.debug("Converting %s failed", job[0], exc_info=True)
+                errors.append(e)
+
+    threads = []
+    for ignore in range(min(workers or CONVERT_WORKERS, len(jobs))):
+        thread = threading.Thread(target=worker, name="Converting disks")
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(1)
+
+    if meter:
+        meter.end()
+    if errors:
+        raise errors[0]
 
 
 def disk_formats():
@@ -19,6 +19,8 @@
 #
 
 import logging
+import os
+import tarfile
 
 from virtinst import util
 
@@ -240,6 +242,40 @@ def _parse_hw_section(vm, nodes, file_refs, disk_section):
             logging.debug("Unhandled device type=%s desc=%s", devtype, desc)
 
 
+def _read_ova_descriptor(input_file):
+    """
+    Return (member name, contents) of the OVF descriptor in an OVA
+    archive, or (None, None) if there isn't one. The spec puts the
+    descriptor first, so this doesn't need to scan past the disks.
+    """
+    tar = tarfile.open(input_file, "r:")
+    try:
+        for member in tar:
+            if member.isfile() and member.name.endswith(".ovf"):
+                return member.name, tar.extractfile(member).read()
+        return None, None
+    finally:
+        tar.close()
+
+
+def _read_input(input_file):
+    """
+    Return (descriptor XML, OVA path or None, descriptor directory
+    within the OVA) for an .ovf file or an .ova archive.
+    """
+    if not tarfile.is_tarfile(input_file):
+        infile = open(input_file, "r")
+        xml = infile.read()
+        infile.close()
+        return xml, None, None
+
+    name, xml = _read_ova_descriptor(input_file)
+    if xml is None:
+        raise ValueError(_("No OVF descriptor found in archive %s") %
+                         input_file)
+    return xml, os.path.abspath(input_file), os.path.dirname(name)
+
+
 class ovf_parser(formats.parser):
     """
     Support for OVF appliance configurations.
@@ -259,11 +295,13 @@ class ovf_parser(formats.parser):
         """
         Return True if the given file is of this format.
         """
-        infile = open(input_file, "r")
-        xml = infile.read()
-        infile.close()
-
         res = False
+        try:
+            xml = _read_input(input_file)[0]
+        except (ValueError, tarfile.TarError), e:
+            logging.debug("Error reading OVA archive: %s", str(e))
+            return res
+
         try:
             if xml.count("</Envelope>"):
                 res = bool(_xpath(xml, "/ovf:Envelope", return_list=True,
@@ -278,16 +316,26 @@ class ovf_parser(formats.parser):
         """
         Import a configuration file.  Raises if the file couldn't be
         opened, or parsing otherwise failed.
+
+        input_file can also be an OVA archive, in which case the disks
+        are left in it, and converted straight out of the archive.
         """
 
-        infile = open(input_file, "r")
-        xml = infile.read()
-        infile.close()
+        xml, archive, basedir = _read_input(input_file)
         logging.debug("Importing OVF XML:\n%s", xml)
 
-        return util.xml_parse_wrapper(xml, ovf_parser._import_file,
+        vm = util.xml_parse_wrapper(xml, ovf_parser._import_file,
                                     register_namespace=ovf_register_namespace)
 
+        if archive:
+            for disk in vm.disks.values():
+                if not disk.path:
+                    continue
+                disk.archive = archive
+                disk.path = os.path.normpath(os.path.join(basedir,
+                                                          disk.path))
+        return vm
+
     @staticmethod
     def _import_file(doc, ctx):
         ignore = doc
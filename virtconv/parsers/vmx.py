@@ -179,8 +179,11 @@ def parse_vmdk(disk, filename):
         raise RuntimeError(_("Didn't detect a storage line in the VMDK "
                              "descriptor file"))
     if len(disklines) > 1:
-        raise RuntimeError(_("Don't know how to handle multistorage VMDK "
-                             "descriptors"))
+        # Split disk: keep pointing at the descriptor, diskcfg knows
+        # how to copy and convert all the extents
+        logging.debug("VMDK file %s has %d extents", filename,
+                      len(disklines))
+        return
 
     diskline = disklines[0]
     newpath = diskline.parse_disk_path()
@@ -0,0 +1,183 @@
+#
+# Copyright 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+#
+
+import array
+import struct
+
+_MAGIC = 0x514649fb
+_COPIED = 1 << 63
+
+_CLUSTER_BITS = 16
+_CLUSTER_SIZE = 1 << _CLUSTER_BITS
+_L2_ENTRIES = _CLUSTER_SIZE / 8
+_REFCOUNTS_PER_BLOCK = _CLUSTER_SIZE / 2
+
+# magic, version, backing_file_offset, backing_file_size, cluster_bits,
+# size, crypt_method, l1_size, l1_table_offset, refcount_table_offset,
+# refcount_table_clusters, nb_snapshots, snapshots_offset
+_HEADER = ">IIQIIQIIQQIIQ"
+
+
+def _div_round_up(a, b):
+    return (a + b - 1) / b
+
+
+class Qcow2Writer(object):
+    """
+    Write a qcow2 (version 2) image in a single pass. Data must be
+    passed in increasing offset order. All-zero clusters are left
+    unallocated, so the result is as sparse as the input.
+
+    Layout: header, L1 table and a refcount table sized for the worst
+    case come first, then data clusters as they arrive. L2 tables and
+    refcount blocks are written at the end by close().
+    """
+    def __init__(self, path, size):
+        self.size = size
+        self._fobj = file(path, "wb")
+
+        self._l1_size = max(1, _div_round_up(size,
+                                             _CLUSTER_SIZE * _L2_ENTRIES))
+        self._l1_clusters = _div_round_up(self._l1_size * 8, _CLUSTER_SIZE)
+
+        # Refcount table must cover every cluster we could ever write
+        maxclusters = (1 + self._l1_clusters +
+                       _div_round_up(size, _CLUSTER_SIZE) + self._l1_size)
+        maxblocks = _div_round_up(maxclusters, _REFCOUNTS_PER_BLOCK) + 1
+        maxclusters += maxblocks
+        maxblocks = _div_round_up(maxclusters, _REFCOUNTS_PER_BLOCK) + 1
+        self._rt_clusters = _div_round_up(maxblocks * 8, _CLUSTER_SIZE)
+
+        self._l1_offset = _CLUSTER_SIZE
+        self._rt_offset = self._l1_offset + self._l1_clusters * _CLUSTER_SIZE
+        self._next_cluster = (1 + self._l1_clusters + self._rt_clusters)
+
+        # L1 index -> array of host cluster numbers, 0 is unallocated
+        self._l2_tables = {}
+
+        self._pending_idx = None
+        self._pending = None
+        self._zero_cluster = "\0" * _CLUSTER_SIZE
+
+    def _alloc_cluster(self):
+        idx = self._next_cluster
+        self._next_cluster += 1
+        return idx
+
+    def _flush_pending(self):
+        if self._pending_idx is None:
+            return
+
+        data = self._pending
+        if isinstance(data, array.array):
+            data = data.tostring()
+        guest_idx = self._pending_idx
+        self._pending_idx = None
+        self._pending = None
+        if data == self._zero_cluster:
+            return
+
+        l1_idx, l2_idx = divmod(guest_idx, _L2_ENTRIES)
+        if l1_idx not in self._l2_tables:
+            self._l2_tables[l1_idx] = array.array("L", [0] * _L2_ENTRIES)
+
+        host_idx = self._alloc_cluster()
+        self._l2_tables[l1_idx][l2_idx] = host_idx
+        self._fobj.seek(host_idx * _CLUSTER_SIZE)
+        self._fobj.write(data)
+
+    def write(self, offset, data):
+        """
+        Write data at guest offset. offset must not be lower than that
+        of previous writes.
+        """
+        start = 0
+        while start < len(data):
+            guest_idx, pos = divmod(offset + start, _CLUSTER_SIZE)
+            count = min(len(data) - start, _CLUSTER_SIZE - pos)
+            chunk = data[start:start + count]
+            start += count
+
+            if guest_idx != self._pending_idx:
+                if (self._pending_idx is not None and
+                    guest_idx < self._pending_idx):
+                    raise ValueError("qcow2 writes must be sequential")
+                self._flush_pending()
+                self._pending_idx = guest_idx
+                if count == _CLUSTER_SIZE:
+                    # Whole cluster, no need to merge with anything
+                    self._pending = chunk
+                    continue
+                self._pending = array.array("c", self._zero_cluster)
+            elif not isinstance(self._pending, array.array):
+                self._pending = array.array("c", self._pending)
+
+            self._pending[pos:pos + count] = array.array("c", chunk)
+
+    def close(self):
+        self._flush_pending()
+
+        # L2 tables
+        l1 = [0] * self._l1_size
+        for l1_idx, table in sorted(self._l2_tables.items()):
+            host_idx = self._alloc_cluster()
+            l1[l1_idx] = (host_idx * _CLUSTER_SIZE) | _COPIED
+            entries = [idx and ((idx * _CLUSTER_SIZE) | _COPIED) or 0
+                       for idx in table]
+            self._fobj.seek(host_idx * _CLUSTER_SIZE)
+            self._fobj.write(struct.pack(">%dQ" % _L2_ENTRIES, *entries))
+
+        # Refcount blocks, which need to count themselves too. Every
+        # cluster up to the end of the file is in use exactly once.
+        nblocks = 0
+        while (nblocks * _REFCOUNTS_PER_BLOCK <
+               self._next_cluster + nblocks):
+            nblocks += 1
+        if nblocks * 8 > self._rt_clusters * _CLUSTER_SIZE:
+            raise RuntimeError("qcow2 refcount table is too small")
+
+        first_block = self._next_cluster
+        total = self._next_cluster + nblocks
+        refcount_table = []
+        for idx in range(nblocks):
+            host_idx = self._alloc_cluster()
+            refcount_table.append(host_idx * _CLUSTER_SIZE)
+            used = min(_REFCOUNTS_PER_BLOCK,
+                       total - idx * _REFCOUNTS_PER_BLOCK)
+            block = (struct.pack(">%dH" % used, *([1] * used)) +
+                     "\0" * ((_REFCOUNTS_PER_BLOCK - used) * 2))
+            self._fobj.seek(host_idx * _CLUSTER_SIZE)
+            self._fobj.write(block)
+        assert first_block + nblocks == total
+
+        self._fobj.seek(self._rt_offset)
+        self._fobj.write(struct.pack(">%dQ" % nblocks, *refcount_table))
+
+        self._fobj.seek(self._l1_offset)
+        self._fobj.write(struct.pack(">%dQ" % self._l1_size, *l1))
+
+        self._fobj.seek(0)
+        self._fobj.write(struct.pack(_HEADER, _MAGIC, 2, 0, 0, _CLUSTER_BITS,
+                                     self.size, 0, self._l1_size,
+                                     self._l1_offset, self._rt_offset,
+                                     self._rt_clusters, 0, 0))
+
+        # Make sure the reserved metadata clusters exist in full
+        self._fobj.truncate(total * _CLUSTER_SIZE)
+        self._fobj.close()
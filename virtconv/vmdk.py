@@ -0,0 +1,381 @@
+#
+# Copyright 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+#
+
+"""
+Native reader for VMDK disk images, which presents the logical disk
+contents as a single stream no matter how many extent files it is
+split over. Supports flat, zero and hosted sparse extents, including
+the compressed streamOptimized variant used in OVAs.
+
+Reference: VMware Virtual Disk Format 1.1 specification
+"""
+
+import logging
+import os
+import shlex
+import struct
+import zlib
+
+SECTOR_SIZE = 512
+
+_SPARSE_MAGIC = "KDMV"
+_GD_AT_END = 0xffffffffffffffff
+
+_FLAG_ZEROED_GRAIN_GTE = 1 << 2
+_FLAG_COMPRESSED = 1 << 16
+
+# magicNumber, version, flags, capacity, grainSize, descriptorOffset,
+# descriptorSize, numGTEsPerGT, rgdOffset, gdOffset, overHead,
+# uncleanShutdown, newline test chars, compressAlgorithm
+_SPARSE_HEADER = "<4sIIQQQQIQQQB4sH"
+
+# Descriptors are small. Anything bigger is extent data
+_MAX_DESCRIPTOR_SIZE = 10 * 1024
+
+
+def _open_file(path):
+    return file(path, "rb")
+
+
+def _truncated(name, sector):
+    return IOError(_("VMDK extent %(file)s is truncated at sector "
+                     "%(sector)d") % {"file": name, "sector": sector})
+
+
+class _FlatExtent(object):
+    """
+    Raw disk data, starting 'offset' sectors into the file
+    """
+    def __init__(self, name, fobj, sectors, offset):
+        self._name = name
+        self._fobj = fobj
+        self._offset = offset * SECTOR_SIZE
+        self.size = sectors * SECTOR_SIZE
+
+    def blocks(self, blocksize):
+        pos = 0
+        while pos < self.size:
+            count = min(blocksize, self.size - pos)
+            self._fobj.seek(self._offset + pos)
+            data = self._fobj.read(count)
+            if len(data) != count:
+                raise _truncated(self._name,
+                                 (self._offset + pos) / SECTOR_SIZE)
+            yield pos, data
+            pos += count
+
+    def close(self):
+        self._fobj.close()
+
+
+class _ZeroExtent(object):
+    def __init__(self, sectors):
+        self.size = sectors * SECTOR_SIZE
+
+    def blocks(self, blocksize):
+        ignore = blocksize
+        return []
+
+    def close(self):
+        pass
+
+
+class _SparseExtent(object):
+    """
+    Hosted sparse extent: data is stored in grains, located through a
+    two level grain directory/grain table lookup. Unallocated grains
+    read as zeros and are skipped.
+    """
+    def __init__(self, name, fobj, header=None):
+        self._name = name
+        self._fobj = fobj
+        if header is None:
+            fobj.seek(0)
+            header = _parse_sparse_header(fobj.read(SECTOR_SIZE))
+
+        flags = header["flags"]
+        self._compressed = bool(flags & _FLAG_COMPRESSED)
+        # With this flag a grain table entry of 1 means 'all zeros'
+        self._min_sector = (flags & _FLAG_ZEROED_GRAIN_GTE) and 1 or 0
+        self._grainsize = header["grainSize"] * SECTOR_SIZE
+        self._gtes = header["numGTEsPerGT"]
+        self.size = header["capacity"] * SECTOR_SIZE
+
+        gd_offset = header["gdOffset"]
+        if gd_offset == _GD_AT_END:
+            # streamOptimized: the real header is in the footer, which
+            # sits before the end-of-stream marker
+            fobj.seek(0, os.SEEK_END)
+            fobj.seek(fobj.tell() - 2 * SECTOR_SIZE)
+            footer = _parse_sparse_header(fobj.read(SECTOR_SIZE))
+            gd_offset = footer["gdOffset"]
+
+        gtcoverage = self._grainsize * self._gtes
+        gdentries = (self.size + gtcoverage - 1) / gtcoverage
+        self._gd = struct.unpack("<%dI" % gdentries,
+                                 self._read(gd_offset, gdentries * 4))
+
+    def _read(self, sector, count):
+        """
+        Read count bytes starting at sector, raising an error naming the
+        extent if the file ends first
+        """
+        self._fobj.seek(sector * SECTOR_SIZE)
+        data = self._fobj.read(count)
+        if len(data) != count:
+            raise _truncated(self._name, sector)
+        return data
+
+    def _read_grain_table(self, gdidx):
+        sector = self._gd[gdidx]
+        if not sector:
+            return None
+        return struct.unpack("<%dI" % self._gtes,
+                             self._read(sector, self._gtes * 4))
+
+    def _read_grain(self, sector, length):
+        """
+        Read the grain at sector, of which at least length bytes are
+        needed: the last grain of the disk only has to reach its end.
+        Compressed grains are padded out with zeros.
+        """
+        if not self._compressed:
+            self._fobj.seek(sector * SECTOR_SIZE)
+            data = self._fobj.read(self._grainsize)
+            if len(data) < length:
+                raise _truncated(self._name, sector)
+            return data
+
+        # Compressed grain: 8 byte LBA, 4 byte size, deflate data
+        ignore, size = struct.unpack("<QI", self._read(sector, 12))
+        self._fobj.seek(sector * SECTOR_SIZE + 12)
+        compressed = self._fobj.read(size)
+        if len(compressed) != size:
+            raise _truncated(self._name, sector)
+        try:
+            data = zlib.decompress(compressed)
+        except zlib.error, e:
+            raise IOError(_("VMDK extent %(file)s has a corrupt "
+                            "compressed grain at sector %(sector)d: "
+                            "%(err)s") %
+                          {"file": self._name, "sector": sector,
+                           "err": str(e)})
+        if len(data) > self._grainsize:
+            raise IOError(_("VMDK extent %(file)s has a compressed grain "
+                            "of the wrong size at sector %(sector)d") %
+                          {"file": self._name, "sector": sector})
+        return data + "\0" * (self._grainsize - len(data))
+
+    def blocks(self, blocksize):
+        # Grains are the natural unit here, blocksize is ignored
+        ignore = blocksize
+        for gdidx in range(len(self._gd)):
+            table = self._read_grain_table(gdidx)
+            if not table:
+                continue
+
+            for gtidx, sector in enumerate(table):
+                # 0 is unallocated
+                if sector <= self._min_sector:
+                    continue
+                pos = (gdidx * self._gtes + gtidx) * self._grainsize
+                if pos >= self.size:
+                    return
+                length = min(self._grainsize, self.size - pos)
+                data = self._read_grain(sector, length)
+                yield pos, data[:length]
+
+    def close(self):
+        self._fobj.close()
+
+
+def _parse_sparse_header(data):
+    if len(data) < struct.calcsize(_SPARSE_HEADER):
+        raise ValueError(_("VMDK sparse header is truncated"))
+    fields = struct.unpack(_SPARSE_HEADER,
+                           data[:struct.calcsize(_SPARSE_HEADER)])
+    names = ["magic", "version", "flags", "capacity", "grainSize",
+             "descriptorOffset", "descriptorSize", "numGTEsPerGT",
+             "rgdOffset", "gdOffset", "overHead", "uncleanShutdown",
+             "newlines", "compressAlgorithm"]
+    header = dict(zip(names, fields))
+    if header["magic"] != _SPARSE_MAGIC:
+        raise ValueError(_("Not a VMDK sparse extent"))
+    return header
+
+
+def _parse_extent_lines(descriptor):
+    """
+    Return a list of (access, sectors, type, filename, offset) tuples
+    for the extent description lines in the descriptor text, e.g.
+
+        RW 4192256 SPARSE "test-s001.vmdk"
+        RW 16777216 FLAT "test-flat.vmdk" 0
+        RW 1048576 ZERO
+    """
+    extents = []
+    for line in descriptor.splitlines():
+        line = line.strip()
+        if not (line.startswith("RW ") or
+                line.startswith("RDONLY ") or
+                line.startswith("NOACCESS ")):
+            continue
+
+        fields = shlex.split(line)
+        access, sectors, extype = fields[:3]
+        filename = len(fields) > 3 and fields[3] or None
+        offset = len(fields) > 4 and int(fields[4]) or 0
+        extents.append((access, int(sectors), extype.upper(),
+                        filename, offset))
+    return extents
+
+
+def read_descriptor(path):
+    """
+    Return the descriptor text for a VMDK: either the file itself if
+    it is a small text descriptor, or the descriptor embedded in a
+    monolithic sparse file. Returns None for anything else.
+    """
+    if not os.path.exists(path):
+        return None
+
+    f = _open_file(path)
+    try:
+        data = f.read(SECTOR_SIZE)
+        if data.startswith(_SPARSE_MAGIC):
+            header = _parse_sparse_header(data)
+            if not header["descriptorOffset"]:
+                return None
+            f.seek(header["descriptorOffset"] * SECTOR_SIZE)
+            text = f.read(header["descriptorSize"] * SECTOR_SIZE)
+            return text.split("\0", 1)[0]
+
+        if os.path.getsize(path) > _MAX_DESCRIPTOR_SIZE:
+            return None
+        return data + f.read()
+    finally:
+        f.close()
+
+
+def get_extent_files(path):
+    """
+    Return the paths of all the extent files a VMDK descriptor refers
+    to, other than the descriptor itself.
+    """
+    descriptor = read_descriptor(path)
+    if descriptor is None:
+        return []
+
+    dirname = os.path.dirname(path)
+    ret = []
+    for ignore, ignore, ignore, filename, ignore in \
+            _parse_extent_lines(descriptor):
+        if not filename:
+            continue
+        extpath = os.path.join(dirname, filename)
+        if os.path.abspath(extpath) != os.path.abspath(path):
+            ret.append(extpath)
+    return ret
+
+
+class VMDKReader(object):
+    """
+    Read the logical contents of a VMDK, whatever its layout.
+
+    path is the descriptor, or a monolithic sparse file. opener is an
+    optional function mapping an extent filename to an open, seekable
+    file object; by default extents are opened relative to path.
+    """
+    def __init__(self, path, opener=None):
+        self.path = path
+        self.extents = []
+        self.size = 0
+
+        if opener is None:
+            dirname = os.path.dirname(path)
+            opener = lambda name: _open_file(os.path.join(dirname, name))
+        self._opener = opener
+
+        try:
+            self._parse()
+        except:
+            self.close()
+            raise
+
+    def _parse(self):
+        fobj = self._opener(os.path.basename(self.path))
+        data = fobj.read(SECTOR_SIZE)
+
+        if data.startswith(_SPARSE_MAGIC):
+            header = _parse_sparse_header(data)
+            descriptor = ""
+            if header["descriptorOffset"]:
+                fobj.seek(header["descriptorOffset"] * SECTOR_SIZE)
+                descriptor = fobj.read(header["descriptorSize"] *
+                                       SECTOR_SIZE).split("\0", 1)[0]
+
+            lines = _parse_extent_lines(descriptor)
+            if len(lines) > 1:
+                raise NotImplementedError(
+                    _("Sparse VMDK files with an embedded multi-extent "
+                      "descriptor are not supported"))
+            self.extents.append(_SparseExtent(os.path.basename(self.path),
+                                              fobj, header))
+        else:
+            descriptor = data + fobj.read(_MAX_DESCRIPTOR_SIZE)
+            fobj.close()
+            lines = _parse_extent_lines(descriptor)
+            if not lines:
+                raise ValueError(_("Didn't detect a storage line in the "
+                                   "VMDK descriptor file"))
+
+            for ignore, sectors, extype, filename, offset in lines:
+                self.extents.append(self._open_extent(sectors, extype,
+                                                      filename, offset))
+
+        self.size = sum([e.size for e in self.extents])
+        logging.debug("Opened VMDK %s: %d extents, %d bytes",
+                      self.path, len(self.extents), self.size)
+
+    def _open_extent(self, sectors, extype, filename, offset):
+        if extype == "ZERO":
+            return _ZeroExtent(sectors)
+        if extype in ["FLAT", "VMFS"]:
+            return _FlatExtent(filename, self._opener(filename),
+                               sectors, offset)
+        if extype == "SPARSE":
+            return _SparseExtent(filename, self._opener(filename))
+        raise NotImplementedError(_("VMDK extent type %s is not supported")
+                                  % extype)
+
+    def blocks(self, blocksize=1024 * 1024):
+        """
+        Yield (offset, data) pairs covering every allocated part of the
+        disk, in increasing offset order. Anything not yielded is zero.
+        """
+        base = 0
+        for extent in self.extents:
+            for pos, data in extent.blocks(blocksize):
+                yield base + pos, data
+            base += extent.size
+
+    def close(self):
+        for extent in self.extents:
+            extent.close()
+        self.extents = []
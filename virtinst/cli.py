@@ -29,7 +29,7 @@ import traceback
 
 import libvirt
 
-from virtcli import cliconfig
+from virtcli import cliconfig, startupprofile
 
 import virtinst
 from virtinst import util
@@ -189,6 +189,21 @@ def setupLogging(appname, debug_stdout, do_quiet, cli_app=True):
     # Log the app command string
     logging.debug("Launched with command line: %s", " ".join(sys.argv))
 
+    _setupProfiling()
+
+
+def _setupProfiling():
+    profile = startupprofile.get_profile()
+    if not profile:
+        return
+
+    logging.debug("Writing startup profile to %s", profile.path)
+    profile.mark("logging-setup")
+    profile.wrap_method(virtinst.VirtualConnection, "open", "conn-open")
+    profile.wrap_method(libvirt.virConnect, "getCapabilities", "caps-fetch")
+    profile.wrap_method(virtinst.CapabilitiesParser.Capabilities,
+                        "__init__", "caps-parse")
+
 
 #######################################
 # Libvirt connection helpers          #
@@ -758,6 +773,9 @@ def add_misc_options(grp, prompt=False, replace=False,
                    help=_("Suppress non-error output"))
     grp.add_argument("-d", "--debug", action="store_true",
                    help=_("Print debugging information"))
+    grp.add_argument(startupprofile.OPTION, metavar="FILE",
+                   dest="profile_startup",
+                   help=_("Write a JSON report of startup timings to FILE"))
 
 
 def vcpu_cli_options(grp, backcompat=True):
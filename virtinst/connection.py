@@ -28,6 +28,7 @@ from virtinst import Guest
 from virtinst import StoragePool
 from virtinst import StorageVolume
 from virtinst import pollhelpers
+from virtinst import rpcstats
 from virtinst import support
 from virtinst import util
 from virtinst.cli import VirtOptionString
@@ -148,6 +149,15 @@ class VirtualConnection(object):
     def is_open(self):
         return bool(self._libvirtconn)
 
+    def get_rpc_stats(self):
+        """
+        Return the rpcstats.RPCStats for this connection, or None if
+        call accounting isn't enabled
+        """
+        if not rpcstats.is_enabled() or not self._libvirtconn:
+            return None
+        return rpcstats.get_stats(self._libvirtconn)
+
     def open(self, passwordcb):
         open_flags = 0
         valid_auth_options = [libvirt.VIR_CRED_AUTHNAME,
@@ -17,19 +17,21 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 # MA 02110-1301 USA.
 
+import gzip
 import logging
 import os
 import shutil
+import stat
 import subprocess
-import tempfile
-
-import urlgrabber
+import zlib
 
 from virtinst import StoragePool, StorageVolume
 from virtinst import util
 from virtinst import Installer
 from virtinst import VirtualDisk
-from virtinst import urlfetcher
+
+# urlfetcher and urlgrabber are slow to import and only needed for URL
+# installs, so they are imported where used
 
 
 def _is_url(conn, url):
@@ -90,6 +92,7 @@ def _build_pool(conn, meter, path):
 
 
 def _upload_file(conn, meter, destpool, src):
+    import urlgrabber
     # Build stream object
     stream = conn.newStream(0)
     def safe_send(data):
@@ -161,62 +164,115 @@ def _upload_file(conn, meter, destpool, src):
     return vol
 
 
-def _rhel4_initrd_inject(initrd, injections):
+def _is_rhel4_initrd(initrd):
+    """
+    RHEL4 initrds are a gzipped ext2 image, not a cpio archive
+    """
     try:
-        file_proc = subprocess.Popen(["file", "-z", initrd],
-                                     stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-        if not "ext2 filesystem" in file_proc.communicate()[0]:
-            return False
-    except:
-        logging.exception("Failed to file command for rhel4 initrd detection")
+        f = gzip.open(initrd, "rb")
+        try:
+            # ext2 superblock magic
+            return f.read(1082)[1080:1082] == "\x53\xef"
+        finally:
+            f.close()
+    except (IOError, zlib.error, EOFError):
+        return False
+
+
+def _rhel4_initrd_inject(initrd, injections):
+    if not _is_rhel4_initrd(initrd):
         return False
 
     logging.debug("Is RHEL4 initrd")
 
     # Uncompress the initrd
-    newinitrd = file(initrd + ".new", "wb")
-    gzip_proc = subprocess.Popen(["gzip", "-d", "-f", "-c", initrd],
-                                 stdout=newinitrd,
-                                 stderr=subprocess.PIPE)
-    gzip_proc.wait()
-    newinitrd.close()
-
-    debugfserr = ""
+    ext2img = initrd + ".ext2"
+    src = gzip.open(initrd, "rb")
+    dest = file(ext2img, "wb")
+    try:
+        shutil.copyfileobj(src, dest, 1024 * 1024)
+    finally:
+        src.close()
+        dest.close()
+
+    # We have an ext2 filesystem, use debugfs to inject all the files
+    # in one go
+    cmds = ""
     for filename in injections:
-        # We have an ext2 filesystem, use debugfs to inject files
-        cmd = ["debugfs", "-w", "-R",
-               "write %s %s" % (filename, os.path.basename(filename)),
-               newinitrd.name]
-        logging.debug("Copying %s to the initrd with cmd=%s", filename, cmd)
-
-        debugfs_proc = subprocess.Popen(cmd,
-                                        stdout=subprocess.PIPE,
-                                        stderr=subprocess.PIPE)
-        debugfs_proc.wait()
-        debugfserr += debugfs_proc.stderr.read() or ""
-
-    gziperr = gzip_proc.stderr.read()
-    if gziperr:
-        logging.debug("gzip stderr=%s", gziperr)
+        logging.debug("Copying %s to the initrd.", filename)
+        cmds += "write %s %s\n" % (filename, os.path.basename(filename))
+
+    debugfs_proc = subprocess.Popen(["debugfs", "-w", "-f", "-", ext2img],
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+    debugfserr = debugfs_proc.communicate(cmds)[1]
     if debugfserr:
         logging.debug("debugfs stderr=%s", debugfserr)
 
-    # Recompress the initrd
-    gzip_proc = subprocess.Popen(["gzip"],
-                                 stdin=file(newinitrd.name, "rb"),
-                                 stdout=file(initrd, "wb"),
-                                 stderr=subprocess.PIPE)
-    gzip_proc.wait()
-    gziperr = gzip_proc.stderr.read()
-    if gziperr:
-        logging.debug("gzip stderr=%s", gziperr)
-    os.unlink(newinitrd.name)
+    # Recompress into a new file, since the original may be hardlinked
+    # from the URL cache
+    src = file(ext2img, "rb")
+    destfile = file(initrd + ".new", "wb")
+    dest = gzip.GzipFile(filename="", mode="wb", fileobj=destfile)
+    try:
+        shutil.copyfileobj(src, dest, 1024 * 1024)
+    finally:
+        src.close()
+        dest.close()
+        destfile.close()
+    os.rename(initrd + ".new", initrd)
+    os.unlink(ext2img)
 
     return True
 
 
-def _perform_initrd_injections(initrd, injections, scratchdir):
+def _cpio_newc_header(ino, mode, mtime, filesize, name):
+    namesize = len(name) + 1
+    header = "070701"
+    for val in [ino, mode, 0, 0, 1, mtime, filesize, 0, 0, 0, 0,
+                namesize, 0]:
+        header += "%08x" % val
+    header += name + "\0"
+    # Header plus name are padded to a multiple of 4 bytes
+    return header + "\0" * (-len(header) % 4)
+
+
+def _write_initrd_segment(dest, injections):
+    """
+    Write injections to the file object dest as a gzip compressed newc
+    cpio archive, which the kernel will unpack over the original initrd
+    contents. Files are placed in the root directory.
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    ino = 0x7f000000
+    for filename in injections:
+        logging.debug("Copying %s to the initrd.", filename)
+        st = os.stat(filename)
+        ino += 1
+        dest.write(compressor.compress(
+            _cpio_newc_header(ino, stat.S_IFREG | (st.st_mode & 0777),
+                              int(st.st_mtime), st.st_size,
+                              os.path.basename(filename))))
+
+        f = file(filename, "rb")
+        try:
+            while True:
+                buff = f.read(1024 * 1024)
+                if not buff:
+                    break
+                dest.write(compressor.compress(buff))
+        finally:
+            f.close()
+        dest.write(compressor.compress("\0" * (-st.st_size % 4)))
+
+    dest.write(compressor.compress(
+        _cpio_newc_header(0, 0, 0, 0, "TRAILER!!!")))
+    dest.write(compressor.flush())
+
+
+def _perform_initrd_injections(initrd, injections):
     """
     Insert files into the root directory of the initial ram disk
     """
@@ -226,42 +282,29 @@ def _perform_initrd_injections(initrd, injections, scratchdir):
     if _rhel4_initrd_inject(initrd, injections):
         return
 
-    tempdir = tempfile.mkdtemp(dir=scratchdir)
-    os.chmod(tempdir, 0775)
-
-    for filename in injections:
-        logging.debug("Copying %s to the initrd.", filename)
-        shutil.copy(filename, tempdir)
-
     logging.debug("Appending to the initrd.")
-    find_proc = subprocess.Popen(['find', '.', '-print0'],
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE,
-                                 cwd=tempdir)
-    cpio_proc = subprocess.Popen(['cpio', '-o', '--null', '-Hnewc', '--quiet'],
-                                 stdin=find_proc.stdout,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE,
-                                 cwd=tempdir)
-    f = open(initrd, 'ab')
-    gzip_proc = subprocess.Popen(['gzip'], stdin=cpio_proc.stdout,
-                                 stdout=f, stderr=subprocess.PIPE)
-    cpio_proc.wait()
-    find_proc.wait()
-    gzip_proc.wait()
-    f.close()
-    shutil.rmtree(tempdir)
-
-    finderr = find_proc.stderr.read()
-    cpioerr = cpio_proc.stderr.read()
-    gziperr = gzip_proc.stderr.read()
-    if finderr:
-        logging.debug("find stderr=%s", finderr)
-    if cpioerr:
-        logging.debug("cpio stderr=%s", cpioerr)
-    if gziperr:
-        logging.debug("gzip stderr=%s", gziperr)
+    if os.stat(initrd).st_nlink > 1 or not os.access(initrd, os.W_OK):
+        # The initrd is hardlinked from the URL cache, or was until the
+        # cache evicted it and left it read only. Write a private copy
+        # with our changes, so they don't leak into the cached file.
+        # This is a single pass over the shared base initrd.
+        logging.debug("Unsharing hardlinked initrd %s", initrd)
+        src = file(initrd, "rb")
+        f = file(initrd + ".new", "wb")
+        try:
+            shutil.copyfileobj(src, f, 1024 * 1024)
+            _write_initrd_segment(f, injections)
+        finally:
+            src.close()
+            f.close()
+        os.rename(initrd + ".new", initrd)
+        return
 
+    f = file(initrd, "ab")
+    try:
+        _write_initrd_segment(f, injections)
+    finally:
+        f.close()
 
 
 def _upload_media(conn, scratchdir, system_scratchdir,
@@ -333,12 +376,14 @@ class DistroInstaller(Installer):
         return self._make_cdrom_dev(self.location, transient=transient)
 
     def _prepare_cdrom_url(self, guest, fetcher):
+        from virtinst import urlfetcher
         store = urlfetcher.getDistroStore(guest, fetcher)
         media = store.acquireBootDisk(guest)
         self._tmpfiles.append(media)
         return self._make_cdrom_dev(media, transient=True)
 
     def _prepare_kernel_url(self, guest, fetcher):
+        from virtinst import urlfetcher
         store = urlfetcher.getDistroStore(guest, fetcher)
         kernel, initrd, args = store.acquireKernel(guest)
         os_variant = store.get_osdict_info()
@@ -352,9 +397,7 @@ class DistroInstaller(Installer):
         if initrd:
             self._tmpfiles.append(initrd)
 
-        _perform_initrd_injections(initrd,
-                                   self.initrd_injections,
-                                   fetcher.scratchdir)
+        _perform_initrd_injections(initrd, self.initrd_injections)
 
         kernel, initrd, tmpvols = _upload_media(
                 guest.conn, fetcher.scratchdir,
@@ -409,6 +452,7 @@ class DistroInstaller(Installer):
         return val
 
     def _prepare(self, guest, meter, scratchdir):
+        from virtinst import urlfetcher
         logging.debug("Using scratchdir=%s", scratchdir)
         mediatype = self._get_media_type()
 
@@ -457,6 +501,7 @@ class DistroInstaller(Installer):
                              MEDIA_LOCATION_PATH]
 
     def check_location(self, guest):
+        from virtinst import urlfetcher
         mediatype = self._get_media_type()
         if mediatype not in [MEDIA_CDROM_URL, MEDIA_LOCATION_URL]:
             return True
@@ -466,6 +511,7 @@ class DistroInstaller(Installer):
         return True
 
     def detect_distro(self, guest):
+        from virtinst import urlfetcher
         try:
             ret = urlfetcher.detectMediaDistro(guest, self.location)
             logging.debug("installer.detect_distro returned=%s", ret)
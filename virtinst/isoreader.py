@@ -0,0 +1,394 @@
+#
+# Read files out of ISO9660 images without mounting them
+#
+# Copyright 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+
+import logging
+import struct
+
+_SECTOR_SIZE = 2048
+_DESCRIPTOR_START = 16 * _SECTOR_SIZE
+
+_VD_PRIMARY = 1
+_VD_SUPPLEMENTARY = 2
+_VD_TERMINATOR = 255
+
+_JOLIET_ESCAPES = ["%/@", "%/C", "%/E"]
+
+_FLAG_DIRECTORY = 0x02
+_FLAG_MULTI_EXTENT = 0x80
+
+# Don't loop forever on a corrupt or malicious image
+_MAX_SYMLINKS = 20
+_MAX_CONTINUATIONS = 32
+
+
+def is_iso(path):
+    """
+    Return True if path is a readable ISO9660 image or device
+    """
+    try:
+        f = file(path, "rb")
+        try:
+            f.seek(_DESCRIPTOR_START)
+            return f.read(6)[1:6] == "CD001"
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return False
+
+
+def _le32(data, offset):
+    return struct.unpack("<I", data[offset:offset + 4])[0]
+
+
+class _Entry(object):
+    """
+    A file, directory or symlink in the image
+    """
+    def __init__(self, name, extents, isdir):
+        self.name = name
+        self.extents = extents
+        self.isdir = isdir
+        self.symlink = None
+        self.relocated = False
+        self.multi_extent = False
+
+    def get_size(self):
+        return sum([length for ignore, length in self.extents])
+
+
+class ISOFile(object):
+    """
+    File-like object reading the extents of a single file in the image
+    """
+    def __init__(self, fobj, entry):
+        self._fobj = fobj
+        self._extents = list(entry.extents)
+        self._extent_pos = 0
+        self.size = entry.get_size()
+
+    def read(self, amt):
+        while self._extents:
+            lba, length = self._extents[0]
+            if self._extent_pos < length:
+                break
+            self._extents.pop(0)
+            self._extent_pos = 0
+        if not self._extents:
+            return ""
+
+        amt = min(amt, length - self._extent_pos)
+        self._fobj.seek(lba * _SECTOR_SIZE + self._extent_pos)
+        buff = self._fobj.read(amt)
+        if len(buff) != amt:
+            raise IOError("Short read from ISO image")
+        self._extent_pos += amt
+        return buff
+
+    def close(self):
+        self._extents = []
+
+
+class ISOReader(object):
+    """
+    Minimal read only ISO9660 parser, with Rock Ridge and Joliet
+    support, which can look up and stream out individual files.
+
+    Rock Ridge names are preferred if present, since they are what
+    mounting the image would show. Otherwise Joliet names are used,
+    and as a last resort plain ISO9660 names, which are matched case
+    insensitively and without their ';1' version suffix.
+    """
+    MODE_ISO9660 = "iso9660"
+    MODE_JOLIET = "joliet"
+    MODE_ROCKRIDGE = "rockridge"
+
+    def __init__(self, path):
+        self.path = path
+        self.mode = None
+
+        self._fobj = file(path, "rb")
+        self._root = None
+        self._susp_skip = 0
+        self._dircache = {}
+
+        try:
+            self._parse_descriptors()
+        except:
+            self.close()
+            raise
+
+
+    ###################
+    # Private helpers #
+    ###################
+
+    def _read(self, lba, length, offset=0):
+        self._fobj.seek(lba * _SECTOR_SIZE + offset)
+        data = self._fobj.read(length)
+        if len(data) != length:
+            raise IOError("Short read from ISO image %s" % self.path)
+        return data
+
+    def _parse_descriptors(self):
+        primary = None
+        joliet = None
+
+        lba = _DESCRIPTOR_START / _SECTOR_SIZE
+        while True:
+            data = self._read(lba, _SECTOR_SIZE)
+            if data[1:6] != "CD001":
+                break
+
+            vdtype = ord(data[0])
+            if vdtype == _VD_TERMINATOR:
+                break
+            if vdtype == _VD_PRIMARY and primary is None:
+                primary = data[156:190]
+            elif vdtype == _VD_SUPPLEMENTARY and joliet is None:
+                escapes = data[88:120]
+                if [e for e in _JOLIET_ESCAPES if e in escapes]:
+                    joliet = data[156:190]
+            lba += 1
+
+        if primary is None:
+            raise ValueError(_("%s is not an ISO9660 image") % self.path)
+
+        root = self._parse_record(primary, 0, False)
+        if self._has_rockridge(root):
+            self.mode = self.MODE_ROCKRIDGE
+        elif joliet is not None:
+            self.mode = self.MODE_JOLIET
+            root = self._parse_record(joliet, 0, False)
+        else:
+            self.mode = self.MODE_ISO9660
+        self._root = root
+        logging.debug("Opened ISO image %s, using %s names",
+                      self.path, self.mode)
+
+    def _has_rockridge(self, root):
+        # Rock Ridge images have a SUSP 'SP' entry in the system use
+        # area of the root directory's '.' record
+        lba, length = root.extents[0]
+        data = self._read(lba, min(length, _SECTOR_SIZE))
+        reclen = ord(data[0])
+        namelen = ord(data[32])
+        sua = 33 + namelen + ((namelen + 1) % 2)
+        if data[sua:sua + 2] != "SP" or data[sua + 4:sua + 6] != "\xbe\xef":
+            return False
+        self._susp_skip = ord(data[sua + 6])
+        return reclen > sua
+
+    def _parse_susp(self, record, sua, entry):
+        """
+        Parse the Rock Ridge entries we care about out of a directory
+        record's system use area, following continuation areas.
+        """
+        areas = [record[sua + self._susp_skip:]]
+        name = None
+        symlink = []
+        count = 0
+
+        while areas and count < _MAX_CONTINUATIONS:
+            data = areas.pop(0)
+            count += 1
+            pos = 0
+            while pos + 4 <= len(data):
+                sig = data[pos:pos + 2]
+                length = ord(data[pos + 2])
+                if length < 4:
+                    break
+                body = data[pos + 4:pos + length]
+                pos += length
+
+                if sig == "ST":
+                    break
+                elif sig == "CE":
+                    areas.append(self._read(_le32(body, 0),
+                                            _le32(body, 16),
+                                            _le32(body, 8)))
+                elif sig == "NM":
+                    flags = ord(body[0])
+                    if not flags & 0x06:
+                        name = (name or "") + body[1:]
+                elif sig == "SL":
+                    symlink.append(body[1:])
+                elif sig == "CL":
+                    # Deep directory moved elsewhere, this is a stub
+                    # pointing at the real location
+                    child = self._read(_le32(body, 0), 34)
+                    entry.extents = [(_le32(body, 0), _le32(child, 10))]
+                    entry.isdir = True
+                elif sig == "RE":
+                    entry.relocated = True
+
+        if name is not None:
+            entry.name = name
+        if symlink:
+            entry.symlink = self._parse_symlink("".join(symlink))
+
+    def _parse_symlink(self, data):
+        # SL component records: flags, length, content
+        target = ""
+        pos = 0
+        while pos + 2 <= len(data):
+            flags = ord(data[pos])
+            length = ord(data[pos + 1])
+            content = data[pos + 2:pos + 2 + length]
+            pos += 2 + length
+
+            if flags & 0x02:
+                content = "."
+            elif flags & 0x04:
+                content = ".."
+            elif flags & 0x08:
+                target = "/"
+                continue
+
+            target += content
+            if not flags & 0x01 and pos < len(data):
+                target += "/"
+        return target
+
+    def _parse_record(self, data, pos, usesusp):
+        reclen = ord(data[pos])
+        record = data[pos:pos + reclen]
+        lba = _le32(record, 2)
+        length = _le32(record, 10)
+        flags = ord(record[25])
+        namelen = ord(record[32])
+        name = record[33:33 + namelen]
+
+        if name in ["\x00", "\x01"]:
+            name = None
+        elif self.mode == self.MODE_JOLIET:
+            name = name.decode("utf-16-be").encode("utf-8")
+            name = name.split(";")[0]
+        else:
+            name = name.split(";")[0]
+            if name.endswith("."):
+                name = name[:-1]
+
+        entry = _Entry(name, [(lba, length)], bool(flags & _FLAG_DIRECTORY))
+        entry.multi_extent = bool(flags & _FLAG_MULTI_EXTENT)
+        if usesusp and name is not None:
+            sua = 33 + namelen + ((namelen + 1) % 2)
+            self._parse_susp(record, sua, entry)
+        return entry
+
+    def _list_dir(self, direntry):
+        key = direntry.extents[0][0]
+        if key in self._dircache:
+            return self._dircache[key]
+
+        usesusp = self.mode == self.MODE_ROCKRIDGE
+        contents = {}
+        multi = None
+        for lba, length in direntry.extents:
+            data = self._read(lba, length)
+            pos = 0
+            while pos < len(data):
+                if ord(data[pos]) == 0:
+                    # Records don't span sectors, skip the padding
+                    pos = (pos / _SECTOR_SIZE + 1) * _SECTOR_SIZE
+                    continue
+
+                entry = self._parse_record(data, pos, usesusp)
+                pos += ord(data[pos])
+                if entry.name is None or entry.relocated:
+                    continue
+
+                if multi:
+                    # Continuation of a file larger than one extent
+                    multi.extents += entry.extents
+                    multi = entry.multi_extent and multi or None
+                    continue
+
+                if self.mode == self.MODE_ISO9660:
+                    contents[entry.name.upper()] = entry
+                else:
+                    contents[entry.name] = entry
+                multi = entry.multi_extent and entry or None
+
+        self._dircache[key] = contents
+        return contents
+
+    def _lookup(self, path):
+        parts = [p for p in path.split("/") if p not in ["", "."]]
+        stack = []
+        entry = self._root
+        links = 0
+
+        while parts:
+            part = parts.pop(0)
+            if part == "..":
+                if stack:
+                    entry = stack.pop()
+                continue
+            if not entry.isdir:
+                return None
+
+            if self.mode == self.MODE_ISO9660:
+                part = part.upper()
+            child = self._list_dir(entry).get(part)
+            if child is None:
+                return None
+
+            if child.symlink is not None:
+                links += 1
+                if links > _MAX_SYMLINKS:
+                    return None
+                if child.symlink.startswith("/"):
+                    # Absolute links refer to the image root
+                    stack = []
+                    entry = self._root
+                parts = child.symlink.split("/") + parts
+                continue
+
+            stack.append(entry)
+            entry = child
+
+        return entry
+
+
+    ##############
+    # Public API #
+    ##############
+
+    def close(self):
+        if self._fobj:
+            self._fobj.close()
+            self._fobj = None
+
+    def exists(self, path):
+        """
+        Return True if path is a file or directory in the image
+        """
+        return self._lookup(path) is not None
+
+    def open(self, path):
+        """
+        Return an ISOFile for reading the contents of path
+        """
+        entry = self._lookup(path)
+        if entry is None:
+            raise IOError("No such file in ISO image: %s" % path)
+        if entry.isdir:
+            raise IOError("%s is a directory" % path)
+        return ISOFile(self._fobj, entry)
@@ -19,10 +19,16 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 # MA 02110-1301 USA.
 
+import threading
+from datetime import datetime
+
 _SENTINEL = -1234
 _allvariants = {}
-from datetime import datetime
-from gi.repository import Libosinfo as libosinfo
+
+# The libosinfo database is only read on first use, see _load_osinfo
+libosinfo = None
+_osinfo_loaded = False
+_osinfo_lock = threading.Lock()
 
 
 _aliases = {
@@ -65,7 +71,39 @@ _aliases = {
 }
 
 
+def _load_osinfo():
+    """
+    Import libosinfo and add its OS list to our variants. Parsing the
+    database takes a while, and plenty of virtinst users never need it,
+    so this happens when something first looks up an OS.
+    """
+    global libosinfo, _osinfo_loaded
+    if _osinfo_loaded:
+        return
+
+    _osinfo_lock.acquire()
+    try:
+        if _osinfo_loaded:
+            return
+
+        from gi.repository import Libosinfo  # pylint: disable=E0611
+        libosinfo = Libosinfo
+
+        loader = libosinfo.Loader()
+        loader.process_default_path()
+        db = loader.get_db()
+
+        oslist = db.get_os_list()
+        for idx in range(oslist.get_length()):
+            osi = _OsVariantOsInfo(oslist.get_nth(idx))
+            _allvariants[osi.name] = osi
+        _osinfo_loaded = True
+    finally:
+        _osinfo_lock.release()
+
+
 def lookup_os(key):
+    _load_osinfo()
     key = _aliases.get(key) or key
     ret = _allvariants.get(key)
     if ret is None:
@@ -123,6 +161,7 @@ def _sort(tosort, sortpref=None):
 def list_os(list_types=False, typename=None,
             filtervars=None, only_supported=False,
             **kwargs):
+    _load_osinfo()
     sortmap = {}
     filtervars = filtervars or []
 
@@ -155,6 +194,7 @@ def lookup_osdict_key(variant, key, default):
 
 
 def get_minimum_resources(variant, arch):
+    _load_osinfo()
     v = _allvariants.get(variant)
     if v is None:
         return None
@@ -558,12 +598,3 @@ _add_type("solaris", "Solaris", clock="localtime")
 _add_type("unix", "UNIX")
 _add_type("other", "Other")
 _add_var("generic", "Generic", supported=True, parent="other")
-
-loader = libosinfo.Loader()
-loader.process_default_path()
-db = loader.get_db()
-
-oslist = db.get_os_list()
-for os in range(oslist.get_length()):
-    osi = _OsVariantOsInfo(oslist.get_nth(os))
-    _allvariants[osi.name] = osi
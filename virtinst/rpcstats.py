@@ -0,0 +1,181 @@
+#
+# Copyright (C) 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+#
+
+"""
+Per connection accounting of libvirt API calls: how often each API is
+called, how much XML it returns and how long it takes.
+
+enable() wraps the methods of the libvirt object classes, so a call on
+any domain, pool, volume etc. is counted against the virConnect it
+came from. Calls proxied through VirtualConnection.__getattr__ end up
+in the same wrapped virConnect methods.
+"""
+
+import threading
+import time
+
+import libvirt
+
+_CLASSES = ["virConnect", "virDomain", "virDomainSnapshot", "virNetwork",
+            "virStoragePool", "virStorageVol", "virInterface",
+            "virNodeDevice", "virSecret", "virNWFilter", "virStream"]
+
+# Methods that just return a python object we already have
+_SKIP = ["c_pointer", "connect", "getConnect", "domain", "getDomain"]
+
+_STATS_ATTR = "_virtinst_rpcstats"
+
+_enabled = False
+_lock = threading.Lock()
+
+
+class RPCStats(object):
+    """
+    Call accounting for a single connection
+    """
+    def __init__(self):
+        # API name -> [calls, XML bytes returned, total time]
+        self._stats = {}
+        self._total_calls = 0
+        self._lock = threading.Lock()
+
+    def add(self, api, elapsed, nbytes):
+        self._lock.acquire()
+        try:
+            entry = self._stats.get(api)
+            if entry is None:
+                entry = self._stats[api] = [0, 0, 0.0]
+            entry[0] += 1
+            entry[1] += nbytes
+            entry[2] += elapsed
+            self._total_calls += 1
+        finally:
+            self._lock.release()
+
+    def get_total_calls(self):
+        return self._total_calls
+
+    def get_stats(self):
+        """
+        Return a list of (API name, calls, XML bytes, total time),
+        most called first
+        """
+        self._lock.acquire()
+        try:
+            ret = [(api, entry[0], entry[1], entry[2])
+                   for api, entry in self._stats.items()]
+        finally:
+            self._lock.release()
+
+        ret.sort(key=lambda s: (-s[1], s[0]))
+        return ret
+
+    def format(self, count=None):
+        """
+        Return a text table of the stats, for logging
+        """
+        lines = ["%-40s %8s %12s %10s %10s" %
+                 ("api", "calls", "xml bytes", "total ms", "avg ms")]
+        for api, calls, nbytes, elapsed in self.get_stats()[:count]:
+            lines.append("%-40s %8d %12d %10.1f %10.3f" %
+                         (api, calls, nbytes, elapsed * 1000,
+                          elapsed * 1000 / calls))
+        return "\n".join(lines)
+
+
+def _find_conn(obj):
+    if isinstance(obj, libvirt.virConnect):
+        return obj
+    conn = getattr(obj, "_conn", None)
+    if conn is None:
+        conn = getattr(getattr(obj, "_dom", None), "_conn", None)
+    return conn
+
+
+def get_stats(conn):
+    """
+    Return the RPCStats for the passed virConnect, creating it if needed
+    """
+    stats = getattr(conn, _STATS_ATTR, None)
+    if stats is None:
+        _lock.acquire()
+        try:
+            stats = getattr(conn, _STATS_ATTR, None)
+            if stats is None:
+                stats = RPCStats()
+                setattr(conn, _STATS_ATTR, stats)
+        finally:
+            _lock.release()
+    return stats
+
+
+def _wrap_method(classobj, name):
+    origfunc = getattr(classobj, name)
+    api = "%s.%s" % (classobj.__name__, name)
+
+    def newfunc(self, *args, **kwargs):
+        start = time.time()
+        ret = None
+        try:
+            ret = origfunc(self, *args, **kwargs)
+            return ret
+        finally:
+            elapsed = time.time() - start
+            nbytes = 0
+            if isinstance(ret, basestring) and ret[:1] == "<":
+                nbytes = len(ret)
+
+            conn = _find_conn(self)
+            if conn is not None:
+                get_stats(conn).add(api, elapsed, nbytes)
+
+    newfunc.__name__ = name
+    newfunc.__doc__ = origfunc.__doc__
+    setattr(classobj, name, newfunc)
+
+
+def enable():
+    """
+    Start counting libvirt calls. Only connections opened after this
+    are guaranteed to have complete stats.
+    """
+    global _enabled
+    _lock.acquire()
+    try:
+        if _enabled:
+            return
+        _enabled = True
+
+        for classname in _CLASSES:
+            classobj = getattr(libvirt, classname, None)
+            if classobj is None:
+                continue
+
+            for name, value in classobj.__dict__.items():
+                if name.startswith("_") or name in _SKIP:
+                    continue
+                if not callable(value):
+                    continue
+                _wrap_method(classobj, name)
+    finally:
+        _lock.release()
+
+
+def is_enabled():
+    return _enabled
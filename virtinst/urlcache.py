@@ -0,0 +1,235 @@
+#
+# Persistent cache for install media fetched from URLs
+#
+# Copyright 2014 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA 02110-1301 USA.
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+
+class URLCache(object):
+    """
+    On disk cache of downloaded files, used by urlfetcher so repeated
+    installs from the same tree don't download the same kernel and
+    initrd every time.
+
+    File contents are stored once under their sha256 digest. The index
+    maps each URL to the digest plus the validators (ETag, Last-Modified,
+    size) the server sent with it, which the fetcher uses to confirm the
+    cached copy is still current. Least recently used files are evicted
+    when the total size exceeds maxsize.
+    """
+    DEFAULT_MAXSIZE = 2 * 1024 * 1024 * 1024
+
+    def __init__(self, cachedir, maxsize=None):
+        self.cachedir = cachedir
+        self.maxsize = maxsize or self.DEFAULT_MAXSIZE
+
+        self._datadir = os.path.join(self.cachedir, "data")
+        self._indexpath = os.path.join(self.cachedir, "index.json")
+        self._lockpath = os.path.join(self.cachedir, "lock")
+
+
+    ###################
+    # Private helpers #
+    ###################
+
+    def _blobpath(self, digest):
+        return os.path.join(self._datadir, digest)
+
+    def _lock(self):
+        """
+        Take an exclusive lock on the cache, so concurrent virt-install
+        processes don't clobber each other's index updates. Returns a
+        file object that releases the lock when closed.
+        """
+        if not os.path.exists(self._datadir):
+            os.makedirs(self._datadir, 0700)
+        lockfile = file(self._lockpath, "a")
+        fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX)
+        return lockfile
+
+    def _read_index(self):
+        index = {"urls": {}, "blobs": {}}
+        if not os.path.exists(self._indexpath):
+            return index
+
+        try:
+            index.update(json.load(file(self._indexpath)))
+        except Exception:
+            logging.debug("Error reading URL cache index, starting fresh",
+                          exc_info=True)
+        return index
+
+    def _write_index(self, index):
+        (fd, tmpname) = tempfile.mkstemp(dir=self.cachedir,
+                                         prefix="index.json.")
+        f = os.fdopen(fd, "w")
+        try:
+            json.dump(index, f)
+        finally:
+            f.close()
+        os.rename(tmpname, self._indexpath)
+
+    def _drop_blob(self, index, digest):
+        index["blobs"].pop(digest, None)
+        for url, entry in index["urls"].items():
+            if entry["digest"] == digest:
+                del(index["urls"][url])
+        try:
+            os.unlink(self._blobpath(digest))
+        except OSError:
+            pass
+
+    def _evict(self, index):
+        blobs = index["blobs"]
+        total = sum([b["size"] for b in blobs.values()])
+        lru = sorted(blobs.keys(), key=lambda d: blobs[d]["atime"])
+
+        while total > self.maxsize and lru:
+            digest = lru.pop(0)
+            logging.debug("Evicting %s from URL cache", digest)
+            total -= blobs[digest]["size"]
+            self._drop_blob(index, digest)
+
+
+    ##############
+    # Public API #
+    ##############
+
+    def lookup(self, url):
+        """
+        Return the cache entry for url, a dict with etag, last_modified,
+        size and digest keys, or None if url isn't cached.
+        """
+        lockfile = self._lock()
+        try:
+            index = self._read_index()
+            entry = index["urls"].get(url)
+            if entry and not os.path.exists(self._blobpath(entry["digest"])):
+                self._drop_blob(index, entry["digest"])
+                self._write_index(index)
+                entry = None
+            return entry
+        finally:
+            lockfile.close()
+
+    def fetch(self, entry, scratchdir, prefix):
+        """
+        Make the cached contents for entry available as a new file in
+        scratchdir. The file is hardlinked if possible, copied otherwise.
+        Callers must not modify the returned file in place.
+
+        Returns None if the contents are gone, for example evicted by
+        another process since lookup(). The entry is dropped then.
+        """
+        lockfile = self._lock()
+        try:
+            index = self._read_index()
+            src = self._blobpath(entry["digest"])
+            if not os.path.exists(src):
+                self._drop_blob(index, entry["digest"])
+                self._write_index(index)
+                return None
+
+            blob = index["blobs"].get(entry["digest"])
+            if blob:
+                blob["atime"] = time.time()
+                self._write_index(index)
+
+            if not os.path.exists(scratchdir):
+                os.makedirs(scratchdir, 0750)
+            (fd, fn) = tempfile.mkstemp(prefix="virtinst-" + prefix,
+                                        dir=scratchdir)
+            os.close(fd)
+
+            try:
+                try:
+                    os.link(src, fn + ".link")
+                    os.rename(fn + ".link", fn)
+                except OSError:
+                    shutil.copyfile(src, fn)
+            except:
+                os.unlink(fn)
+                raise
+            return fn
+        finally:
+            lockfile.close()
+
+    def store(self, url, etag, last_modified, filename):
+        """
+        Add the downloaded file to the cache as the contents of url.
+        The server must have given us at least one of etag or
+        last_modified, otherwise we couldn't validate the cached copy.
+        """
+        if not etag and not last_modified:
+            return
+
+        size = os.path.getsize(filename)
+        if size > self.maxsize:
+            return
+
+        sha = hashlib.sha256()
+        f = file(filename, "rb")
+        try:
+            while True:
+                buff = f.read(1024 * 1024)
+                if not buff:
+                    break
+                sha.update(buff)
+        finally:
+            f.close()
+        digest = sha.hexdigest()
+
+        lockfile = self._lock()
+        try:
+            index = self._read_index()
+            if not os.path.exists(self._blobpath(digest)):
+                (fd, tmpname) = tempfile.mkstemp(dir=self._datadir,
+                                                 prefix=".new.")
+                os.close(fd)
+                try:
+                    try:
+                        os.link(filename, tmpname + ".link")
+                        os.rename(tmpname + ".link", tmpname)
+                    except OSError:
+                        # Cache is on a different filesystem
+                        shutil.copyfile(filename, tmpname)
+                    os.chmod(tmpname, 0444)
+                    os.rename(tmpname, self._blobpath(digest))
+                except:
+                    os.unlink(tmpname)
+                    raise
+
+            index["blobs"][digest] = {"size": size, "atime": time.time()}
+            index["urls"][url] = {"etag": etag,
+                                  "last_modified": last_modified,
+                                  "size": size,
+                                  "digest": digest}
+            logging.debug("Stored %s in URL cache as %s", url, digest)
+
+            self._evict(index)
+            self._write_index(index)
+        finally:
+            lockfile.close()
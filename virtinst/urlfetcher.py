@@ -21,18 +21,23 @@
 
 import ConfigParser
 import ftplib
+import httplib
 import logging
 import os
 import re
+import socket
 import stat
 import subprocess
 import tempfile
-import urllib2
+import urllib
 import urlparse
 
 import urlgrabber.grabber as grabber
 
 from virtinst import osdict
+from virtinst import util
+from virtinst import isoreader
+from virtinst.urlcache import URLCache
 
 
 #########################################################################
@@ -44,6 +49,9 @@ class _ImageFetcher(object):
     This is a generic base class for fetching/extracting files from
     a media source, such as CD ISO, NFS server, or HTTP/FTP server
     """
+    # How many times saveTemp will try to resume an interrupted download
+    _max_resume = 5
+
     def __init__(self, location, scratchdir, meter):
         self.location = location
         self.scratchdir = scratchdir
@@ -60,20 +68,49 @@ class _ImageFetcher(object):
 
         return path
 
-    def saveTemp(self, fileobj, prefix):
+    def saveTemp(self, fileobj, prefix, resume_cb=None):
+        """
+        Copy the contents of fileobj to a new file in the scratchdir.
+
+        If resume_cb is passed and reading fails partway through, it is
+        called with the number of bytes already written, and must return
+        a (fileobj, offset) tuple to continue reading from. offset is
+        where the new fileobj starts, which may be 0 if the source
+        can't resume.
+        """
         if not os.path.exists(self.scratchdir):
             os.makedirs(self.scratchdir, 0750)
         (fd, fn) = tempfile.mkstemp(prefix="virtinst-" + prefix,
                                     dir=self.scratchdir)
         block_size = 16384
+        offset = 0
+        retries = 0
         try:
-            while 1:
-                buff = fileobj.read(block_size)
-                if not buff:
-                    break
-                os.write(fd, buff)
-        finally:
-            os.close(fd)
+            try:
+                while 1:
+                    try:
+                        buff = fileobj.read(block_size)
+                    except (IOError, socket.error, httplib.HTTPException), e:
+                        if not resume_cb or retries >= self._max_resume:
+                            raise
+                        retries += 1
+                        logging.debug("Reading %s failed at offset %d: %s, "
+                                      "resuming (attempt %d)",
+                                      prefix, offset, str(e), retries)
+                        fileobj, offset = resume_cb(offset)
+                        os.lseek(fd, offset, os.SEEK_SET)
+                        os.ftruncate(fd, offset)
+                        continue
+
+                    if not buff:
+                        break
+                    os.write(fd, buff)
+                    offset += len(buff)
+            finally:
+                os.close(fd)
+        except:
+            os.unlink(fn)
+            raise
         return fn
 
     def prepareLocation(self):
@@ -124,13 +161,270 @@ class _URIImageFetcher(_ImageFetcher):
                               (self.location))
 
 
+class _HTTPResponseReader(object):
+    """
+    File-like wrapper around an httplib response. Tracks the absolute
+    offset into the remote file for progress reporting, and raises
+    IOError if the server closes the connection before sending the
+    full body, so saveTemp knows to resume.
+    """
+    def __init__(self, response, url, offset, size, meter):
+        self._response = response
+        self._meter = meter
+        self.url = url
+        self.pos = offset
+        self.size = size
+
+        self.etag = response.getheader("etag")
+        self.last_modified = response.getheader("last-modified")
+
+    def read(self, amt):
+        buff = self._response.read(amt)
+        if buff:
+            self.pos += len(buff)
+            self._meter.update(self.pos)
+        elif self.size is not None and self.pos < self.size:
+            raise IOError("Connection closed after %d of %d bytes" %
+                          (self.pos, self.size))
+        return buff
+
+    def close(self):
+        self._response.close()
+
+
 class _HTTPImageFetcher(_URIImageFetcher):
+    """
+    Fetcher for http:// and https:// install trees. A single keep-alive
+    connection per server is reused for every probe and download, and
+    interrupted downloads are resumed with Range requests.
+
+    Downloaded files are kept in a URLCache, and served from there
+    when the server confirms they haven't changed. Set cache to None
+    to disable this.
+    """
+    _max_redirects = 10
+
+    def __init__(self, *args, **kwargs):
+        _URIImageFetcher.__init__(self, *args, **kwargs)
+
+        # Open connections, keyed by (scheme, netloc)
+        self._conns = {}
+
+        self.cache = URLCache(os.path.join(util.get_cache_dir(), "urlcache"))
+
+    def _get_conn(self, scheme, netloc):
+        key = (scheme, netloc)
+        if key in self._conns:
+            return self._conns[key]
+
+        proxy = None
+        proxies = urllib.getproxies()
+        if proxies.get(scheme) and not urllib.proxy_bypass(netloc):
+            proxy = urlparse.urlparse(proxies[scheme])[1]
+
+        if scheme == "https":
+            conn = httplib.HTTPSConnection(proxy or netloc)
+            if proxy:
+                conn.set_tunnel(netloc)
+        else:
+            conn = httplib.HTTPConnection(proxy or netloc)
+
+        # Absolute request URIs are only needed for plain http proxies
+        conn.virtinst_absolute = bool(proxy and scheme == "http")
+        logging.debug("Opening HTTP connection to %s%s", netloc,
+                      proxy and (" via proxy %s" % proxy) or "")
+        self._conns[key] = conn
+        return conn
+
+    def _drop_conn(self, scheme, netloc):
+        conn = self._conns.pop((scheme, netloc), None)
+        if conn:
+            conn.close()
+
+    def _request(self, method, url, headers=None):
+        """
+        Issue a request over the pooled connection, following redirects.
+        Returns (response, final_url). The caller must read the response
+        body completely before making another request.
+        """
+        headers = dict(headers or {})
+        headers["Connection"] = "keep-alive"
+
+        for ignore in range(self._max_redirects):
+            scheme, netloc, path, query, ignore = urlparse.urlsplit(url)
+            reqpath = path or "/"
+            if query:
+                reqpath += "?" + query
+
+            # A kept-alive connection may have been closed by the server
+            # since we last used it: retry once on a fresh connection
+            for attempt in [1, 2]:
+                conn = self._get_conn(scheme, netloc)
+                try:
+                    conn.request(method,
+                                 conn.virtinst_absolute and url or reqpath,
+                                 headers=headers)
+                    response = conn.getresponse()
+                    break
+                except (socket.error, httplib.HTTPException):
+                    self._drop_conn(scheme, netloc)
+                    if attempt == 2:
+                        raise
+
+            location = response.getheader("location")
+            if response.status in [301, 302, 303, 307, 308] and location:
+                response.read()
+                if response.will_close:
+                    self._drop_conn(scheme, netloc)
+                url = urlparse.urljoin(url, location)
+                logging.debug("HTTP redirected to %s", url)
+                if response.status == 303:
+                    method = "GET"
+                continue
+
+            if response.will_close:
+                # Server won't keep this connection alive. Forget it,
+                # but leave it open so the body can still be read
+                self._conns.pop((scheme, netloc), None)
+            return response, url
+
+        raise ValueError(_("Too many redirects fetching %s") % url)
+
+    def _open(self, url, offset, headers=None):
+        """
+        GET url starting from byte offset. Returns a _HTTPResponseReader
+        whose pos is where the response body actually starts (the
+        server may ignore our Range header), or None if a conditional
+        request returned 304 Not Modified.
+        """
+        headers = dict(headers or {})
+        if offset:
+            headers["Range"] = "bytes=%d-" % offset
+
+        response, url = self._request("GET", url, headers)
+        if response.status == 304:
+            response.read()
+            return None
+
+        if response.status == 206:
+            # Content-Range: bytes start-end/total
+            crange = response.getheader("content-range") or ""
+            match = re.match(r"bytes (\d+)-\d+/(\d+|\*)", crange)
+            if not match:
+                response.close()
+                raise IOError("Invalid Content-Range '%s'" % crange)
+            start, total = match.groups()
+            size = total != "*" and int(total) or None
+            return _HTTPResponseReader(response, url, int(start), size,
+                                       self.meter)
+
+        if response.status != 200:
+            response.read()
+            raise IOError("HTTP Error %d: %s" %
+                          (response.status, response.reason))
+
+        length = response.getheader("content-length")
+        size = length and int(length) or None
+        return _HTTPResponseReader(response, url, 0, size, self.meter)
+
+    def _abort(self, reader):
+        # The connection still has unread body data queued, so it
+        # can't be reused for another request
+        reader.close()
+        self._drop_conn(*urlparse.urlsplit(reader.url)[:2])
+
+    def cleanupLocation(self):
+        for scheme, netloc in self._conns.keys():
+            self._drop_conn(scheme, netloc)
+
+    def acquireFile(self, filename):
+        path = self._make_path(filename)
+        base = os.path.basename(filename)
+        logging.debug("Fetching URI: %s", path)
+
+        entry = None
+        headers = {}
+        if self.cache:
+            try:
+                entry = self.cache.lookup(path)
+            except Exception:
+                logging.debug("Error looking up %s in URL cache", path,
+                              exc_info=True)
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        def open_reader(reqheaders):
+            try:
+                return self._open(path, 0, reqheaders)
+            except Exception, e:
+                raise ValueError(_("Couldn't acquire file %s: %s") %
+                                   (path, str(e)))
+
+        reader = open_reader(headers)
+        if reader is None:
+            tmpname = None
+            try:
+                tmpname = self.cache.fetch(entry, self.scratchdir,
+                                           base + ".")
+            except Exception:
+                logging.debug("Error fetching %s from URL cache", path,
+                              exc_info=True)
+            if tmpname:
+                logging.debug("Using cached copy of %s, saved to %s",
+                              path, tmpname)
+                return tmpname
+
+            # The cached copy went away after we looked it up, so
+            # download it again, unconditionally this time
+            logging.debug("Cached copy of %s is gone, downloading it", path)
+            reader = open_reader({})
+
+        readers = [reader]
+
+        def resume_cb(pos):
+            self._abort(readers[0])
+            # Only resume if the file hasn't changed under us
+            validator = reader.etag or reader.last_modified
+            readers[0] = self._open(path, pos,
+                                    validator and {"If-Range": validator})
+            if readers[0].pos != pos:
+                logging.debug("Server ignored Range request, "
+                              "restarting download from %d", readers[0].pos)
+            return readers[0], readers[0].pos
+
+        self.meter.start(filename=path, url=path, basename=base,
+                         size=reader.size,
+                         text=_("Retrieving file %s...") % base)
+        try:
+            tmpname = self.saveTemp(reader, prefix=base + ".",
+                                    resume_cb=resume_cb)
+        except:
+            self._abort(readers[0])
+            raise
+        readers[0].close()
+        self.meter.end(readers[0].pos)
+        logging.debug("Saved file to " + tmpname)
+
+        if self.cache:
+            try:
+                self.cache.store(path, readers[0].etag,
+                                 readers[0].last_modified, tmpname)
+            except Exception:
+                logging.debug("Error storing %s in URL cache", path,
+                              exc_info=True)
+        return tmpname
+
     def hasFile(self, filename):
+        path = self._make_path(filename)
         try:
-            path = self._make_path(filename)
-            request = urllib2.Request(path)
-            request.get_method = lambda: "HEAD"
-            urllib2.urlopen(request)
+            response = self._request("HEAD", path)[0]
+            response.read()
+            if response.status != 200:
+                raise IOError("HTTP Error %d: %s" %
+                              (response.status, response.reason))
         except Exception, e:
             logging.debug("HTTP hasFile: didn't find %s: %s", path, str(e))
             return False
@@ -217,6 +511,73 @@ class _MountedImageFetcher(_LocalImageFetcher):
             pass
 
 
+class _ISOFileReader(object):
+    """
+    File-like wrapper around an isoreader.ISOFile, reporting progress
+    to the meter as the file is copied out
+    """
+    def __init__(self, isofile, meter):
+        self._isofile = isofile
+        self._meter = meter
+        self.pos = 0
+
+    def read(self, amt):
+        buff = self._isofile.read(amt)
+        if buff:
+            self.pos += len(buff)
+            self._meter.update(self.pos)
+        return buff
+
+
+class _ISOImageFetcher(_ImageFetcher):
+    """
+    Fetcher which reads files straight out of an ISO image or CDROM
+    device, so it doesn't need to be mounted.
+    """
+    def __init__(self, *args, **kwargs):
+        _ImageFetcher.__init__(self, *args, **kwargs)
+
+        self._iso = None
+
+    def prepareLocation(self):
+        try:
+            self._iso = isoreader.ISOReader(self.location)
+        except (IOError, ValueError), e:
+            raise ValueError(_("Opening ISO image '%s' failed: %s") %
+                             (self.location, str(e)))
+        return True
+
+    def cleanupLocation(self):
+        if self._iso:
+            self._iso.close()
+            self._iso = None
+
+    def acquireFile(self, filename):
+        base = os.path.basename(filename)
+        logging.debug("Extracting %s from ISO %s", filename, self.location)
+
+        try:
+            isofile = self._iso.open(filename)
+        except IOError, e:
+            raise ValueError(_("Couldn't acquire file %s: %s") %
+                               (filename, str(e)))
+
+        self.meter.start(filename=filename, basename=base, size=isofile.size,
+                         text=_("Retrieving file %s...") % base)
+        tmpname = self.saveTemp(_ISOFileReader(isofile, self.meter),
+                                prefix=base + ".")
+        self.meter.end(isofile.size)
+
+        logging.debug("Saved file to " + tmpname)
+        return tmpname
+
+    def hasFile(self, filename):
+        if self._iso.exists(filename):
+            return True
+        logging.debug("ISO hasFile: Couldn't find %s", filename)
+        return False
+
+
 class _DirectImageFetcher(_LocalImageFetcher):
     def prepareLocation(self):
         self.srcdir = self.location
@@ -232,6 +593,8 @@ def fetcherForURI(uri, *args, **kwargs):
     else:
         if os.path.isdir(uri):
             fclass = _DirectImageFetcher
+        elif isoreader.is_iso(uri):
+            fclass = _ISOImageFetcher
         else:
             fclass = _MountedImageFetcher
     return fclass(uri, *args, **kwargs)
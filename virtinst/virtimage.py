@@ -19,8 +19,11 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 # MA 02110-1301 USA.
 
+import hashlib
+import json
 import logging
 import os
+import threading
 
 import urlgrabber
 
@@ -29,6 +32,10 @@ from virtinst import Installer
 from virtinst import VirtualDisk
 from virtinst import util
 
+# Read buffer size and number of threads for checking disk signatures
+_HASH_BUFSIZE = 4 * 1024 * 1024
+_HASH_WORKERS = 4
+
 
 class Image(object):
     """The toplevel object representing a VM image"""
@@ -245,54 +252,219 @@ class Disk(object):
                  _("The format for disk %s must be one of %s") %
                  (self.file, ",".join(formats)))
 
+    def _get_checksum_type(self):
+        for csumtype in ["sha256", "sha1"]:
+            if csumtype in self.csum:
+                return csumtype
+        return None
+
     def check_disk_signature(self, meter=None):
+        verify_disk_signatures([self], meter=meter)
+
+
+class _DigestCache(object):
+    """
+    Remembers the digests of disk images we have already hashed, keyed
+    by path, so re-importing an unchanged image doesn't need to read it
+    again. An entry is only used if the file's size, mtime and inode
+    still match, and stale entries are dropped when the cache is saved.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+
         try:
-            import hashlib
-            sha = None
-        except:
-            import sha
-            hashlib = None
-
-        if meter is None:
-            meter = urlgrabber.progress.BaseMeter()
-
-        m = None
-        if hashlib:
-            if "sha256" in self.csum:
-                csumvalue = self.csum["sha256"]
-                m = hashlib.sha256()  # pylint: disable-msg=E1101
-
-            elif "sha1" in self.csum:
-                csumvalue = self.csum["sha1"]
-                m = hashlib.sha1()
-        else:
-            if "sha1" in self.csum:
-                csumvalue = self.csum["sha1"]
-                m = sha.new()
-
-        if not m:
-            return
-
-        meter_ct = 0
-        disk_size = os.path.getsize(self.file)
-        meter.start(size=disk_size,
-                    text=_("Checking disk signature for %s" % self.file))
-
-        f = file(self.file)
-        while 1:
-            chunk = f.read(65536)
-            if not chunk:
+            if os.path.exists(self.path):
+                f = file(self.path)
+                try:
+                    self._entries = json.load(f)
+                finally:
+                    f.close()
+        except Exception:
+            logging.debug("Error reading disk digest cache %s",
+                          self.path, exc_info=True)
+
+    def _key(self, path):
+        st = os.stat(path)
+        return (os.path.realpath(path),
+                [st.st_size, st.st_mtime, st.st_ino])
+
+    def lookup(self, path, csumtype):
+        realpath, stamp = self._key(path)
+        entry = self._entries.get(realpath)
+        if not entry or entry["stamp"] != stamp:
+            return None
+        return entry["digests"].get(csumtype)
+
+    def add(self, path, csumtype, digest):
+        realpath, stamp = self._key(path)
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(realpath)
+            if not entry or entry["stamp"] != stamp:
+                entry = {"stamp": stamp, "digests": {}}
+                self._entries[realpath] = entry
+            entry["digests"][csumtype] = digest
+        finally:
+            self._lock.release()
+
+    def _prune(self):
+        """
+        Drop entries for files that are gone or have changed since they
+        were hashed, so the cache doesn't grow forever
+        """
+        for realpath, entry in self._entries.items():
+            try:
+                stamp = self._key(realpath)[1]
+            except OSError:
+                stamp = None
+            if entry["stamp"] != stamp:
+                del(self._entries[realpath])
+
+    def save(self):
+        try:
+            self._lock.acquire()
+            try:
+                self._prune()
+            finally:
+                self._lock.release()
+
+            dirname = os.path.dirname(self.path)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname, 0700)
+            tmpname = self.path + ".new"
+            f = file(tmpname, "w")
+            try:
+                json.dump(self._entries, f)
+            finally:
+                f.close()
+            os.rename(tmpname, self.path)
+        except Exception:
+            logging.debug("Error saving disk digest cache %s",
+                          self.path, exc_info=True)
+
+
+def _hash_file(path, csumtype, progress_cb):
+    m = hashlib.new(csumtype)
+    buf = bytearray(_HASH_BUFSIZE)
+    view = memoryview(buf)
+
+    f = file(path, "rb")
+    try:
+        while True:
+            count = f.readinto(buf)
+            if not count:
                 break
-            meter.update(meter_ct)
-            meter_ct = meter_ct + 65536
-            m.update(chunk)
-        checksum = m.hexdigest()
-        if checksum != csumvalue:
-            logging.debug(_("Disk signature for %s does not match "
-                            "Expected: %s  Received: %s" % (self.file,
-                             csumvalue, checksum)))
-            raise ValueError(_("Disk signature for %s does not "
-                               "match" % self.file))
+            # hashlib drops the GIL for big updates, so several disks
+            # can be hashed in parallel
+            m.update(view[:count])
+            progress_cb(count)
+    finally:
+        f.close()
+    return m.hexdigest()
+
+
+def verify_disk_signatures(disks, meter=None, cachefile=None, workers=None):
+    """
+    Check the checksum of every passed Disk that has one, raising
+    ValueError on the first mismatch. Disks are hashed in parallel by
+    up to 'workers' threads, reporting combined progress to meter.
+
+    Digests are remembered in cachefile (by default in the user's
+    cache dir), and files whose size, mtime and inode haven't changed
+    since are not hashed again. Pass cachefile="" to disable this.
+    """
+    if meter is None:
+        meter = urlgrabber.progress.BaseMeter()
+    if cachefile is None:
+        cachefile = os.path.join(util.get_cache_dir(), "image-digests.json")
+    cache = cachefile and _DigestCache(cachefile) or None
+
+    todo = []
+    for disk in disks:
+        csumtype = disk._get_checksum_type()
+        if not csumtype:
+            continue
+
+        digest = cache and cache.lookup(disk.file, csumtype)
+        if digest:
+            logging.debug("Using cached %s digest for %s",
+                          csumtype, disk.file)
+            _check_digest(disk, csumtype, digest)
+            continue
+        todo.append((disk, csumtype))
+
+    if not todo:
+        return
+
+    lock = threading.Lock()
+    state = {"read": 0, "results": {}}
+    queue = todo[:]
+
+    def progress_cb(count):
+        lock.acquire()
+        state["read"] += count
+        lock.release()
+
+    def worker():
+        while True:
+            lock.acquire()
+            try:
+                if not queue:
+                    return
+                disk, csumtype = queue.pop(0)
+            finally:
+                lock.release()
+
+            try:
+                result = _hash_file(disk.file, csumtype, progress_cb)
+            except Exception, e:
+                result = e
+            state["results"][disk.file] = result
+
+    total = sum([os.path.getsize(disk.file) for disk, ignore in todo])
+    if len(todo) == 1:
+        text = _("Checking disk signature for %s") % todo[0][0].file
+    else:
+        text = _("Checking disk signatures for %d disks") % len(todo)
+    meter.start(size=total, text=text)
+
+    threads = []
+    for ignore in range(min(workers or _HASH_WORKERS, len(todo))):
+        thread = threading.Thread(target=worker,
+                                  name="Checking disk signatures")
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    # Only this thread touches the meter
+    while [t for t in threads if t.is_alive()]:
+        threads[0].join(.1)
+        meter.update(state["read"])
+    meter.end(total)
+
+    try:
+        for disk, csumtype in todo:
+            result = state["results"][disk.file]
+            if isinstance(result, Exception):
+                raise result
+            if cache:
+                cache.add(disk.file, csumtype, result)
+            _check_digest(disk, csumtype, result)
+    finally:
+        if cache:
+            cache.save()
+
+
+def _check_digest(disk, csumtype, checksum):
+    csumvalue = disk.csum[csumtype]
+    if checksum != csumvalue:
+        logging.debug(_("Disk signature for %s does not match "
+                        "Expected: %s  Received: %s" % (disk.file,
+                         csumvalue, checksum)))
+        raise ValueError(_("Disk signature for %s does not "
+                           "match" % disk.file))
 
 
 def validate(cond, msg):